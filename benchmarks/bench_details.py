@@ -0,0 +1,84 @@
+"""Micro-benchmark of details symptom matching.
+
+Run with the benchmark suite (see benchmarks/conftest.py).
+"""
+
+import json
+import random
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
+
+import pytest
+from corpus import make_details
+from jsonpath_ng import parse as jsonpath
+
+from webcompat.models import Report
+from webcompat.symptoms import DetailsSymptom, compile_jsonpath
+
+PATHS = (
+    "$.tabInfo.antitracking.blockList",
+    "$.tabInfo.frameworks.fastclick",
+    "$.tabInfo.languages[0]",
+    "$.browserInfo.addons[*].id",
+)
+
+
+@pytest.fixture(scope="module")
+def all_details():
+    rnd = random.Random(1)
+    return [make_details(rnd) for _ in range(1000)]
+
+
+@pytest.mark.parametrize("impl", ("jsonpath_ng", "compiled"))
+def test_details_path(benchmark, all_details, impl):
+    """find the values of a few paths in each details blob"""
+    exprs = [jsonpath(path) for path in PATHS]
+    if impl == "compiled":
+        finders = [compile_jsonpath(expr) for expr in exprs]
+    else:
+        finders = [
+            lambda data, expr=expr: [match.value for match in expr.find(data)]
+            for expr in exprs
+        ]
+
+    def run():
+        for details in all_details:
+            for find in finders:
+                find(details)
+
+    benchmark(run)
+
+
+@pytest.mark.parametrize("impl", ("uncached", "cached"))
+def test_details_whole(benchmark, all_details, impl):
+    """match three symptoms without path against each report"""
+    symptoms = [
+        DetailsSymptom({"type": "details", "pattern": pattern})
+        for pattern in (".*strict", ".*fastclick.: true", ".*Defender")
+    ]
+    reports = [
+        Report(
+            app_name="Firefox",
+            app_version="131.0",
+            comments="",
+            details=details,
+            os="Linux",
+            reported_at=datetime(2024, 1, 1, tzinfo=timezone.utc),
+            uuid=str(idx),
+            url=urlsplit("https://example.com/"),
+        )
+        for idx, details in enumerate(all_details)
+    ]
+
+    def run():
+        for report in reports:
+            if impl == "uncached":
+                # serialize the details once per symptom, like before caching
+                for symptom in symptoms:
+                    symptom.matcher.matches(json.dumps(report.details))
+            else:
+                report.__dict__.pop("details_json", None)
+                for symptom in symptoms:
+                    symptom.matches(report)
+
+    benchmark(run)
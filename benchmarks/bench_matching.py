@@ -0,0 +1,61 @@
+"""Benchmarks of the webcompat matching engine."""
+
+import pytest
+
+from webcompat.models import ReportBatch, Signature
+
+SYMPTOMS = {
+    "hostname": '{"type": "url", "part": "hostname", "value": "www.site0.com"}',
+    "url_pattern": '{"type": "url", "pattern": "https://[^/]*/search"}',
+    "comments_pattern": '{"type": "comments", "pattern": ".*video"}',
+    "details_path": (
+        '{"type": "details", "path": "$.tabInfo.antitracking.blockList",'
+        ' "value": "strict"}'
+    ),
+    "details_pattern": '{"type": "details", "pattern": ".*\\"fastclick\\": true"}',
+    "reported_at": (
+        '{"type": "reported_at", "after": "2024-01-05T00:00:00",'
+        ' "before": "2024-01-06T00:00:00"}'
+    ),
+}
+
+
+@pytest.mark.parametrize("kind", SYMPTOMS)
+def test_match_single(benchmark, reports, kind):
+    """match a signature of one symptom against each report"""
+    signature = Signature(f'{{"symptoms": [{SYMPTOMS[kind]}]}}')
+
+    def run():
+        for report in reports:
+            signature.matches(report)
+
+    benchmark(run)
+
+
+@pytest.mark.parametrize("kind", SYMPTOMS)
+def test_match_batch(benchmark, reports, kind):
+    """match a signature of one symptom against a batch of all reports"""
+    signature = Signature(f'{{"symptoms": [{SYMPTOMS[kind]}]}}')
+    benchmark(lambda: signature.match_batch(ReportBatch(reports)))
+
+
+def test_match_signatures_single(benchmark, reports, signatures):
+    """match mixed signatures against each report"""
+
+    def run():
+        for signature in signatures:
+            for report in reports:
+                signature.matches(report)
+
+    benchmark(run)
+
+
+def test_match_signatures_batch(benchmark, reports, signatures):
+    """match mixed signatures against a batch of all reports"""
+
+    def run():
+        batch = ReportBatch(reports)
+        for signature in signatures:
+            signature.match_batch(batch)
+
+    benchmark(run)
@@ -0,0 +1,81 @@
+"""Benchmarks of loading reports from their serialized form, as the server does
+for matching.
+
+The memory used per report is recorded in the extra info of each benchmark.
+"""
+
+import json
+import tracemalloc
+from urllib.parse import urlsplit
+
+import pytest
+from dateutil.parser import isoparse
+
+from webcompat.models import LazyReport, Report, ReportBatch, Signature
+
+HOSTNAME_SIGNATURE = (
+    '{"symptoms": [{"type": "url", "part": "hostname", "value": "www.site0.com"}]}'
+)
+
+
+@pytest.fixture(scope="module")
+def rows(reports):
+    """Report fields as they are loaded from the database"""
+    return [
+        {
+            "app_name": report.app_name,
+            "app_channel": report.app_channel,
+            "app_version": report.app_version,
+            "breakage_category": report.breakage_category,
+            "comments": report.comments,
+            "details_text": json.dumps(report.details),
+            "os": report.os,
+            "reported_at": report.reported_at.isoformat(),
+            "url": report.url.geturl(),
+            "uuid": report.uuid,
+        }
+        for report in reports
+    ]
+
+
+def load_eager(rows):
+    result = []
+    for row in rows:
+        fields = dict(row)
+        fields["details"] = json.loads(fields.pop("details_text"))
+        fields["reported_at"] = isoparse(fields["reported_at"])
+        fields["url"] = urlsplit(fields["url"])
+        result.append(Report(**fields))
+    return result
+
+
+def load_lazy(rows):
+    return [LazyReport(**row) for row in rows]
+
+
+def load_lazy_url(rows):
+    # only the fields used by a hostname signature, like ReportEntry.load_reports
+    return [LazyReport(url=row["url"]) for row in rows]
+
+
+LOADERS = {"eager": load_eager, "lazy": load_lazy, "lazy_url": load_lazy_url}
+
+
+@pytest.mark.parametrize("loader", LOADERS)
+def test_load_match(benchmark, rows, loader):
+    """load all reports and match a hostname signature against them"""
+    load = LOADERS[loader]
+    signature = Signature(HOSTNAME_SIGNATURE)
+
+    def run():
+        return signature.match_batch(ReportBatch(load(rows)))
+
+    benchmark(run)
+
+    tracemalloc.start()
+    loaded = load(rows)
+    signature.match_batch(ReportBatch(loaded))
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    benchmark.extra_info["bytes_per_report"] = size // len(rows)
+    benchmark.extra_info["peak_bytes_per_report"] = peak // len(rows)
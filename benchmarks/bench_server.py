@@ -0,0 +1,164 @@
+"""Benchmarks of triage, reassign and import in the server.
+
+The database is the one of the test settings (an in-memory SQLite database by
+default), so results are only comparable between runs with the same settings.
+"""
+
+import tracemalloc
+from datetime import timedelta
+
+import pytest
+
+pytest.importorskip("pytest_django")
+
+from corpus import BEGIN, make_reports, make_signatures  # noqa: E402
+from django.core.cache import cache  # noqa: E402
+from django.core.management import call_command  # noqa: E402
+from rest_framework.request import Request  # noqa: E402
+from rest_framework.test import APIRequestFactory  # noqa: E402
+
+from reportmanager.importer import KNOWN_BUCKET_IDS, ReportImporter  # noqa: E402
+from reportmanager.models import (  # noqa: E402
+    APP_CACHE,
+    BREAKAGE_CATEGORY_CACHE,
+    OS_CACHE,
+    Bucket,
+    ReportEntry,
+)
+from reportmanager.reassign import ReassignMatcher  # noqa: E402
+from reportmanager.triage import BulkTriage  # noqa: E402
+from reportmanager.views import BucketViewSet, ReportStatsViewSet  # noqa: E402
+
+# entries are committed so the dimension caches are used like in production
+pytestmark = pytest.mark.django_db(transaction=True)
+
+
+@pytest.fixture(autouse=True)
+def _clear_caches():
+    # the database is flushed after each benchmark, cached ids become invalid
+    yield
+    for dimension_cache in (APP_CACHE, BREAKAGE_CATEGORY_CACHE, OS_CACHE):
+        dimension_cache.clear()
+    KNOWN_BUCKET_IDS.clear()
+
+
+def _import(count, seed=0):
+    ReportImporter().import_reports(make_reports(count, seed=seed))
+
+
+@pytest.mark.parametrize("n_buckets", (100, 1000))
+def test_triage(benchmark, n_buckets):
+    """triage 1000 entries against n_buckets signature buckets (and a hostname
+    bucket per host)
+    """
+    for signature in make_signatures(n_buckets, seed=1):
+        Bucket.objects.create(description="bench", signature=signature.raw_signature)
+    _import(1000)
+
+    def setup():
+        ReportEntry.objects.update(bucket=None)
+
+    # the warmup round creates buckets for entries not matching any
+    benchmark.pedantic(
+        lambda: BulkTriage().run(), setup=setup, rounds=5, warmup_rounds=1
+    )
+
+
+@pytest.mark.parametrize("n_entries", (1000, 4000))
+def test_reassign_preview(benchmark, n_entries):
+    """preview the reassignment of n_entries to a new bucket"""
+    _import(n_entries)
+    bucket = Bucket.objects.create(
+        description="bench",
+        priority=1,
+        signature='{"symptoms": [{"type": "comments", "pattern": ".*video"}]}',
+    )
+    benchmark.pedantic(lambda: bucket.reassign(False), rounds=5)
+
+
+@pytest.mark.parametrize("n_entries", (1000, 4000))
+def test_reassign_match(benchmark, n_entries):
+    """match n_entries for the reassignment to a new bucket"""
+    _import(n_entries)
+    bucket = Bucket.objects.create(
+        description="bench",
+        priority=1,
+        signature='{"symptoms": [{"type": "comments", "pattern": ".*video"}]}',
+    )
+    entry_ids = list(ReportEntry.objects.values_list("id", flat=True))
+    matcher = ReassignMatcher(workers=1)
+    benchmark.pedantic(
+        lambda: matcher.match(bucket.get_signature(), bucket.pk, entry_ids), rounds=5
+    )
+
+
+@pytest.mark.parametrize("n_entries", (1000, 4000))
+def test_optimize(benchmark, n_entries):
+    """optimize the signature of a bucket for n_entries unbucketed entries (all
+    matching it, so all are scanned)
+    """
+    _import(n_entries)
+    ReportEntry.objects.update(bucket=None)
+    bucket = Bucket.objects.create(
+        description="bench",
+        signature='{"symptoms": [{"type": "url", "pattern": "https://"}]}',
+    )
+    entries = ReportEntry.objects.filter(bucket=None).order_by("-id")
+    benchmark.pedantic(lambda: bucket.optimize_signature(entries.all()), rounds=3)
+
+    # should not depend on n_entries
+    tracemalloc.start()
+    bucket.optimize_signature(entries.all())
+    benchmark.extra_info["peak_bytes"] = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+
+def test_report_stats(benchmark, mocker):
+    """compute the report statistics for 4000 entries (without the cache)"""
+    _import(4000)
+    # the end of the corpus
+    mocker.patch("django.utils.timezone.now", return_value=BEGIN + timedelta(days=30))
+    view = ReportStatsViewSet()
+    benchmark.pedantic(
+        lambda: view.retrieve(None), setup=cache.clear, rounds=5, warmup_rounds=1
+    )
+
+
+@pytest.mark.parametrize("resolution", ("hour", "day", "week"))
+def test_report_history(benchmark, mocker, resolution):
+    """fetch the report history of a page of 100 buckets"""
+    _import(4000)
+    mocker.patch("django.utils.timezone.now", return_value=BEGIN + timedelta(days=30))
+    view = BucketViewSet()
+    view.request = Request(APIRequestFactory().get("/", {"resolution": resolution}))
+    bucket_ids = list(Bucket.objects.values_list("pk", flat=True)[:100])
+    history = benchmark(view.get_report_history, bucket_ids)
+    benchmark.extra_info["points"] = sum(len(hits) for hits in history.values())
+
+
+def test_cleanup(benchmark, mocker):
+    """delete 2000 expired report entries"""
+    seeds = iter(range(1, 100))
+    # all entries of the corpus are expired
+    mocker.patch("django.utils.timezone.now", return_value=BEGIN + timedelta(days=60))
+    benchmark.pedantic(
+        call_command,
+        args=("cleanup_old_reports",),
+        kwargs={"leave_empty_buckets": True},
+        setup=lambda: _import(2000, seed=next(seeds)),
+        rounds=5,
+    )
+    assert not ReportEntry.objects.exists()
+
+
+def test_import(benchmark):
+    """import 1000 new reports"""
+    seeds = iter(range(1, 100))
+    # the warmup round creates the buckets and fills the caches
+    benchmark.pedantic(
+        _import,
+        setup=lambda: ((1000,), {"seed": next(seeds)}),
+        rounds=5,
+        warmup_rounds=1,
+    )
+    benchmark.extra_info["reports_per_round"] = 1000
@@ -0,0 +1,88 @@
+"""Compare pytest-benchmark results with a baseline.
+
+usage: python benchmarks/compare.py BASELINE RESULTS [--threshold RATIO]
+       python benchmarks/compare.py --update BASELINE RESULTS
+
+Prints the ratio of the mean time of each benchmark to its baseline. With
+--threshold, exits with an error if any benchmark is slower than RATIO times
+its baseline. With --update, the baseline is replaced by the results, keeping
+only the name, mean, stddev and extra_info of each benchmark (without the
+machine info and the times of each round).
+"""
+
+import argparse
+import json
+import sys
+
+
+def load_benchmarks(path):
+    """Load the results of a --benchmark-json file, or of a baseline
+
+    @rtype: list
+    @return: {"fullname", "mean", "stddev", "extra_info"} for each benchmark
+    """
+    with open(path) as json_fd:
+        data = json.load(json_fd)
+    return [
+        {
+            "fullname": bench["fullname"],
+            "mean": bench["stats"]["mean"] if "stats" in bench else bench["mean"],
+            "stddev": (
+                bench["stats"]["stddev"] if "stats" in bench else bench["stddev"]
+            ),
+            "extra_info": bench.get("extra_info", {}),
+        }
+        for bench in data["benchmarks"]
+    ]
+
+
+def load_means(path):
+    return {bench["fullname"]: bench["mean"] for bench in load_benchmarks(path)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("baseline", help="baseline JSON file")
+    parser.add_argument("results", help="results JSON file (--benchmark-json)")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        help="fail if a benchmark is slower than this ratio to its baseline",
+    )
+    parser.add_argument(
+        "--update",
+        action="store_true",
+        help="replace the baseline by the results instead of comparing them",
+    )
+    args = parser.parse_args(argv)
+
+    if args.update:
+        benchmarks = sorted(load_benchmarks(args.results), key=lambda b: b["fullname"])
+        with open(args.baseline, "w") as json_fd:
+            json.dump({"benchmarks": benchmarks}, json_fd, indent=2, sort_keys=True)
+            json_fd.write("\n")
+        return 0
+
+    baseline = load_means(args.baseline)
+    results = load_means(args.results)
+    width = max(map(len, results), default=0)
+    slower = []
+    for name, mean in sorted(results.items()):
+        if name not in baseline:
+            print(f"{name:<{width}}  {mean * 1000:10.3f}ms  (new)")
+            continue
+        ratio = mean / baseline[name]
+        print(f"{name:<{width}}  {mean * 1000:10.3f}ms  {ratio:6.2f}x")
+        if args.threshold is not None and ratio > args.threshold:
+            slower.append(name)
+    for name in sorted(set(baseline) - set(results)):
+        print(f"{name:<{width}}  (missing)")
+
+    if slower:
+        print(f"{len(slower)} benchmarks slower than {args.threshold}x the baseline")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,33 @@
+"""Benchmarks of signature matching, triage and import.
+
+The benchmarks use pytest-benchmark, and the server benchmarks pytest-django.
+They are not collected by a normal test run, use `tox -e benchmark`, or:
+
+    pytest benchmarks -o python_files="bench_*.py" --no-cov
+
+The tox environment compares the results with benchmarks/baseline.json, see
+benchmarks/README.md to update it.
+"""
+
+import logging
+
+import pytest
+from corpus import make_reports, make_signatures
+
+
+@pytest.fixture(autouse=True, scope="session")
+def _disable_debug_logging():
+    # debug logging (enabled in pyproject.toml) would dominate matching time
+    logging.disable(logging.DEBUG)
+    yield
+    logging.disable(logging.NOTSET)
+
+
+@pytest.fixture(scope="session")
+def reports():
+    return make_reports(1000)
+
+
+@pytest.fixture(scope="session")
+def signatures():
+    return make_signatures(200)
@@ -0,0 +1,157 @@
+"""Seeded generator of synthetic reports and signatures for the benchmarks.
+
+The same seed always gives the same corpus, so results of different runs can be
+compared.
+"""
+
+import json
+import random
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlsplit
+
+from webcompat.models import Report, Signature
+
+BEGIN = datetime(2024, 1, 1, tzinfo=timezone.utc)
+N_HOSTS = 500
+HOSTS = [
+    f"{('www.', '', 'm.', 'shop.')[n % 4]}site{n}.{('com', 'org', 'de', 'fr')[n % 3]}"
+    for n in range(N_HOSTS)
+]
+PATHS = ["/", "/index.html", "/search", "/watch", "/cart/checkout", "/login"]
+WORDS = [
+    "video",
+    "doesn't",
+    "play",
+    "page",
+    "blank",
+    "login",
+    "button",
+    "broken",
+    "layout",
+    "slow",
+    "popup",
+    "scroll",
+]
+OSES = ["Linux", "Mac", "Windows", "Android"]
+CATEGORIES = [None, "account_signin", "checkout", "media", "page_not_loading"]
+
+
+def make_host(rnd):
+    # a few hosts get most reports
+    return HOSTS[min(int(rnd.expovariate(1 / 40)), N_HOSTS - 1)]
+
+
+def make_details(rnd):
+    """Details shaped like those of a Firefox broken site report"""
+    return {
+        "browserInfo": {
+            "addons": [
+                {"id": f"addon{n}@example.com", "name": f"Addon {n}"}
+                for n in range(rnd.randint(0, 5))
+            ],
+            "app": {
+                "defaultLocales": ["en-US", "en"],
+                "defaultUseragentString": "Mozilla/5.0 (X11; Linux x86_64; rv:131.0)",
+                "fissionEnabled": True,
+            },
+            "graphics": {
+                "devicePixelRatio": rnd.choice((1, 1.5, 2)),
+                "hasTouchScreen": rnd.random() < 0.3,
+                "monitors": [{"screenWidth": 1920, "screenHeight": 1080}],
+            },
+            "prefs": {
+                "cookieBehavior": rnd.choice((0, 4, 5)),
+                "globalPrivacyControlEnabled": rnd.random() < 0.1,
+                "installtriggerEnabled": False,
+                "opaqueResponseBlocking": True,
+            },
+            "security": {"antispyware": None, "antivirus": ["Defender"]},
+        },
+        "tabInfo": {
+            "antitracking": {
+                "blockList": rnd.choice(("basic", "strict")),
+                "btpHasPurgedSite": False,
+                "hasMixedActiveContentBlocked": False,
+                "hasTrackingContentBlocked": rnd.random() < 0.5,
+                "isPrivateBrowsing": rnd.random() < 0.2,
+            },
+            "frameworks": {
+                "fastclick": rnd.random() < 0.05,
+                "marfeel": False,
+                "mobify": False,
+            },
+            "languages": rnd.choice((["en-US"], ["de", "en-US"], ["fr"])),
+            "useragentString": "Mozilla/5.0 (X11; Linux x86_64; rv:131.0)",
+        },
+    }
+
+
+def make_report(rnd, uuid):
+    url = f"https://{make_host(rnd)}{rnd.choice(PATHS)}"
+    if rnd.random() < 0.3:
+        url += f"?q={rnd.randint(0, 1000)}"
+    return Report(
+        app_name=rnd.choice(("Firefox", "Fenix")),
+        app_channel=rnd.choice(("release", "beta", "nightly")),
+        app_version=str(rnd.randint(120, 131)),
+        breakage_category=rnd.choice(CATEGORIES),
+        comments=" ".join(rnd.choices(WORDS, k=rnd.randint(0, 12))),
+        details=make_details(rnd),
+        os=rnd.choice(OSES),
+        reported_at=BEGIN + timedelta(minutes=rnd.randint(0, 60 * 24 * 30)),
+        url=urlsplit(url),
+        uuid=uuid,
+    )
+
+
+def make_reports(count, seed=0):
+    """Return a list of count reports (with uuids unique across seeds)"""
+    rnd = random.Random(seed)
+    return [
+        make_report(rnd, f"{idx:08x}-{seed:04x}-4000-8000-000000000000")
+        for idx in range(count)
+    ]
+
+
+def make_symptom(rnd):
+    kind = rnd.choice(("hostname", "url", "comments", "details", "time", "os"))
+    if kind == "hostname":
+        return {"type": "url", "part": "hostname", "value": make_host(rnd)}
+    if kind == "url":
+        return {"type": "url", "pattern": f"https://[^/]*{rnd.choice(PATHS)}"}
+    if kind == "comments":
+        return {"type": "comments", "pattern": f".*{rnd.choice(WORDS)}"}
+    if kind == "details":
+        if rnd.random() < 0.2:
+            return {"type": "details", "pattern": '.*"fastclick": true'}
+        return {
+            "type": "details",
+            "path": "$.tabInfo.antitracking.blockList",
+            "value": rnd.choice(("basic", "strict")),
+        }
+    if kind == "time":
+        start = BEGIN + timedelta(days=rnd.randint(0, 29))
+        return {
+            "type": "reported_at",
+            "after": start.isoformat(),
+            "before": (start + timedelta(days=1)).isoformat(),
+        }
+    return {"type": "os", "value": rnd.choice(OSES)}
+
+
+def make_signatures(count, seed=0):
+    """Return a list of count signatures of one to three symptoms. Most include a
+    hostname symptom, like those of real buckets.
+    """
+    rnd = random.Random(seed)
+    result = []
+    for _ in range(count):
+        symptoms = [make_symptom(rnd) for _ in range(rnd.randint(0, 2))]
+        if rnd.random() < 0.8:
+            symptoms.append(
+                {"type": "url", "part": "hostname", "value": make_host(rnd)}
+            )
+        elif not symptoms:
+            symptoms.append(make_symptom(rnd))
+        result.append(Signature(json.dumps({"symptoms": symptoms})))
+    return result
@@ -0,0 +1,260 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""Process-wide caches for objects which are expensive to create."""
+
+import threading
+from collections import OrderedDict
+from hashlib import sha1
+
+from django.conf import settings
+from django.db import transaction
+
+from webcompat.models import AdaptiveSignature, Signature
+
+
+class SignatureCache:
+    """LRU cache of parsed Signature objects.
+
+    Parsing a signature involves JSON decoding, schema validation, regex
+    compilation and JSONPath parsing. Signatures are keyed by a hash of their raw
+    text, which is normalized by `Bucket.save()`, so an edited signature never
+    returns a stale object. Returned signatures are shared and must not be modified.
+
+    If adaptive is set, signatures are created as `AdaptiveSignature`, which
+    reorder their symptoms by observed selectivity and record statistics for
+    `symptom_stats()`.
+    """
+
+    def __init__(self, max_size, adaptive=False):
+        assert max_size > 0
+        self.max_size = max_size
+        self.adaptive = adaptive
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._cache)
+
+    @staticmethod
+    def _key(raw_signature):
+        return sha1(raw_signature.encode("utf-8")).digest()
+
+    def get(self, raw_signature):
+        """Return the parsed signature for the given raw signature text.
+
+        Raises RuntimeError if the signature is invalid (invalid signatures are
+        not cached).
+        """
+        key = self._key(raw_signature)
+        with self._lock:
+            signature = self._cache.get(key)
+            if signature is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return signature
+            self.misses += 1
+
+        if self.adaptive:
+            signature = AdaptiveSignature(raw_signature)
+        else:
+            signature = Signature(raw_signature)
+
+        with self._lock:
+            self._cache[key] = signature
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+                self.evictions += 1
+        return signature
+
+    def discard(self, raw_signature):
+        """Remove the given signature from the cache, if present"""
+        with self._lock:
+            self._cache.pop(self._key(raw_signature), None)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        return {
+            "size": len(self._cache),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def symptom_stats(self):
+        """Return the symptom statistics of all cached adaptive signatures.
+
+        @rtype: list
+        @return: {"signature": raw signature, "symptoms": symptom statistics} for
+                 each signature, see `AdaptiveSignature.get_stats()`
+        """
+        with self._lock:
+            signatures = list(self._cache.values())
+        return [
+            {"signature": signature.raw_signature, "symptoms": signature.get_stats()}
+            for signature in signatures
+            if isinstance(signature, AdaptiveSignature)
+        ]
+
+
+SIGNATURE_CACHE = SignatureCache(
+    getattr(settings, "SIGNATURE_CACHE_SIZE", 4096),
+    adaptive=getattr(settings, "ADAPTIVE_SYMPTOM_ORDER", False),
+)
+
+
+class DimensionCache:
+    """Bounded LRU cache of the primary keys of a lookup table (eg. App or OS),
+    keyed by the natural key of the table.
+
+    The cache is filled with the most recent rows on first use. Misses fall back to
+    `get_or_create`, which handles the unique constraint race with other processes
+    by fetching the row inserted concurrently. Rows looked up inside a transaction
+    are only added to the shared cache once it is committed (they may have been
+    created by it), so a rollback can't leave a dangling primary key in the cache.
+    Until then, they are kept for the savepoint they were looked up in, so
+    repeated keys don't miss for the rest of the transaction.
+
+    Arguments:
+        model: Model of the lookup table.
+        fields: Names of the fields forming the natural key.
+        max_size: Maximum number of cached keys.
+    """
+
+    def __init__(self, model, fields, max_size):
+        assert max_size > 0
+        self.model = model
+        self.fields = tuple(fields)
+        self.max_size = max_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._warm = False
+        # ids looked up in the transactions of this thread, see `_pending_ids()`
+        self._local = threading.local()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._cache)
+
+    def _store(self, key, pk):
+        with self._lock:
+            self._cache[key] = pk
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+
+    def warm(self):
+        """Load the most recently created rows of the table into the cache"""
+        rows = list(
+            self.model.objects.order_by("-pk").values_list(*self.fields, "pk")[
+                : self.max_size
+            ]
+        )
+        with self._lock:
+            # oldest first, so the newest rows are evicted last
+            for *key, pk in reversed(rows):
+                self._cache[tuple(key)] = pk
+                self._cache.move_to_end(tuple(key))
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+            self._warm = True
+
+    def get_id(self, **values):
+        """Return the primary key of the row with the given natural key, creating
+        the row if it doesn't exist.
+        """
+        key = tuple(values[field] for field in self.fields)
+        if not self._warm:
+            # also inside a transaction: rows are only created by get_id() once
+            # warm, and the rows of other transactions are committed
+            self.warm()
+        with self._lock:
+            pk = self._cache.get(key)
+            if pk is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return pk
+
+        connection = transaction.get_connection()
+        if not connection.in_atomic_block:
+            self.misses += 1
+            pk = self.model.objects.get_or_create(**values)[0].pk
+            self._store(key, pk)
+            return pk
+
+        pending = self._pending_ids(connection)
+        for ids in pending.values():
+            pk = ids.get(key)
+            if pk is not None:
+                self.hits += 1
+                return pk
+        self.misses += 1
+        pk = self.model.objects.get_or_create(**values)[0].pk
+        savepoint_ids = tuple(connection.savepoint_ids)
+        ids = pending.get(savepoint_ids)
+        if ids is None:
+            ids = pending[savepoint_ids] = _PendingIds(self, savepoint_ids)
+            transaction.on_commit(ids.publish)
+        ids[key] = pk
+        return pk
+
+    def _pending_ids(self, connection):
+        """Return the ids looked up in the current transaction, by savepoint.
+
+        The ids of a savepoint are dropped once its on_commit callback is gone, ie.
+        when it is rolled back (or the transaction, or they were published).
+        """
+        pending = getattr(self._local, "pending", None)
+        if pending is None:
+            pending = self._local.pending = {}
+        if pending:
+            registered = {id(entry[1]) for entry in connection.run_on_commit}
+            for savepoint_ids, ids in list(pending.items()):
+                if id(ids.publish) not in registered:
+                    del pending[savepoint_ids]
+        return pending
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self._warm = False
+            self.hits = self.misses = 0
+        self._local = threading.local()
+
+    def stats(self):
+        return {
+            "size": len(self._cache),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+class _PendingIds(dict):
+    """Ids looked up by a DimensionCache in a savepoint of a transaction, which
+    are stored in the cache once it is committed.
+    """
+
+    def __init__(self, cache, savepoint_ids):
+        super().__init__()
+        self.cache = cache
+        self.savepoint_ids = savepoint_ids
+        # bound once, so `_pending_ids()` can find it among on_commit callbacks
+        self.publish = self._publish
+
+    def _publish(self):
+        pending = getattr(self.cache._local, "pending", {})
+        if pending.get(self.savepoint_ids) is self:
+            del pending[self.savepoint_ids]
+        for key, pk in self.items():
+            self.cache._store(key, pk)
@@ -0,0 +1,227 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""Set-based deletion of report entries and empty buckets.
+
+Deleting entries through the ORM loads every instance and runs the ReportEntry
+post_delete receiver for each of them. Here, entries are deleted by id in chunks,
+one transaction per chunk. The counters depending on the entries of a chunk
+(BucketHit and its rollups, ReportHit and BucketStats) are computed with a single
+GROUP BY query, and updated in the same transaction as the DELETE. If the table
+is partitioned (see `reportmanager.partitions`), expired partitions are dropped
+after computing the counter changes the same way.
+"""
+
+import sys
+import time
+from collections import Counter
+from datetime import timedelta
+from datetime import timezone as dt_timezone
+
+from django.db import models, transaction
+from django.db.models.functions import TruncHour
+
+from .models import (
+    Bucket,
+    BucketHit,
+    BucketRepresentative,
+    BucketStats,
+    ReportEntry,
+    ReportHit,
+)
+
+if sys.version_info[:2] < (3, 12):
+    from server.utils import batched
+else:
+    from itertools import batched
+
+
+class EntryCleanup:
+    """Delete report entries and empty buckets in bounded chunks.
+
+    Rows are locked for one chunk (`chunk_size` entries) at a time. With `dry_run`,
+    rows are only counted.
+    """
+
+    def __init__(self, chunk_size=500, dry_run=False):
+        assert chunk_size > 0
+        self.chunk_size = chunk_size
+        self.dry_run = dry_run
+        self.deleted_entries = 0
+        self.deleted_buckets = 0
+        self.elapsed = 0.0
+
+    @property
+    def rate(self):
+        """Deletion throughput in entries/sec"""
+        if not self.elapsed:
+            return 0.0
+        return self.deleted_entries / self.elapsed
+
+    def delete_entries(self, entries):
+        """Delete entries and update the counters depending on them.
+
+        @type entries: QuerySet
+        @param entries: ReportEntry queryset of the entries to delete
+
+        @rtype: int
+        @return: Number of entries deleted (or to be deleted if dry_run)
+        """
+        if self.dry_run:
+            return entries.count()
+
+        start = time.perf_counter()
+        entries = entries.order_by("id")
+        deleted = 0
+        last_id = 0
+        while True:
+            chunk = list(
+                entries.filter(id__gt=last_id).values_list("id", "reported_at")[
+                    : self.chunk_size
+                ]
+            )
+            if not chunk:
+                break
+            last_id = chunk[-1][0]
+            deleted += self._delete_chunk(chunk)
+        self.deleted_entries += deleted
+        self.elapsed += time.perf_counter() - start
+        return deleted
+
+    def delete_partition(self, partitions, partition):
+        """Drop a partition of the ReportEntry table, and update the counters
+        depending on its entries.
+
+        @type partitions: ReportPartitions
+        @param partitions: Partitions of the ReportEntry table
+
+        @type partition: Partition
+        @param partition: The partition to drop
+
+        @rtype: int
+        @return: Number of entries deleted (or to be deleted if dry_run)
+        """
+        begin, end = partitions.get_range(partition)
+        in_range = models.Q(reported_at__lt=end)
+        if begin is not None:
+            in_range &= models.Q(reported_at__gte=begin)
+        entries = ReportEntry.objects.filter(in_range).order_by()
+        if self.dry_run:
+            return entries.count()
+
+        start = time.perf_counter()
+        with transaction.atomic():
+            # entries can't be changed until the partition is dropped
+            partitions.lock(partition)
+            bucket_hits, report_hits, stats_changes = self._get_changes(entries)
+            BucketRepresentative.objects.filter(entry__in=entries.values("id")).delete()
+            partitions.drop(partition)
+            # the latest entries of buckets are recomputed without the partition
+            self._apply_changes(bucket_hits, report_hits, stats_changes)
+        deleted = -sum(report_hits.values())
+        self.deleted_entries += deleted
+        self.elapsed += time.perf_counter() - start
+        return deleted
+
+    @staticmethod
+    def _get_changes(entries):
+        """Return the changes to the counters if entries are deleted"""
+        # the hour of BucketHit counters starts at reported_at, the one of ReportHit
+        # counters ends at it (see ReportHit.get_period())
+        groups = (
+            entries.values(
+                "bucket_id",
+                hour=TruncHour("reported_at", tzinfo=dt_timezone.utc),
+                report_hour=TruncHour(
+                    models.ExpressionWrapper(
+                        models.F("reported_at") - timedelta(microseconds=1),
+                        output_field=models.DateTimeField(),
+                    ),
+                    tzinfo=dt_timezone.utc,
+                ),
+            )
+            .annotate(
+                count=models.Count("id"),
+                latest_id=models.Max("id"),
+                latest_report=models.Max("reported_at"),
+            )
+            .values_list(
+                "bucket_id",
+                "hour",
+                "report_hour",
+                "count",
+                "latest_id",
+                "latest_report",
+            )
+        )
+        bucket_hits = Counter()
+        report_hits = Counter()
+        stats_changes = []
+        for bucket_id, hour, report_hour, count, latest_id, latest_report in groups:
+            report_hits[report_hour + timedelta(hours=1)] -= count
+            if bucket_id is not None:
+                bucket_hits[(bucket_id, hour)] -= count
+                # BucketStats only needs the latest of the removed entries
+                stats_changes.append((bucket_id, latest_id, latest_report, -count))
+        return bucket_hits, report_hits, stats_changes
+
+    @staticmethod
+    def _apply_changes(bucket_hits, report_hits, stats_changes):
+        BucketHit.apply_deltas(bucket_hits)
+        ReportHit.apply_deltas(report_hits)
+        BucketStats.apply_changes(stats_changes)
+
+    @transaction.atomic
+    def _delete_chunk(self, chunk):
+        # bounds on reported_at let the database skip partitions
+        reported_at = (
+            min(reported_at for _, reported_at in chunk),
+            max(reported_at for _, reported_at in chunk),
+        )
+        # lock the entries so they can't be moved to another bucket before the
+        # counters are updated, and skip those deleted since the ids were fetched
+        entry_ids = list(
+            ReportEntry.objects.select_for_update()
+            .filter(
+                id__in=[entry_id for entry_id, _ in chunk],
+                reported_at__range=reported_at,
+            )
+            .order_by("id")
+            .values_list("id", flat=True)
+        )
+        if not entry_ids:
+            return 0
+        entries = ReportEntry.objects.filter(
+            id__in=entry_ids, reported_at__range=reported_at
+        ).order_by()
+
+        changes = self._get_changes(entries)
+        BucketRepresentative.objects.filter(entry_id__in=entry_ids).delete()
+        # a single DELETE, without collecting the entries or sending signals. This
+        # is what QuerySet.delete() does for models without receivers or relations.
+        deleted = entries._raw_delete(entries.db)
+        self._apply_changes(*changes)
+        return deleted
+
+    def delete_empty_buckets(self):
+        """Delete buckets without entries, which are not assigned to a bug.
+
+        @rtype: int
+        @return: Number of buckets deleted (or to be deleted if dry_run)
+        """
+        empty = Bucket.objects.filter(bug=None).filter(
+            ~models.Exists(ReportEntry.objects.filter(bucket=models.OuterRef("pk")))
+        )
+        if self.dry_run:
+            return empty.count()
+
+        deleted = 0
+        for bucket_ids in batched(
+            empty.order_by("id").values_list("id", flat=True), self.chunk_size
+        ):
+            with transaction.atomic(), BucketHit.deferred():
+                # entries may have been added since the ids were fetched
+                _, per_model = empty.filter(id__in=bucket_ids).delete()
+            deleted += per_model.get(Bucket._meta.label, 0)
+        self.deleted_buckets += deleted
+        return deleted
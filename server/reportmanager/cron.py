@@ -2,60 +2,44 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 from datetime import timedelta
-from itertools import count
 
 from celeryconf import app
 from django.conf import settings
+from django.core.cache import cache
 from django.core.management import call_command
 from django.db import transaction
-from django.db.models import F, Q
 from django.utils import timezone
 
 
 @app.task(ignore_result=True)
 def update_report_stats():
-    from .models import ReportEntry, ReportHit
+    from .models import REPORT_STATS_CACHE_KEY, ReportEntry, ReportHit
 
     max_history = timedelta(days=getattr(settings, "REPORT_STATS_MAX_HISTORY_DAYS", 14))
     now = timezone.now()
-    cur_period = ReportHit.get_period(now)
+    old_cutoff = ReportHit.get_period(now) - max_history
 
-    try:
-        last_run = max(
-            ReportHit.objects.all().order_by("-last_update")[0].last_update,
-            cur_period - max_history,
-        )
-    except IndexError:
-        # no run, go back as far in history as needed
-        last_run = cur_period - max_history
-
-    for hours in count():
-        period = cur_period - timedelta(hours=hours)
-        if period <= last_run:
-            break
+    # trim old stats
+    ReportHit.objects.filter(last_update__lt=old_cutoff).delete()
+
+    # Counters are updated as report entries are created and deleted. Only hours
+    # which changed after they ended need to be recounted, in case some change was
+    # missed (eg. entries deleted in bulk without signals).
+    dirty = ReportHit.objects.filter(dirty=True).order_by("last_update")
+    for period in dirty.values_list("last_update", flat=True):
         with transaction.atomic():
-            reporthits_range = ReportHit.objects.select_for_update().filter(
-                Q(last_update__gt=period - timedelta(hours=1))
-                & Q(last_update__lte=period)
-            )
-            hits = ReportEntry.objects.filter(
-                reported_at__gt=max(period - timedelta(hours=1), last_run),
+            hit = dirty.select_for_update().filter(last_update=period).first()
+            if hit is None:
+                # recounted concurrently
+                continue
+            hit.count = ReportEntry.objects.filter(
+                reported_at__gt=period - timedelta(hours=1),
                 reported_at__lte=period,
             ).count()
+            hit.dirty = False
+            hit.save(update_fields=["count", "dirty"])
 
-            obj, created = reporthits_range.get_or_create(
-                defaults={
-                    "last_update": min(period, now),
-                    "count": hits,
-                },
-            )
-            if not created:
-                obj.last_update = min(period, now)
-                obj.count = F("count") + hits
-                obj.save()
-    # trim old stats
-    old_cutoff = cur_period - max_history
-    ReportHit.objects.filter(last_update__lt=old_cutoff).delete()
+    cache.delete(REPORT_STATS_CACHE_KEY)
 
 
 @app.task(ignore_result=True)
@@ -66,6 +50,13 @@ def unhide_buckets():
     Bucket.objects.filter(hide_until__lte=now).update(hide_until=None)
 
 
+@app.task(ignore_result=True)
+def refresh_bucket_representatives():
+    from .models import BucketRepresentative
+
+    BucketRepresentative.refresh()
+
+
 @app.task(ignore_result=True)
 def bug_update_status():
     call_command("bug_update_status")
@@ -76,6 +67,11 @@ def cleanup_old_reports():
     call_command("cleanup_old_reports")
 
 
+@app.task(ignore_result=True)
+def create_report_partitions():
+    call_command("create_report_partitions")
+
+
 @app.task(ignore_result=True)
 def triage_new_reports():
     call_command("triage_new_reports")
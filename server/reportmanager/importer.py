@@ -0,0 +1,260 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""Bulk import of reports.
+
+Reports are imported in chunks: lookup tables are resolved through the dimension
+caches, uuids that already exist are skipped with one query per chunk and the
+remaining entries are inserted with `bulk_create`. The work normally done by the
+ReportEntry post_save receiver (BucketHit and ReportHit counters, BucketStats,
+notifications, triage) is done once per chunk instead.
+"""
+
+import sys
+from collections import Counter
+from contextlib import suppress
+from logging import getLogger
+from urllib.parse import urlsplit
+from uuid import UUID
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.db.utils import IntegrityError
+from django.utils import timezone
+
+from webcompat.models import Report
+
+from .models import (
+    APP_CACHE,
+    BREAKAGE_CATEGORY_CACHE,
+    OS_CACHE,
+    Bucket,
+    BucketHit,
+    BucketStats,
+    ReportEntry,
+    ReportHit,
+    notify_bucket_hits,
+)
+from .triage import get_signature_index
+
+if sys.version_info[:2] < (3, 12):
+    from server.utils import batched
+else:
+    from itertools import batched
+
+LOG = getLogger("reportmanager.import")
+
+# Little dict that maps hostnames to bucket IDs, used to memoize the results of
+# the find_bucket_for_report function below, since DB lookups are slow.
+KNOWN_BUCKET_IDS: dict[str, int] = {}
+
+
+# This is only returning a bucket if there is exactly one matching bucket, or
+# if there is absolutely no matching bucket and we have to create one. If there
+# are multiple buckets matching, we return none, and effectively leave the
+# report in the "untriaged", i.e. not assigned to any bucket, state. The cronjob
+# can then pick the report up and run the more comprehensive full-signature
+# check.
+def find_bucket_for_report(report_info: Report) -> int | None:
+    hostname = report_info.url.hostname
+    if (known_bucket := KNOWN_BUCKET_IDS.get(hostname)) is not None:
+        return known_bucket
+
+    candidates = Bucket.objects.filter(Q(domain=hostname)).values_list("id", flat=True)
+
+    if len(candidates) == 1:
+        KNOWN_BUCKET_IDS[hostname] = candidates[0]
+        return candidates[0]
+
+    if len(candidates) == 0:
+        bucket = Bucket.objects.create(
+            description=f"domain is {report_info.url.hostname}",
+            signature=report_info.create_signature().raw_signature,
+        )
+        KNOWN_BUCKET_IDS[hostname] = bucket.id
+        return bucket.id
+
+    return None
+
+
+def report_from_row(row) -> Report:
+    """Create a Report from a row of the BigQuery reports table"""
+    # The BugBot ML prediction can assign two labels, invalid or valid,
+    # with a probability between 0 and 1. Having two labels makes
+    # filtering and sorting harder, so let's transform "invalid 95%"
+    # into "valid 5%".
+    # There is a rare chance that a bug will have no score. In this case,
+    # we just assign None, which will get treated as invalid in the
+    # frontend.
+    ml_valid_probability = None
+    match row.ml_label:
+        case "invalid":
+            ml_valid_probability = 1 - row.ml_probability
+        case "valid":
+            ml_valid_probability = row.ml_probability
+
+    return Report(
+        app_name=row.app_name,
+        app_channel=row.app_channel,
+        app_version=row.app_version,
+        breakage_category=row.breakage_category,
+        comments=row.comments,
+        comments_translated=row.translated_text,
+        comments_original_language=row.language_code,
+        details=row.details,
+        reported_at=row.reported_at.replace(tzinfo=timezone.utc),
+        url=urlsplit(row.url),
+        os=row.os,
+        uuid=row.uuid,
+        ml_valid_probability=ml_valid_probability,
+    )
+
+
+class ReportImporter:
+    """Import Report objects into the database in chunks.
+
+    Arguments:
+        chunk_size: Number of reports inserted per transaction.
+    """
+
+    def __init__(self, chunk_size=500):
+        assert chunk_size > 0
+        self.chunk_size = chunk_size
+        self.created = 0
+        self.skipped = 0
+
+    def import_reports(self, reports):
+        """Import all reports from the given iterable.
+
+        @rtype: int
+        @return: number of entries created
+        """
+        for chunk in batched(reports, self.chunk_size):
+            self.import_chunk(chunk)
+        return self.created
+
+    def _prepare_entries(self, reports):
+        # forget memoized buckets which have been deleted since
+        known = set(KNOWN_BUCKET_IDS.values())
+        if known:
+            known -= set(
+                Bucket.objects.filter(pk__in=known).values_list("pk", flat=True)
+            )
+        if known:
+            for hostname, bucket_id in list(KNOWN_BUCKET_IDS.items()):
+                if bucket_id in known:
+                    del KNOWN_BUCKET_IDS[hostname]
+
+        # triage with the signatures of all buckets, like triage_new_report does,
+        # so a higher priority bucket is found before the domain bucket
+        bucket_ids = get_signature_index().find_buckets(reports)
+        found = set(bucket_ids) - {None}
+        if found:
+            # buckets may have been deleted since the index was built
+            found = set(
+                Bucket.objects.filter(pk__in=found).values_list("pk", flat=True)
+            )
+
+        entries = []
+        for report, bucket_id in zip(reports, bucket_ids):
+            if bucket_id not in found:
+                bucket_id = find_bucket_for_report(report)
+            entry = ReportEntry(
+                app_id=APP_CACHE.get_id(
+                    channel=report.app_channel,
+                    name=report.app_name,
+                    version=report.app_version,
+                ),
+                breakage_category_id=(
+                    None
+                    if report.breakage_category is None
+                    else BREAKAGE_CATEGORY_CACHE.get_id(value=report.breakage_category)
+                ),
+                url=report.url.geturl(),
+                **ReportEntry.get_url_parts(report.url),
+                uuid=report.uuid,
+                reported_at=report.reported_at,
+                os_id=OS_CACHE.get_id(name=report.os),
+                details=report.details,
+                comments=report.comments,
+                comments_translated=report.comments_translated,
+                comments_original_language=report.comments_original_language,
+                ml_valid_probability=report.ml_valid_probability,
+                bucket_id=bucket_id,
+            )
+            entry.sanitize()
+            entries.append(entry)
+        return entries
+
+    @staticmethod
+    @transaction.atomic
+    def _insert(entries):
+        created = ReportEntry.objects.bulk_create(entries)
+        if any(entry.pk is None for entry in created):
+            # not all backends return primary keys from bulk inserts
+            ids = dict(
+                ReportEntry.objects.filter(
+                    uuid__in=[entry.uuid for entry in created]
+                ).values_list("uuid", "id")
+            )
+            for entry in created:
+                entry.pk = ids[UUID(str(entry.uuid))]
+        BucketHit.apply_deltas(
+            Counter(
+                (entry.bucket_id, entry.reported_at)
+                for entry in created
+                if entry.bucket_id is not None
+            )
+        )
+        BucketStats.apply_changes(
+            (entry.bucket_id, entry.pk, entry.reported_at, 1)
+            for entry in created
+            if entry.bucket_id is not None
+        )
+        ReportHit.apply_deltas(Counter(entry.reported_at for entry in created))
+        return created
+
+    def import_chunk(self, reports):
+        """Import a chunk of reports, skipping those which exist already."""
+        by_uuid = {}
+        for report in reports:
+            by_uuid.setdefault(UUID(str(report.uuid)), report)
+        existing = set(
+            ReportEntry.objects.filter(uuid__in=list(by_uuid)).values_list(
+                "uuid", flat=True
+            )
+        )
+        new_reports = [
+            report for uuid, report in by_uuid.items() if uuid not in existing
+        ]
+        self.skipped += len(reports) - len(new_reports)
+        if not new_reports:
+            return
+
+        entries = self._prepare_entries(new_reports)
+        try:
+            created = self._insert(entries)
+        except IntegrityError:
+            # some reports were inserted concurrently, insert one at a time
+            created = []
+            for entry in entries:
+                entry.pk = None
+                with suppress(IntegrityError):
+                    created.extend(self._insert([entry]))
+            self.skipped += len(entries) - len(created)
+        self.created += len(created)
+
+        by_bucket = {}
+        untriaged = False
+        for entry in created:
+            if entry.bucket_id is None:
+                untriaged = True
+            else:
+                by_bucket.setdefault(entry.bucket_id, []).append(entry)
+        notify_bucket_hits(by_bucket)
+
+        if untriaged and getattr(settings, "USE_CELERY", None):
+            from .cron import triage_new_reports
+
+            triage_new_reports.delay()
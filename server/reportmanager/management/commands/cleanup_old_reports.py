@@ -1,18 +1,13 @@
-import sys
 from datetime import timedelta
 from logging import getLogger
 
 from django.conf import settings
 from django.core.management import BaseCommand, CommandError  # noqa
-from django.db.models.aggregates import Count
 from django.utils import timezone
 
-from reportmanager.models import Bucket, Bug, ReportEntry
-
-if sys.version_info[:2] < (3, 12):
-    from server.utils import batched
-else:
-    from itertools import batched
+from reportmanager.cleanup import EntryCleanup
+from reportmanager.models import BucketHit, Bug, ReportEntry
+from reportmanager.partitions import ReportPartitions
 
 LOG = getLogger("reportmanager.cleanup_old_reports")
 
@@ -25,6 +20,9 @@ class Command(BaseCommand):
         cleanup_fixed_buckets_after_days = getattr(
             settings, "CLEANUP_FIXED_BUCKETS_AFTER_DAYS", 3
         )
+        dry_run = options["dry_run"]
+        action = "Would remove" if dry_run else "Removed"
+        cleanup = EntryCleanup(chunk_size=options["chunk_size"], dry_run=dry_run)
 
         # Select all buckets that have been closed for x days
         now = timezone.now()
@@ -36,68 +34,66 @@ class Command(BaseCommand):
             microseconds=now.microsecond,
         )
         bugs = Bug.objects.filter(closed__lt=expiry_date)
-        for bug in bugs:
-            # Deleting the bug causes buckets referring to this bug as well as entries
-            # referring these buckets to be deleted as well due to cascading delete.
-            # However, if the associated buckets are too large, the cascading delete
-            # can easily cause Django to run out of memory so we have to manually
-            # delete issues in batches first for large buckets.
-            # The reason for Django running OOM here is probably due to the fact that
-            # we have a post-delete receiver on ReportEntry that has to be called for
-            # every single deleted entry with the full instance. Maybe Django loads
-            # a copy of all instances to be deleted into memory for this purpose.
-            reports = ReportEntry.objects.filter(bucket__bug=bug)
-            report_count = reports.count()
-            if report_count:
-                LOG.info(
-                    "Removing %d ReportEntry objects from buckets assigned to bug %s",
-                    report_count,
-                    bug.external_id,
-                )
-            for report_set in batched(reports.values_list("id", flat=True), 500):
-                # Deleting things in buckets is complicated:
-                #
-                # Attempting to combine a subset (LIMIT) with a delete yields
-                #   "Cannot use 'limit' or 'offset' with delete."
-                #
-                # Using a nested query with pk_in=<filter query> yields
-                #   "This version of MySQL doesn't yet support
-                #        'LIMIT & IN/ALL/ANY/SOME subquery'"
-
-                # So the only way we have left is to manually select a given amount of
-                # pks and store them in a list to use pk__in with the list and a DELETE
-                # query.
-                ReportEntry.objects.filter(pk__in=list(report_set)).delete()
-
-            bug.delete()
+        # Deleting the bugs causes buckets referring to them as well as entries
+        # referring these buckets to be deleted as well due to cascading delete.
+        # The cascade loads every entry to run its post_delete receiver, so the
+        # entries are deleted in chunks first.
+        count = cleanup.delete_entries(ReportEntry.objects.filter(bucket__bug__in=bugs))
+        if count:
+            LOG.info(
+                "%s %d ReportEntry objects from buckets assigned to closed bugs",
+                action,
+                count,
+            )
+        if dry_run:
+            count = bugs.count()
+        else:
+            with BucketHit.deferred():
+                count = bugs.delete()[1].get(Bug._meta.label, 0)
+        if count:
+            LOG.info("%s %d closed Bug objects", action, count)
 
         if not options["leave_empty_buckets"]:
-            # Select all buckets that are empty and delete them
-            for bucket in Bucket.objects.annotate(size=Count("reportentry")).filter(
-                size=0, bug=None
-            ):
-                LOG.info("Removing empty bucket %d", bucket.id)
-                bucket.delete()
+            count = cleanup.delete_empty_buckets()
+            if count:
+                LOG.info("%s %d empty buckets", action, count)
 
         # Select all entries that are older than x days
-        # Again, for the same reason as mentioned above, we have to delete entries in
-        # batches.
         expiry_date = now - timedelta(
             days=cleanup_reports_after_days,
         )
         old_reports = ReportEntry.objects.filter(reported_at__lt=expiry_date)
-        old_report_count = old_reports.count()
-        if old_report_count:
-            LOG.info("Removing %d old, unbucketed reports", old_report_count)
-        for report_set in batched(old_reports.values_list("pk", flat=True), 500):
-            ReportEntry.objects.filter(pk__in=list(report_set)).delete()
+        # if the table is partitioned, whole partitions are dropped instead
+        partitions = ReportPartitions()
+        expired = partitions.get_expired(expiry_date)
+        for partition in expired:
+            count = cleanup.delete_partition(partitions, partition)
+            LOG.info("%s partition %s (%d old reports)", action, partition.name, count)
+        if dry_run and expired:
+            old_reports = old_reports.filter(reported_at__gte=expired[-1].end)
+        if dry_run:
+            # entries of closed bugs are counted above already
+            old_reports = old_reports.exclude(bucket__bug__in=bugs)
+        count = cleanup.delete_entries(old_reports)
+        if count:
+            LOG.info("%s %d old reports", action, count)
 
         # Cleanup all bugs that don't belong to any bucket anymore
         orphan_bugs = Bug.objects.filter(bucket__isnull=True)
-        orphan_bug_count = orphan_bugs.count()
-        if orphan_bug_count:
-            LOG.info("Removing %d orphaned Bug objects", orphan_bug_count)
-            orphan_bugs.delete()
+        if dry_run:
+            count = orphan_bugs.exclude(pk__in=bugs).count()
+        else:
+            count = orphan_bugs.delete()[1].get(Bug._meta.label, 0)
+        if count:
+            LOG.info("%s %d orphaned Bug objects", action, count)
+
+        if not dry_run:
+            LOG.info(
+                "deleted %d report entries in %.1fs (%.1f rows/sec)",
+                cleanup.deleted_entries,
+                cleanup.elapsed,
+                cleanup.rate,
+            )
 
     def add_arguments(self, parser):
         parser.add_argument(
@@ -107,3 +103,16 @@ class Command(BaseCommand):
             required=False,
             default=False,
         )
+        parser.add_argument(
+            "--chunk-size",
+            help="number of report entries to delete per transaction",
+            type=int,
+            default=500,
+        )
+        parser.add_argument(
+            "--dry-run",
+            help="only log the number of objects which would be removed",
+            action="store_true",
+            required=False,
+            default=False,
+        )
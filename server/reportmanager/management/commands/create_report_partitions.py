@@ -0,0 +1,70 @@
+from datetime import timedelta
+from logging import getLogger
+
+from django.core.management import BaseCommand, CommandError
+from django.utils import timezone
+
+from reportmanager.partitions import ReportPartitions
+
+LOG = getLogger("reportmanager.create_report_partitions")
+
+
+class Command(BaseCommand):
+    help = (
+        "Create the ReportEntry partitions for the coming days, if the table is "
+        "partitioned (see REPORT_PARTITION_INTERVAL)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days-ahead",
+            help="create partitions covering this many days from now",
+            type=int,
+            default=14,
+        )
+        parser.add_argument(
+            "--dry-run",
+            help="only log the partitions which would be created",
+            action="store_true",
+            required=False,
+            default=False,
+        )
+        parser.add_argument(
+            "--conversion-sql",
+            help="print the SQL statements converting the unpartitioned table, "
+            "instead of creating partitions. The statements aren't run, review them "
+            "and run them in a maintenance window.",
+            action="store_true",
+            required=False,
+            default=False,
+        )
+
+    def handle(self, *args, **options):
+        partitions = ReportPartitions()
+        until = timezone.now() + timedelta(days=options["days_ahead"])
+
+        if options["conversion_sql"]:
+            if not partitions.supported:
+                raise CommandError(
+                    "REPORT_PARTITION_INTERVAL must be set, for a PostgreSQL or MySQL "
+                    "database"
+                )
+            for statement in partitions.conversion_sql(until):
+                self.stdout.write(f"{statement};")
+            return
+
+        if not partitions.supported:
+            return
+        existing = partitions.get_partitions()
+        if not existing:
+            raise CommandError(
+                "ReportEntry table isn't partitioned, see --conversion-sql"
+            )
+        for partition in partitions.get_missing(until, existing):
+            if not options["dry_run"]:
+                partitions.create(partition)
+            LOG.info(
+                "%s partition %s",
+                "Would create" if options["dry_run"] else "Created",
+                partition.name,
+            )
@@ -0,0 +1,79 @@
+from logging import getLogger
+
+from django.core.management import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, Max
+
+from reportmanager.models import BucketStats, ReportEntry
+
+LOG = getLogger("reportmanager.rebuild_bucket_stats")
+
+
+class Command(BaseCommand):
+    help = "Recompute the size and latest entry of all buckets from scratch."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="only report buckets with stats that differ, and fail if any do",
+        )
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        expected = {
+            bucket_id: (size, latest_report, latest_entry_id)
+            for bucket_id, size, latest_report, latest_entry_id in (
+                ReportEntry.objects.filter(bucket__isnull=False)
+                .values("bucket_id")
+                .annotate(Count("id"), Max("reported_at"), Max("id"))
+                .values_list("bucket_id", "id__count", "reported_at__max", "id__max")
+            )
+        }
+        current = {
+            bucket_id: (size, latest_report, latest_entry_id)
+            for bucket_id, size, latest_report, latest_entry_id in (
+                BucketStats.objects.select_for_update()
+                .filter(size__gt=0)
+                .values_list("bucket_id", "size", "latest_report", "latest_entry_id")
+            )
+        }
+
+        mismatched = sorted(
+            bucket_id
+            for bucket_id in expected.keys() | current.keys()
+            if expected.get(bucket_id) != current.get(bucket_id)
+        )
+        for bucket_id in mismatched:
+            LOG.warning(
+                "bucket %d: stats are %r, expected %r",
+                bucket_id,
+                current.get(bucket_id),
+                expected.get(bucket_id),
+            )
+
+        if options["check"]:
+            if mismatched:
+                raise CommandError(f"{len(mismatched)} buckets have stale stats")
+            return
+
+        BucketStats.objects.all().delete()
+        BucketStats.objects.bulk_create(
+            [
+                BucketStats(
+                    bucket_id=bucket_id,
+                    size=size,
+                    latest_report=latest_report,
+                    latest_entry_id=latest_entry_id,
+                )
+                for bucket_id, (size, latest_report, latest_entry_id) in sorted(
+                    expected.items()
+                )
+            ],
+            batch_size=500,
+        )
+        LOG.info(
+            "rebuilt stats of %d buckets (%d were stale)",
+            len(expected),
+            len(mismatched),
+        )
@@ -3,9 +3,9 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 from django.core.management import BaseCommand
 from django.db import transaction
-from django.db.models import Q
 
 from reportmanager.models import Bucket, ReportEntry
+from reportmanager.triage import get_signature_index, invalidate_signature_index
 
 
 class Command(BaseCommand):
@@ -23,20 +23,22 @@ class Command(BaseCommand):
         entry = ReportEntry.objects.select_for_update().get(pk=options["id"])
         report_info = entry.get_report()
 
-        buckets = Bucket.objects.filter(
-            Q(domain=report_info.url.hostname) | Q(domain__isnull=True)
-        ).order_by("-priority")
-
-        for bucket in buckets:
-            signature = bucket.get_signature()
-
-            if signature.matches(report_info):
-                entry.bucket = bucket
-                break
-        else:
-            entry.bucket = Bucket.objects.create(
+        bucket = None
+        bucket_id = get_signature_index().find_bucket(report_info)
+        if bucket_id is not None:
+            bucket = Bucket.objects.filter(pk=bucket_id).first()
+            if bucket is None:
+                # bucket was deleted by another process, index is stale
+                invalidate_signature_index()
+                bucket_id = get_signature_index().find_bucket(report_info)
+                if bucket_id is not None:
+                    bucket = Bucket.objects.get(pk=bucket_id)
+
+        if bucket is None:
+            bucket = Bucket.objects.create(
                 description=f"domain is {report_info.url.hostname}",
                 signature=report_info.create_signature().raw_signature,
             )
 
+        entry.bucket = bucket
         entry.save()
@@ -1,6 +1,12 @@
-from django.core.management import BaseCommand, call_command
+import json
+from logging import getLogger
 
-from reportmanager.models import ReportEntry
+from django.core.management import BaseCommand
+
+from reportmanager.caches import SIGNATURE_CACHE
+from reportmanager.triage import BulkTriage, invalidate_signature_index
+
+LOG = getLogger("reportmanager.triage_new_reports")
 
 
 class Command(BaseCommand):
@@ -9,8 +15,39 @@ class Command(BaseCommand):
         "before to assign them into the existing buckets."
     )
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size",
+            help="number of report entries to triage per transaction",
+            type=int,
+            default=500,
+        )
+        parser.add_argument(
+            "--symptom-stats",
+            help="write statistics of the symptoms evaluated to this JSON file "
+            "(enables adaptive symptom ordering for this run)",
+            metavar="FILE",
+        )
+
     def handle(self, *args, **options):
-        for entry in ReportEntry.objects.filter(bucket__isnull=True).values_list(
-            "id", flat=True
-        ):
-            call_command("triage_new_report", entry)
+        # buckets may have been changed by other processes, so make sure the
+        # process-wide index used by `triage_new_report` is rebuilt as well
+        invalidate_signature_index()
+
+        if options["symptom_stats"] and not SIGNATURE_CACHE.adaptive:
+            SIGNATURE_CACHE.adaptive = True
+            SIGNATURE_CACHE.clear()
+
+        triage = BulkTriage(chunk_size=options["chunk_size"])
+        triage.run()
+        LOG.info(
+            "triaged %d report entries (%d new buckets) in %.1fs (%.1f reports/sec)",
+            triage.triaged,
+            triage.created_buckets,
+            triage.elapsed,
+            triage.rate,
+        )
+
+        if options["symptom_stats"]:
+            with open(options["symptom_stats"], "w") as stats_fd:
+                json.dump(SIGNATURE_CACHE.symptom_stats(), stats_fd, indent=2)
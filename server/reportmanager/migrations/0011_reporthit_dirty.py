@@ -0,0 +1,38 @@
+# Generated by Django 4.2.17 on 2026-10-18 12:00
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def reset_report_hits(apps, schema_editor):
+    # ReportHit counters used to be keyed by the time of the last update, and are
+    # now kept per hour. Replace existing rows by dirty counters for every hour of
+    # the history, these are recounted by the next update_report_stats run.
+    ReportHit = apps.get_model("reportmanager", "ReportHit")
+    ReportHit.objects.all().delete()
+
+    now = timezone.now()
+    cur_period = now.replace(minute=0, second=0, microsecond=0)
+    if cur_period != now:
+        cur_period += timedelta(hours=1)
+    n_periods = getattr(settings, "REPORT_STATS_MAX_HISTORY_DAYS", 14) * 24
+    ReportHit.objects.bulk_create(
+        ReportHit(last_update=cur_period - timedelta(hours=n), count=0, dirty=True)
+        for n in range(n_periods)
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = (("reportmanager", "0010_reportentry_ml_valid_probability"),)
+
+    operations = (
+        migrations.AddField(
+            model_name="reporthit",
+            name="dirty",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(reset_report_hits, migrations.RunPython.noop),
+    )
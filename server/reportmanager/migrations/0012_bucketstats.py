@@ -0,0 +1,54 @@
+# Generated by Django 4.2.30 on 2026-10-18 21:21
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def fill_bucket_stats(apps, schema_editor):
+    BucketStats = apps.get_model("reportmanager", "BucketStats")
+    ReportEntry = apps.get_model("reportmanager", "ReportEntry")
+    BucketStats.objects.bulk_create(
+        (
+            BucketStats(
+                bucket_id=bucket_id,
+                size=size,
+                latest_report=latest_report,
+                latest_entry_id=latest_entry_id,
+            )
+            for bucket_id, size, latest_report, latest_entry_id in (
+                ReportEntry.objects.filter(bucket__isnull=False)
+                .values("bucket_id")
+                .annotate(
+                    models.Count("id"), models.Max("reported_at"), models.Max("id")
+                )
+                .values_list("bucket_id", "id__count", "reported_at__max", "id__max")
+            )
+        ),
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = (("reportmanager", "0011_reporthit_dirty"),)
+
+    operations = (
+        migrations.CreateModel(
+            name="BucketStats",
+            fields=[
+                (
+                    "bucket",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="stats",
+                        serialize=False,
+                        to="reportmanager.bucket",
+                    ),
+                ),
+                ("size", models.IntegerField(default=0)),
+                ("latest_report", models.DateTimeField(null=True)),
+                ("latest_entry_id", models.IntegerField(null=True)),
+            ],
+        ),
+        migrations.RunPython(fill_bucket_stats, migrations.RunPython.noop),
+    )
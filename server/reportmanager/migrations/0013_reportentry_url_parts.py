@@ -0,0 +1,71 @@
+# Generated by Django 4.2.30 on 2026-10-18 21:26
+
+from urllib.parse import urlsplit
+
+from django.db import migrations, models, transaction
+
+URL_PART_MAX_LENGTH = 255
+
+
+def fill_url_parts(apps, schema_editor):
+    ReportEntry = apps.get_model("reportmanager", "ReportEntry")
+    entries = ReportEntry.objects.filter(path__isnull=True).order_by("id")
+    last_id = 0
+    while True:
+        # commit each chunk, so the backfill can be interrupted and resumed
+        with transaction.atomic():
+            chunk = list(entries.filter(id__gt=last_id).only("id", "url")[:1000])
+            if not chunk:
+                break
+            for entry in chunk:
+                url = urlsplit(entry.url)
+                entry.hostname, entry.path, entry.scheme = (
+                    url.hostname,
+                    url.path,
+                    url.scheme,
+                )
+                if entry.hostname is not None and (
+                    len(entry.hostname) > URL_PART_MAX_LENGTH
+                ):
+                    entry.hostname = None
+                if len(entry.scheme) > URL_PART_MAX_LENGTH:
+                    entry.scheme = None
+            ReportEntry.objects.bulk_update(chunk, ["hostname", "path", "scheme"])
+        last_id = chunk[-1].id
+
+
+class Migration(migrations.Migration):
+    # the backfill commits in chunks
+    atomic = False
+
+    dependencies = (("reportmanager", "0012_bucketstats"),)
+
+    operations = (
+        migrations.AddField(
+            model_name="reportentry",
+            name="hostname",
+            field=models.CharField(max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name="reportentry",
+            name="path",
+            field=models.TextField(null=True),
+        ),
+        migrations.AddField(
+            model_name="reportentry",
+            name="scheme",
+            field=models.CharField(max_length=255, null=True),
+        ),
+        migrations.RunPython(fill_url_parts, migrations.RunPython.noop),
+        # indexes are created after the backfill, which is faster
+        migrations.AlterField(
+            model_name="reportentry",
+            name="hostname",
+            field=models.CharField(db_index=True, max_length=255, null=True),
+        ),
+        migrations.AlterField(
+            model_name="reportentry",
+            name="scheme",
+            field=models.CharField(db_index=True, max_length=255, null=True),
+        ),
+    )
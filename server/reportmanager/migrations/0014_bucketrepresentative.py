@@ -0,0 +1,61 @@
+# Generated by Django 4.2.30 on 2026-10-18 21:57
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def fill_bucket_representatives(apps, schema_editor):
+    BucketRepresentative = apps.get_model("reportmanager", "BucketRepresentative")
+    ReportEntry = apps.get_model("reportmanager", "ReportEntry")
+    sample_size = getattr(settings, "BUCKET_REPRESENTATIVES", 5)
+    bucket_ids = (
+        ReportEntry.objects.filter(bucket__isnull=False)
+        .values_list("bucket_id", flat=True)
+        .distinct()
+    )
+    for bucket_id in bucket_ids.iterator():
+        BucketRepresentative.objects.bulk_create(
+            BucketRepresentative(bucket_id=bucket_id, entry_id=entry_id)
+            for entry_id in ReportEntry.objects.filter(bucket_id=bucket_id)
+            .order_by("?")
+            .values_list("id", flat=True)[:sample_size]
+        )
+
+
+class Migration(migrations.Migration):
+    dependencies = (("reportmanager", "0013_reportentry_url_parts"),)
+
+    operations = (
+        migrations.CreateModel(
+            name="BucketRepresentative",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "bucket",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="representatives",
+                        to="reportmanager.bucket",
+                    ),
+                ),
+                (
+                    "entry",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="representative",
+                        to="reportmanager.reportentry",
+                    ),
+                ),
+            ],
+        ),
+        migrations.RunPython(fill_bucket_representatives, migrations.RunPython.noop),
+    )
@@ -0,0 +1,69 @@
+# Generated by Django 4.2.30 on 2026-10-18 22:04
+
+from collections import Counter
+from datetime import timedelta
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def fill_bucket_hit_rollups(apps, schema_editor):
+    BucketHit = apps.get_model("reportmanager", "BucketHit")
+    BucketHitRollup = apps.get_model("reportmanager", "BucketHitRollup")
+    counts = Counter()
+    for bucket_id, begin, count in (
+        BucketHit.objects.filter(count__gt=0)
+        .values_list("bucket_id", "begin", "count")
+        .iterator()
+    ):
+        day = begin.replace(microsecond=0, second=0, minute=0, hour=0)
+        counts[(bucket_id, "day", day)] += count
+        counts[(bucket_id, "week", day - timedelta(days=day.weekday()))] += count
+    BucketHitRollup.objects.bulk_create(
+        (
+            BucketHitRollup(
+                bucket_id=bucket_id, resolution=resolution, begin=begin, count=count
+            )
+            for (bucket_id, resolution, begin), count in counts.items()
+        ),
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = (("reportmanager", "0014_bucketrepresentative"),)
+
+    operations = (
+        migrations.CreateModel(
+            name="BucketHitRollup",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("resolution", models.CharField(max_length=4)),
+                ("begin", models.DateTimeField()),
+                ("count", models.IntegerField(default=0)),
+                (
+                    "bucket",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="reportmanager.bucket",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="buckethitrollup",
+            constraint=models.UniqueConstraint(
+                fields=("bucket", "resolution", "begin"),
+                name="unique_buckethitrollups",
+            ),
+        ),
+        migrations.RunPython(fill_bucket_hit_rollups, migrations.RunPython.noop),
+    )
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.30 on 2026-10-18 22:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("reportmanager", "0015_buckethitrollup"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="BucketRevision",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("revision", models.BigIntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -2,9 +2,14 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 import json
+import operator
 import re
 import sys
+import threading
+from collections import Counter
+from contextlib import contextmanager
 from datetime import timedelta
+from functools import reduce
 from logging import getLogger
 from urllib.parse import urlsplit
 
@@ -14,16 +19,18 @@ from django.contrib.auth.models import User as DjangoUser
 from django.contrib.contenttypes.models import ContentType
 from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models, transaction
-from django.db.models.functions import Length
+from django.db.models.functions import Cast, Greatest, Length
 from django.db.models.signals import post_delete, post_save
 from django.dispatch.dispatcher import receiver
 from django.utils import timezone
 from enumfields import Enum, EnumField
 from notifications.signals import notify
 
-from webcompat.models import Report, Signature
+from webcompat.models import LazyReport, ReportBatch
 from webcompat.symptoms import URLSymptom, ValueMatcher
 
+from .caches import SIGNATURE_CACHE, DimensionCache
+
 if getattr(settings, "USE_CELERY", None):
     from .tasks import triage_new_report
 
@@ -34,6 +41,15 @@ else:
 
 LOG = getLogger("reportmanager")
 
+UTF8_4BYTE_RE = re.compile("[^\u0000-\ud7ff\ue000-\uffff]", re.UNICODE)
+
+# pending BucketHit, ReportHit and BucketStats changes for this thread,
+# see BucketHit.deferred()
+_DEFERRED_HITS = threading.local()
+
+# number of entries fetched and matched at once by Bucket.optimize_signature()
+OPTIMIZE_CHUNK_SIZE = 1000
+
 
 # these enable `{field}__length` filtering in Django
 models.CharField.register_lookup(Length)
@@ -84,6 +100,17 @@ class Bucket(models.Model):
             ),
         )
 
+    def __init__(self, *args, **kwargs):
+        self._original_signature = None
+        super().__init__(*args, **kwargs)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if "signature" in field_names:
+            instance._original_signature = instance.signature
+        return instance
+
     @property
     def watchers(self):
         ids = User.objects.filter(
@@ -92,7 +119,10 @@ class Bucket(models.Model):
         return DjangoUser.objects.filter(id__in=ids).distinct()
 
     def get_signature(self):
-        return Signature(self.signature)
+        """Return the parsed signature of this bucket. The object is shared through
+        the process-wide signature cache, so it must not be modified.
+        """
+        return SIGNATURE_CACHE.get(self.signature)
 
     def save(self, *args, **kwargs):
         modified = set()
@@ -124,6 +154,10 @@ class Bucket(models.Model):
 
         super().save(*args, **kwargs)
 
+        if self._original_signature not in (None, self.signature):
+            SIGNATURE_CACHE.discard(self._original_signature)
+        self._original_signature = self.signature
+
     def reassign(self, submit_save, limit=None, offset=None):
         """Assign all issues that match our signature to this bucket from
         lower-priority buckets. Furthermore, remove all non-matching issues
@@ -132,14 +166,20 @@ class Bucket(models.Model):
         We only actually save if "submit_save" is set.
         For previewing, we just count how many issues would be assigned and removed.
         """
+        from .pushdown import compile_signature
+        from .reassign import MATCH_BATCH_SIZE, ReassignMatcher
         from .serializers import ReportEntryVueSerializer
 
         in_list, out_list = [], []
         in_list_count, out_list_count = 0, 0
 
         signature = self.get_signature()
+        # The database only selects candidates from other buckets, all entries of
+        # this bucket must be checked.
+        pushdown, _ = compile_signature(signature)
         entries = ReportEntry.objects.filter(
-            models.Q(bucket__priority__lt=self.priority) | models.Q(bucket=self)
+            (models.Q(bucket__priority__lt=self.priority) & pushdown)
+            | models.Q(bucket=self)
         ).select_related(
             # these are used by get_report
             "app",
@@ -169,134 +209,181 @@ class Bucket(models.Model):
                 next_offset = (offset or 0) + limit
             entry_ids = entry_ids[:limit]
 
-        # If we are saving, we only care about the id of each entry
+        # If we are saving, we only care about the id of each entry, and matching
+        # may be spread across worker processes.
         # Otherwise, we save the entire object. Limit to the first 100 entries to avoid
         # OOM.
-        MATCH_BATCH_SIZE = 100
-        for entry_ids_batch in batched(entry_ids, MATCH_BATCH_SIZE):
-            for entry in entries.filter(id__in=entry_ids_batch):
-                match = signature.matches(entry.get_report())
-                if match and entry.bucket != self:
-                    if submit_save:
-                        in_list.append(entry.pk)
-                    elif len(in_list) < MATCH_BATCH_SIZE:
-                        in_list.append(ReportEntryVueSerializer(entry).data)
-                    in_list_count += 1
-                elif not match and entry.bucket == self:
-                    if submit_save:
-                        out_list.append(entry.pk)
-                    elif len(out_list) < MATCH_BATCH_SIZE:
-                        out_list.append(ReportEntryVueSerializer(entry).data)
-                    out_list_count += 1
+        if submit_save:
+            in_list, out_list = ReassignMatcher().match(signature, self.pk, entry_ids)
+            in_list_count, out_list_count = len(in_list), len(out_list)
+        else:
+            for entry_ids_batch in batched(entry_ids, MATCH_BATCH_SIZE):
+                for entry in entries.filter(id__in=entry_ids_batch):
+                    match = signature.matches(entry.get_report())
+                    if match and entry.bucket != self:
+                        if len(in_list) < MATCH_BATCH_SIZE:
+                            in_list.append(ReportEntryVueSerializer(entry).data)
+                        in_list_count += 1
+                    elif not match and entry.bucket == self:
+                        if len(out_list) < MATCH_BATCH_SIZE:
+                            out_list.append(ReportEntryVueSerializer(entry).data)
+                        out_list_count += 1
 
         if submit_save:
             UPDATE_BATCH_SIZE = 500
             for entry_ids_batch in batched(in_list, UPDATE_BATCH_SIZE):
-                for report in ReportEntry.objects.filter(pk__in=entry_ids_batch).values(
-                    "bucket_id",
-                    "reported_at",
-                ):
-                    if report["bucket_id"] != self.id:
-                        if report["bucket_id"] is not None:
-                            BucketHit.decrement_count(
-                                report["bucket_id"],
-                                report["reported_at"],
-                            )
-                        BucketHit.increment_count(self.id, report["reported_at"])
-                ReportEntry.objects.filter(pk__in=entry_ids_batch).update(bucket=self)
+                hits = Counter()
+                changes = []
+                for entry_id, bucket_id, reported_at in ReportEntry.objects.filter(
+                    pk__in=entry_ids_batch
+                ).values_list("id", "bucket_id", "reported_at"):
+                    if bucket_id != self.id:
+                        if bucket_id is not None:
+                            hits[(bucket_id, reported_at)] -= 1
+                            changes.append((bucket_id, entry_id, reported_at, -1))
+                        hits[(self.id, reported_at)] += 1
+                        changes.append((self.id, entry_id, reported_at, 1))
+                with transaction.atomic():
+                    ReportEntry.objects.filter(pk__in=entry_ids_batch).update(
+                        bucket=self
+                    )
+                    BucketHit.apply_deltas(hits)
+                    BucketStats.apply_changes(changes)
             for entry_ids_batch in batched(out_list, UPDATE_BATCH_SIZE):
-                for report in ReportEntry.objects.filter(pk__in=entry_ids_batch).values(
-                    "bucket_id", "reported_at"
-                ):
-                    if report["bucket_id"] is not None:
-                        BucketHit.decrement_count(
-                            report["bucket_id"], report["reported_at"]
-                        )
-                ReportEntry.objects.filter(pk__in=entry_ids_batch).update(bucket=None)
+                hits = Counter()
+                changes = []
+                for entry_id, bucket_id, reported_at in ReportEntry.objects.filter(
+                    pk__in=entry_ids_batch
+                ).values_list("id", "bucket_id", "reported_at"):
+                    if bucket_id is not None:
+                        hits[(bucket_id, reported_at)] -= 1
+                        changes.append((bucket_id, entry_id, reported_at, -1))
+                with transaction.atomic():
+                    ReportEntry.objects.filter(pk__in=entry_ids_batch).update(
+                        bucket=None
+                    )
+                    BucketHit.apply_deltas(hits)
+                    BucketStats.apply_changes(changes)
 
         return in_list, out_list, in_list_count, out_list_count, next_offset
 
     def optimize_signature(self, unbucketed_entries):
-        buckets = Bucket.objects.all()
+        """Find a signature derived from ours which matches some of the given
+        entries, without matching entries of other buckets.
 
-        signature = self.get_signature()
+        Entries are streamed from the database in chunks, so memory use doesn't
+        depend on the number of entries.
 
-        entries = unbucketed_entries
+        @type unbucketed_entries: QuerySet
+        @param unbucketed_entries: ReportEntry queryset to optimize for
 
-        optimized_signature = None
-        matching_entries = []
+        @rtype: tuple
+        @return: (optimized Signature or None, list of ids of matching entries)
+        """
+        from .pushdown import compile_signature, match_residual_batch
 
-        # Avoid hitting the database multiple times when looking for the first
-        # entry of a bucket. Keeping these in memory is less expensive.
-        first_entry_per_bucket_cache = {}
+        signature = self.get_signature()
+        fields = signature.report_fields
+
+        optimized_signature = None
+        matching_entry_ids = []
 
-        for entry in entries:
-            entry.reportinfo = entry.get_report()
+        # representatives of all buckets, loaded once a candidate is found
+        samples = None
 
+        for chunk in batched(
+            ReportEntry.iter_reports(
+                unbucketed_entries, fields, chunk_size=OPTIMIZE_CHUNK_SIZE
+            ),
+            OPTIMIZE_CHUNK_SIZE,
+        ):
+            reports = [report for _, _, report in chunk]
             # For optimization, disregard any issues that directly match since those
             # could be incoming new issues and we don't want these to block the
             # optimization.
-            if signature.matches(entry.reportinfo):
-                continue
+            matched = signature.match_batch(ReportBatch(reports))
+            for row, report in enumerate(reports):
+                if matched >> row & 1:
+                    continue
+
+                optimized_signature = signature.fit(report)
+                if not optimized_signature:
+                    continue
 
-            optimized_signature = signature.fit(entry.reportinfo)
-            if optimized_signature:
                 # We now try to determine how this signature will behave in other
-                # buckets. If the signature matches lots of other buckets as well, it is
-                # likely too broad and we should not consider it (or later rate it worse
-                # than others).
-                matches_in_other_buckets = False
-                non_matches_in_other_buckets = 0  # noqa
-                other_matching_bucket_ids = []  # noqa
-                for other_bucket in buckets:
-                    if other_bucket.pk == self.pk:
-                        continue
-
-                    if (
-                        self.bug
-                        and other_bucket.bug
-                        and self.bug.pk == other_bucket.bug.pk
-                    ):
-                        # Allow matches in other buckets if they are both linked to the
-                        # same bug
-                        continue
-
-                    if other_bucket.pk not in first_entry_per_bucket_cache:
-                        c = ReportEntry.objects.filter(
-                            bucket=other_bucket
-                        ).select_related("app", "breakage_category", "os")
-                        c = c.first()
-                        first_entry_per_bucket_cache[other_bucket.pk] = c
-                        if c:
-                            first_entry_per_bucket_cache[other_bucket.pk] = (
-                                c.get_report()
+                # buckets. If the signature matches lots of other buckets as well, it
+                # is likely too broad and we should not consider it (or later rate it
+                # worse than others).
+                if samples is None:
+                    samples = BucketSamples(fields)
+                    # Allow matches in other buckets if they are both linked to the
+                    # same bug
+                    allowed_bucket_ids = {self.pk}
+                    if self.bug_id:
+                        allowed_bucket_ids.update(
+                            Bucket.objects.filter(bug=self.bug_id).values_list(
+                                "id", flat=True
                             )
-
-                    first_entry_report = first_entry_per_bucket_cache[other_bucket.pk]
-                    if first_entry_report and optimized_signature.matches(
-                        first_entry_report
-                    ):
-                        matches_in_other_buckets = True
-                        break
-
-                if matches_in_other_buckets:
+                        )
+                if samples.matching_buckets(optimized_signature) - allowed_bucket_ids:
                     # Reset, we don't actually have an optimized signature if it's
                     # matching some other bucket as well.
                     optimized_signature = None
-                else:
-                    for other_entry in entries:
-                        other_entry.reportinfo = other_entry.get_report()
-                        if optimized_signature.matches(other_entry.reportinfo):
-                            matching_entries.append(other_entry)
+                    continue
+
+                pushdown, residual = compile_signature(optimized_signature)
+                residual_fields = {symptom.report_field for symptom in residual}
+                for other_chunk in batched(
+                    ReportEntry.iter_reports(
+                        unbucketed_entries.filter(pushdown),
+                        residual_fields,
+                        chunk_size=OPTIMIZE_CHUNK_SIZE,
+                    ),
+                    OPTIMIZE_CHUNK_SIZE,
+                ):
+                    other_matched = match_residual_batch(
+                        residual,
+                        ReportBatch(other_report for _, _, other_report in other_chunk),
+                    )
+                    matching_entry_ids.extend(
+                        entry_id
+                        for other_row, (entry_id, _, _) in enumerate(other_chunk)
+                        if other_matched >> other_row & 1
+                    )
+
+                # Fallback for when the optimization algorithm failed for some
+                # reason
+                if not matching_entry_ids:
+                    optimized_signature = None
+
+                return (optimized_signature, matching_entry_ids)
+
+        return (optimized_signature, matching_entry_ids)
+
+
+class BucketRevision(models.Model):
+    """Single row counting the changes of buckets. It is incremented in the
+    transaction saving or deleting a bucket, so each process can tell whether its
+    signature index (see `reportmanager.triage`) is stale.
+    """
+
+    revision = models.BigIntegerField(default=0)
 
-                    # Fallback for when the optimization algorithm failed for some
-                    # reason
-                    if not matching_entries:
-                        optimized_signature = None
+    @classmethod
+    def get(cls):
+        return cls.objects.filter(pk=1).values_list("revision", flat=True).first() or 0
 
-                    break
+    @classmethod
+    def bump(cls):
+        """Increment the revision
 
-        return (optimized_signature, matching_entries)
+        @rtype: int
+        @return: The new revision
+        """
+        with transaction.atomic():
+            cls.objects.get_or_create(pk=1)
+            cls.objects.filter(pk=1).update(revision=models.F("revision") + 1)
+            return cls.get()
 
 
 class BucketColor(models.Model):
@@ -339,6 +426,70 @@ class Bug(models.Model):
     closed = models.DateTimeField(blank=True, null=True)
 
 
+def _counters_filter(fields, keys):
+    """Return a Q object selecting the counters with the given keys"""
+    # counters sharing all but the last field are selected with one IN lookup, eg.
+    # the hours of a bucket
+    last_values = {}
+    for key in keys:
+        last_values.setdefault(key[:-1], []).append(key[-1])
+    return reduce(
+        operator.or_,
+        (
+            models.Q(**dict(zip(fields, prefix)), **{f"{fields[-1]}__in": values})
+            for prefix, values in last_values.items()
+        ),
+    )
+
+
+def _lock_counters(model, fields, counters):
+    """Lock counters in the order of their key, in the current transaction.
+
+    The row locks taken by an UPDATE are in no particular order, so updates of
+    counters shared with a concurrent caller could deadlock. Once locked in key
+    order, the counters can be updated in any order.
+    """
+    if transaction.get_connection(model.objects.db).features.has_select_for_update:
+        list(
+            model.objects.select_for_update()
+            .filter(counters)
+            .order_by(*fields)
+            .values_list("pk", flat=True)
+        )
+
+
+def _apply_counter_deltas(model, fields, changes):
+    """Add to many counters of model at once, in the current transaction.
+
+    Counters are rows with a `count` field, unique by fields. Missing counters are
+    created, and counters never go below zero.
+
+    Arguments:
+        changes: list of (values of fields, delta) tuples, sorted by key
+    """
+    # make sure all counters being incremented exist, so the increment can be
+    # done atomically in the database even if rows are created concurrently
+    model.objects.bulk_create(
+        [
+            model(**dict(zip(fields, key)), count=0)
+            for key, delta in changes
+            if delta > 0
+        ],
+        ignore_conflicts=True,
+    )
+    for changes_batch in batched(changes, 500):
+        _lock_counters(
+            model, fields, _counters_filter(fields, [key for key, _ in changes_batch])
+        )
+        by_delta = {}
+        for key, delta in changes_batch:
+            by_delta.setdefault(delta, []).append(key)
+        for delta, keys in by_delta.items():
+            model.objects.filter(_counters_filter(fields, keys)).update(
+                count=Greatest(models.F("count") + delta, 0)
+            )
+
+
 def buckethit_default_range_begin():
     return timezone.now().replace(microsecond=0, second=0, minute=0)
 
@@ -348,31 +499,82 @@ class BucketHit(models.Model):
     begin = models.DateTimeField(default=buckethit_default_range_begin)
     count = models.IntegerField(default=0)
 
+    @staticmethod
+    def get_begin(time):
+        """Return the start of the hour containing time"""
+        return time.replace(microsecond=0, second=0, minute=0)
+
+    @classmethod
+    def apply_deltas(cls, deltas):
+        """Apply changes to many counters at once.
+
+        Arguments:
+            deltas: mapping of (bucket_id, time) to the amount to add to the counter
+                    for the hour containing time. Counters never go below zero.
+
+        The day and week counters of BucketHitRollup are updated too.
+        """
+        merged = Counter()
+        for (bucket_id, begin), delta in deltas.items():
+            merged[(bucket_id, cls.get_begin(begin))] += delta
+        # sort to lock rows in the same order as any concurrent caller
+        changes = sorted((key, delta) for key, delta in merged.items() if delta)
+        if not changes:
+            return
+
+        with transaction.atomic():
+            _apply_counter_deltas(cls, ("bucket_id", "begin"), changes)
+            BucketHitRollup.apply_deltas(changes)
+
+    @classmethod
+    @contextmanager
+    def deferred(cls):
+        """Accumulate counter changes made through `add_delta()` in this thread (eg.
+        by the ReportEntry signal receivers) and apply them together on exit.
+
+        This also applies to the ReportHit counters and BucketStats.
+        """
+        if getattr(_DEFERRED_HITS, "deltas", None) is not None:
+            # already deferred by an outer block
+            yield
+            return
+        _DEFERRED_HITS.deltas = deltas = Counter()
+        _DEFERRED_HITS.report_deltas = report_deltas = Counter()
+        _DEFERRED_HITS.stats_changes = stats_changes = []
+        try:
+            yield
+        except BaseException:
+            # changes committed outside of a transaction must still be counted
+            if not transaction.get_connection().in_atomic_block:
+                cls.apply_deltas(deltas)
+                ReportHit.apply_deltas(report_deltas)
+                BucketStats.apply_changes(stats_changes)
+            raise
+        else:
+            cls.apply_deltas(deltas)
+            ReportHit.apply_deltas(report_deltas)
+            BucketStats.apply_changes(stats_changes)
+        finally:
+            _DEFERRED_HITS.deltas = None
+            _DEFERRED_HITS.report_deltas = None
+            _DEFERRED_HITS.stats_changes = None
+
+    @classmethod
+    def add_delta(cls, bucket_id, begin, delta):
+        """Change a single counter, or accumulate the change if in `deferred()`"""
+        deltas = getattr(_DEFERRED_HITS, "deltas", None)
+        if deltas is not None:
+            deltas[(bucket_id, cls.get_begin(begin))] += delta
+        else:
+            cls.apply_deltas({(bucket_id, begin): delta})
+
     @classmethod
-    @transaction.atomic
     def decrement_count(cls, bucket_id, begin):
-        begin = begin.replace(microsecond=0, second=0, minute=0)
-        counter = (
-            cls.objects.select_for_update()
-            .filter(
-                bucket_id=bucket_id,
-                begin=begin,
-            )
-            .first()
-        )
-        if counter is not None and counter.count > 0:
-            counter.count -= 1
-            counter.save()
+        cls.add_delta(bucket_id, begin, -1)
 
     @classmethod
-    @transaction.atomic
     def increment_count(cls, bucket_id, begin):
-        begin = begin.replace(microsecond=0, second=0, minute=0)
-        counter, _ = cls.objects.select_for_update().get_or_create(
-            bucket_id=bucket_id, begin=begin
-        )
-        counter.count += 1
-        counter.save()
+        cls.add_delta(bucket_id, begin, 1)
 
     class Meta:
         constraints = (
@@ -383,6 +585,169 @@ class BucketHit(models.Model):
         )
 
 
+class BucketHitRollup(models.Model):
+    """Number of entries of a bucket per day or week (UTC, weeks start on Monday).
+
+    These are updated along with the hourly BucketHit counters, so longer periods
+    can be shown without reading every hour.
+    """
+
+    RESOLUTIONS = ("day", "week")
+
+    bucket = models.ForeignKey(Bucket, on_delete=models.deletion.CASCADE)
+    resolution = models.CharField(max_length=4)
+    begin = models.DateTimeField()
+    count = models.IntegerField(default=0)
+
+    @staticmethod
+    def get_begin(time, resolution):
+        """Return the start of the day or week containing time"""
+        begin = time.replace(microsecond=0, second=0, minute=0, hour=0)
+        if resolution == "week":
+            begin -= timedelta(days=begin.weekday())
+        return begin
+
+    @classmethod
+    def apply_deltas(cls, changes):
+        """Apply changes of hourly counters to the rollups, in the current
+        transaction (see `BucketHit.apply_deltas()`).
+
+        Arguments:
+            changes: iterable of ((bucket_id, begin), delta) tuples
+        """
+        merged = Counter()
+        for (bucket_id, begin), delta in changes:
+            for resolution in cls.RESOLUTIONS:
+                merged[(bucket_id, resolution, cls.get_begin(begin, resolution))] += (
+                    delta
+                )
+        _apply_counter_deltas(
+            cls,
+            ("bucket_id", "resolution", "begin"),
+            sorted((key, delta) for key, delta in merged.items() if delta),
+        )
+
+    class Meta:
+        constraints = (
+            models.UniqueConstraint(
+                fields=["bucket", "resolution", "begin"],
+                name="unique_buckethitrollups",
+            ),
+        )
+
+
+class BucketStats(models.Model):
+    """Size and most recent entry of a bucket.
+
+    These are updated as entries are added to or removed from the bucket, instead
+    of being aggregated from ReportEntry on every request. Buckets without entries
+    may have no row. The rebuild_bucket_stats command recomputes all rows.
+    """
+
+    bucket = models.OneToOneField(
+        Bucket,
+        on_delete=models.deletion.CASCADE,
+        primary_key=True,
+        related_name="stats",
+    )
+    size = models.IntegerField(default=0)
+    latest_report = models.DateTimeField(null=True)
+    latest_entry_id = models.IntegerField(null=True)
+
+    @classmethod
+    def apply_changes(cls, changes):
+        """Update the stats of many buckets at once.
+
+        Arguments:
+            changes: iterable of (bucket_id, entry_id, reported_at, delta) tuples,
+                     delta is 1 for an entry added to the bucket, and -1 for an
+                     entry removed from it.
+        """
+        # bucket_id -> [size delta, latest added report, latest added id,
+        #               latest removed report, latest removed id]
+        summary = {}
+        for bucket_id, entry_id, reported_at, delta in changes:
+            item = summary.setdefault(bucket_id, [0, None, None, None, None])
+            item[0] += delta
+            offset = 1 if delta > 0 else 3
+            if item[offset] is None or reported_at > item[offset]:
+                item[offset] = reported_at
+            if item[offset + 1] is None or entry_id > item[offset + 1]:
+                item[offset + 1] = entry_id
+        if not summary:
+            return
+
+        with transaction.atomic():
+            # only buckets with new entries need a row, removing entries from a
+            # bucket without stats is a no-op
+            cls.objects.bulk_create(
+                [
+                    cls(bucket_id=bucket_id)
+                    for bucket_id, item in sorted(summary.items())
+                    if item[1] is not None
+                ],
+                ignore_conflicts=True,
+            )
+            rows = []
+            for bucket_ids in batched(sorted(summary), 500):
+                rows.extend(
+                    cls.objects.select_for_update()
+                    .filter(bucket_id__in=bucket_ids)
+                    .order_by("bucket_id")
+                )
+
+            stale = []
+            for stats in rows:
+                size_delta, add_report, add_id, rm_report, rm_id = summary[
+                    stats.bucket_id
+                ]
+                stats.size = max(stats.size + size_delta, 0)
+                if rm_id is not None and (
+                    stats.latest_entry_id is None
+                    or stats.latest_report is None
+                    or rm_id >= stats.latest_entry_id
+                    or rm_report >= stats.latest_report
+                ):
+                    # the latest entry may have been removed, recompute below
+                    stale.append(stats)
+                elif add_id is not None:
+                    if stats.latest_report is None or add_report > stats.latest_report:
+                        stats.latest_report = add_report
+                    if stats.latest_entry_id is None or add_id > stats.latest_entry_id:
+                        stats.latest_entry_id = add_id
+
+            latest = {}
+            for stale_batch in batched(stale, 500):
+                latest.update(
+                    (bucket_id, (latest_report, latest_entry_id))
+                    for bucket_id, latest_report, latest_entry_id in (
+                        ReportEntry.objects.filter(
+                            bucket_id__in=[stats.bucket_id for stats in stale_batch]
+                        )
+                        .values("bucket_id")
+                        .annotate(models.Max("reported_at"), models.Max("id"))
+                        .values_list("bucket_id", "reported_at__max", "id__max")
+                    )
+                )
+            for stats in stale:
+                stats.latest_report, stats.latest_entry_id = latest.get(
+                    stats.bucket_id, (None, None)
+                )
+
+            cls.objects.bulk_update(
+                rows, ["size", "latest_report", "latest_entry_id"], batch_size=500
+            )
+
+    @classmethod
+    def add_change(cls, bucket_id, entry_id, reported_at, delta):
+        """Record a single change, or accumulate it if in `BucketHit.deferred()`"""
+        changes = getattr(_DEFERRED_HITS, "stats_changes", None)
+        if changes is not None:
+            changes.append((bucket_id, entry_id, reported_at, delta))
+        else:
+            cls.apply_changes([(bucket_id, entry_id, reported_at, delta)])
+
+
 class BucketWatch(models.Model):
     user = models.ForeignKey("User", on_delete=models.deletion.CASCADE)
     bucket = models.ForeignKey(Bucket, on_delete=models.deletion.CASCADE)
@@ -396,9 +761,21 @@ class OS(models.Model):
     name = models.CharField(max_length=63, unique=True)
 
 
+# cache key of the ReportStatsViewSet payload
+REPORT_STATS_CACHE_KEY = "reportmanager:report-stats"
+
+
 class ReportHit(models.Model):
+    """Number of report entries per hour, keyed by the end of the hour.
+
+    Counters are updated as entries are created and deleted. Hours changed after
+    they ended (late arrivals or deletions) are flagged dirty, and recounted by
+    the update_report_stats cron task.
+    """
+
     last_update = models.DateTimeField(default=timezone.now)
     count = models.BigIntegerField(default=0)
+    dirty = models.BooleanField(default=False)
 
     @staticmethod
     def get_period(time):
@@ -416,6 +793,54 @@ class ReportHit(models.Model):
             microseconds=-time.microsecond,
         )
 
+    @classmethod
+    def apply_deltas(cls, deltas):
+        """Apply changes to many counters at once.
+
+        Arguments:
+            deltas: mapping of time to the amount to add to the counter for the
+                    hour containing time. Counters never go below zero.
+        """
+        merged = Counter()
+        for time, delta in deltas.items():
+            merged[cls.get_period(time)] += delta
+        changes = sorted((period, delta) for period, delta in merged.items() if delta)
+        if not changes:
+            return
+
+        cur_period = cls.get_period(timezone.now())
+        with transaction.atomic():
+            cls.objects.bulk_create(
+                [cls(last_update=period, count=0) for period, _ in changes],
+                ignore_conflicts=True,
+            )
+            for changes_batch in batched(changes, 500):
+                _lock_counters(
+                    cls,
+                    ("last_update",),
+                    models.Q(last_update__in=[period for period, _ in changes_batch]),
+                )
+                by_delta = {}
+                for period, delta in changes_batch:
+                    dirty = delta < 0 or period < cur_period
+                    by_delta.setdefault((delta, dirty), []).append(period)
+                for (delta, dirty), periods in by_delta.items():
+                    updates = {"count": Greatest(models.F("count") + delta, 0)}
+                    if dirty:
+                        updates["dirty"] = True
+                    cls.objects.filter(last_update__in=periods).update(**updates)
+
+    @classmethod
+    def add_delta(cls, time, delta):
+        """Change a single counter, or accumulate the change if in
+        `BucketHit.deferred()`
+        """
+        deltas = getattr(_DEFERRED_HITS, "report_deltas", None)
+        if deltas is not None:
+            deltas[cls.get_period(time)] += delta
+        else:
+            cls.apply_deltas({time: delta})
+
     class Meta:
         constraints = (
             models.UniqueConstraint(
@@ -425,28 +850,42 @@ class ReportHit(models.Model):
         )
 
 
+# ids of lookup table rows, by natural key
+DIMENSION_CACHE_SIZE = getattr(settings, "DIMENSION_CACHE_SIZE", 1024)
+APP_CACHE = DimensionCache(App, ("channel", "name", "version"), DIMENSION_CACHE_SIZE)
+BREAKAGE_CATEGORY_CACHE = DimensionCache(
+    BreakageCategory, ("value",), DIMENSION_CACHE_SIZE
+)
+OS_CACHE = DimensionCache(OS, ("name",), DIMENSION_CACHE_SIZE)
+
+
+def sanitize_utf8(s):
+    """Replace 4-byte UTF-8 characters in s with U+FFFD"""
+    if not isinstance(s, str):
+        s = str(s, "utf-8")
+
+    return UTF8_4BYTE_RE.sub("\ufffd", s)
+
+
 class ReportEntryManager(models.Manager):
     @transaction.atomic
     def create_from_report(self, report, bucket_id=None):
-        app = App.objects.get_or_create(
-            channel=report.app_channel,
-            name=report.app_name,
-            version=report.app_version,
-        )[0]
         if report.breakage_category is not None:
-            breakage = BreakageCategory.objects.get_or_create(
-                value=report.breakage_category,
-            )[0]
+            breakage_id = BREAKAGE_CATEGORY_CACHE.get_id(value=report.breakage_category)
         else:
-            breakage = None
-        os = OS.objects.get_or_create(name=report.os)[0]
+            breakage_id = None
         return self.create(
-            app=app,
-            breakage_category=breakage,
+            app_id=APP_CACHE.get_id(
+                channel=report.app_channel,
+                name=report.app_name,
+                version=report.app_version,
+            ),
+            breakage_category_id=breakage_id,
             url=report.url.geturl(),
+            **ReportEntry.get_url_parts(report.url),
             uuid=report.uuid,
             reported_at=report.reported_at,
-            os=os,
+            os_id=OS_CACHE.get_id(name=report.os),
             details=report.details,
             comments=report.comments,
             comments_translated=report.comments_translated,
@@ -456,6 +895,27 @@ class ReportEntryManager(models.Manager):
         )
 
 
+URL_PART_MAX_LENGTH = 255
+
+# Report field -> ReportEntry lookup
+REPORT_FIELD_LOOKUPS = {
+    "app_channel": "app__channel",
+    "app_name": "app__name",
+    "app_version": "app__version",
+    "breakage_category": "breakage_category__value",
+    "comments": "comments",
+    "comments_original_language": "comments_original_language",
+    "comments_translated": "comments_translated",
+    # the JSON text, decoded by LazyReport when used
+    "details": "details_text",
+    "ml_valid_probability": "ml_valid_probability",
+    "os": "os__name",
+    "reported_at": "reported_at",
+    "url": "url",
+    "uuid": "uuid",
+}
+
+
 class ReportEntry(models.Model):
     app = models.ForeignKey(App, on_delete=models.deletion.CASCADE)
     breakage_category = models.ForeignKey(
@@ -469,6 +929,13 @@ class ReportEntry(models.Model):
     os = models.ForeignKey(OS, on_delete=models.deletion.CASCADE)
     reported_at = models.DateTimeField()
     url = models.URLField(max_length=8192)
+    # parts of url, for filtering in the database. hostname and scheme are None if
+    # they don't fit in the column (or the url has no hostname).
+    hostname = models.CharField(
+        max_length=URL_PART_MAX_LENGTH, null=True, db_index=True
+    )
+    path = models.TextField(null=True)
+    scheme = models.CharField(max_length=URL_PART_MAX_LENGTH, null=True, db_index=True)
     uuid = models.UUIDField(unique=True)
     ml_valid_probability = models.FloatField(null=True)
 
@@ -485,34 +952,117 @@ class ReportEntry(models.Model):
         instance._original_bucket = instance.bucket_id
         return instance
 
-    def save(self, *args, **kwargs):
-        modified = set()
+    def sanitize(self):
+        """Prepare fields of a new entry for insertion into the database.
 
-        if self.pk is None and not getattr(settings, "DB_ISUTF8MB4", False):
-            # Replace 4-byte UTF-8 characters with U+FFFD if our database
-            # doesn't support them. By default, MySQL utf-8 does not support these.
-            utf8_4byte_re = re.compile("[^\u0000-\ud7ff\ue000-\uffff]", re.UNICODE)
+        This is done by save(), and must be called for entries created by other
+        means (eg. bulk_create).
 
-            def sanitize_utf8(s):
-                if not isinstance(s, str):
-                    s = str(s, "utf-8")
+        @rtype: set
+        @return: names of fields that were modified
+        """
+        modified = set()
 
-                return utf8_4byte_re.sub("\ufffd", s)
+        if self.path is None:
+            for field, value in self.get_url_parts(urlsplit(self.url)).items():
+                setattr(self, field, value)
+                modified.add(field)
 
+        if not getattr(settings, "DB_ISUTF8MB4", False):
+            # Replace 4-byte UTF-8 characters with U+FFFD if our database
+            # doesn't support them. By default, MySQL utf-8 does not support these.
             comments = sanitize_utf8(self.comments)
             if self.comments != comments:
                 self.comments = comments
                 modified.add("comments")
 
+        return modified
+
+    @staticmethod
+    def get_url_parts(url):
+        """Return the values of the url part fields for the given split url"""
+        hostname, scheme = url.hostname, url.scheme
+        if hostname is not None and len(hostname) > URL_PART_MAX_LENGTH:
+            hostname = None
+        if len(scheme) > URL_PART_MAX_LENGTH:
+            scheme = None
+        return {"hostname": hostname, "path": url.path, "scheme": scheme}
+
+    def save(self, *args, **kwargs):
+        modified = set()
+
+        if self.pk is None:
+            modified = self.sanitize()
+
         # required in Django 4.2+
         if "update_fields" in kwargs and kwargs["update_fields"] is not None:
             kwargs["update_fields"] = modified.union(kwargs["update_fields"])
 
         super().save(*args, **kwargs)
 
+    @staticmethod
+    def iter_reports(entries, fields, chunk_size=None):
+        """Load the reports of entries, with only the given Report fields set.
+
+        Rows are fetched with `values_list()` instead of creating model instances,
+        and details are only decoded if used, so this needs much less memory than
+        `get_report()` for large numbers of entries. With chunk_size, rows are
+        fetched in pages of chunk_size entries by id (like `BulkTriage`), so
+        memory use is bounded on all database backends. Pages are in ascending id
+        order, or descending if entries are ordered by "-id".
+
+        @type entries: QuerySet
+        @param entries: ReportEntry queryset
+
+        @type fields: Iterable[str]
+        @param fields: Report fields to load (eg. `Signature.report_fields`)
+
+        @type chunk_size: int
+        @param chunk_size: Number of rows to fetch from the database at once
+
+        @rtype: Iterator[tuple]
+        @return: (entry id, bucket id, LazyReport) for each entry
+        """
+        fields = sorted(fields)
+        if "details" in fields:
+            entries = entries.annotate(
+                details_text=Cast("details", output_field=models.TextField())
+            )
+        rows = entries.values_list(
+            "id", "bucket_id", *(REPORT_FIELD_LOOKUPS[field] for field in fields)
+        )
+        if chunk_size is not None:
+            rows = ReportEntry._iter_pages(rows, chunk_size)
+        if "details" in fields:
+            fields[fields.index("details")] = "details_text"
+        for pk, bucket_id, *values in rows:
+            yield pk, bucket_id, LazyReport(**dict(zip(fields, values)))
+
+    @staticmethod
+    def _iter_pages(rows, chunk_size):
+        # drivers like MySQLdb buffer whole result sets on the client, even with
+        # `iterator()`, so each page is a separate query
+        if tuple(rows.query.order_by) in (("-id",), ("-pk",)):
+            rows, lookup = rows.order_by("-id"), "id__lt"
+        else:
+            rows, lookup = rows.order_by("id"), "id__gt"
+        page = list(rows[:chunk_size])
+        while page:
+            yield from page
+            page = list(rows.filter(**{lookup: page[-1][0]})[:chunk_size])
+
+    @staticmethod
+    def load_reports(entries, fields):
+        """Same as `iter_reports()`, as a list
+
+        @rtype: list
+        @return: (entry id, bucket id, LazyReport) for each entry
+        """
+        return list(ReportEntry.iter_reports(entries, fields))
+
     def get_report(self):
         if self._cached_report is None:
-            self._cached_report = Report(
+            self._cached_report = LazyReport(
                 app_channel=self.app.channel,
                 app_name=self.app.name,
                 app_version=self.app.version,
@@ -523,7 +1073,8 @@ class ReportEntry(models.Model):
                 os=self.os.name,
                 reported_at=self.reported_at,
                 uuid=self.uuid,
-                url=urlsplit(self.url),
+                # split when used
+                url=self.url,
                 breakage_category=(
                     self.breakage_category.value
                     if self.breakage_category is not None
@@ -554,24 +1105,179 @@ class ReportEntry(models.Model):
         return self.save()
 
 
+class BucketRepresentative(models.Model):
+    """A sampled entry of a bucket.
+
+    Up to BUCKET_REPRESENTATIVES entries of each bucket are kept, to check whether
+    a signature would also match other buckets without querying each of them (see
+    `BucketSamples`). Rows of entries which were moved to another bucket are
+    ignored until `refresh()` replaces them.
+    """
+
+    bucket = models.ForeignKey(
+        Bucket, on_delete=models.deletion.CASCADE, related_name="representatives"
+    )
+    entry = models.OneToOneField(
+        ReportEntry, on_delete=models.deletion.CASCADE, related_name="representative"
+    )
+
+    @classmethod
+    def refresh(cls):
+        """Remove representatives of entries moved to another bucket, and sample
+        new ones for buckets which have less than BUCKET_REPRESENTATIVES (and more
+        entries).
+
+        @rtype: int
+        @return: Number of representatives added
+        """
+        sample_size = getattr(settings, "BUCKET_REPRESENTATIVES", 5)
+        cls.objects.exclude(entry__bucket=models.F("bucket")).delete()
+        counts = dict(
+            cls.objects.values("bucket_id")
+            .annotate(models.Count("id"))
+            .values_list("bucket_id", "id__count")
+        )
+        added = []
+        for bucket_id, size in BucketStats.objects.filter(size__gt=0).values_list(
+            "bucket_id", "size"
+        ):
+            missing = min(size, sample_size) - counts.get(bucket_id, 0)
+            if missing <= 0:
+                continue
+            added.extend(
+                cls(bucket_id=bucket_id, entry_id=entry_id)
+                for entry_id in ReportEntry.objects.filter(
+                    bucket_id=bucket_id, representative__isnull=True
+                )
+                .order_by("?")
+                .values_list("id", flat=True)[:missing]
+            )
+        # entries may have been sampled concurrently
+        cls.objects.bulk_create(added, batch_size=500, ignore_conflicts=True)
+        return len(added)
+
+
+class BucketSamples:
+    """Reports of the representatives of all buckets, loaded in one query.
+
+    Buckets which have entries but no representatives yet (eg. created since the
+    last `BucketRepresentative.refresh()`) are sampled by their first entry.
+
+    Arguments:
+        fields: Report fields to load (eg. `Signature.report_fields` of the
+                signatures to match)
+    """
+
+    def __init__(self, fields):
+        rows = ReportEntry.load_reports(
+            ReportEntry.objects.filter(representative__bucket=models.F("bucket")),
+            fields,
+        )
+        missing = set(
+            BucketStats.objects.filter(size__gt=0).values_list("bucket_id", flat=True)
+        ) - {bucket_id for _, bucket_id, _ in rows}
+        for bucket_ids in batched(sorted(missing), 500):
+            first_ids = (
+                ReportEntry.objects.filter(bucket_id__in=bucket_ids)
+                .values("bucket_id")
+                .annotate(first_id=models.Min("id"))
+                .values("first_id")
+            )
+            rows.extend(
+                ReportEntry.load_reports(
+                    ReportEntry.objects.filter(id__in=first_ids), fields
+                )
+            )
+        self.bucket_ids = [bucket_id for _, bucket_id, _ in rows]
+        self.batch = ReportBatch(report for _, _, report in rows)
+
+    def matching_buckets(self, signature):
+        """Match signature against all representatives at once
+
+        @rtype: set
+        @return: Ids of the buckets with a representative matching signature
+        """
+        matched = signature.match_batch(self.batch)
+        return {self.bucket_ids[row] for row in ReportBatch.iter_rows(matched)}
+
+
+def notify_bucket_hits(entries_by_bucket):
+    """Notify the watchers of each bucket about new entries, without relying on
+    the ReportEntry post_save receiver (eg. after bulk updates).
+
+    Arguments:
+        entries_by_bucket: mapping of bucket id to list of ReportEntry objects
+    """
+    for bucket in Bucket.objects.filter(pk__in=entries_by_bucket):
+        watchers = bucket.watchers
+        if not watchers.exists():
+            continue
+        for entry in entries_by_bucket[bucket.pk]:
+            notify.send(
+                bucket,
+                recipient=watchers,
+                actor=bucket,
+                verb="bucket_hit",
+                target=entry,
+                level="info",
+                description=(
+                    f"The bucket {bucket.pk} received a new report entry {entry.pk}"
+                ),
+            )
+
+
+@receiver(post_save, sender=Bucket)
+def Bucket_save(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not {"priority", "signature"} & set(update_fields):
+        return
+
+    from .triage import bucket_saved
+
+    revision = BucketRevision.bump()
+    transaction.on_commit(lambda: bucket_saved(instance, revision))
+
+
+@receiver(post_delete, sender=Bucket)
+def Bucket_delete(sender, instance, **kwargs):
+    from .triage import bucket_deleted
+
+    SIGNATURE_CACHE.discard(instance.signature)
+    bucket_id = instance.pk
+    revision = BucketRevision.bump()
+    transaction.on_commit(lambda: bucket_deleted(bucket_id, revision))
+
+
 @receiver(post_delete, sender=ReportEntry)
 def ReportEntry_delete(sender, instance, **kwargs):
+    ReportHit.add_delta(instance.reported_at, -1)
     if instance.bucket_id is not None:
-        BucketHit.decrement_count(instance.bucket_id, instance.reported_at)
+        BucketHit.add_delta(instance.bucket_id, instance.reported_at, -1)
+        BucketStats.add_change(
+            instance.bucket_id, instance.pk, instance.reported_at, -1
+        )
 
 
 @receiver(post_save, sender=ReportEntry)
 def ReportEntry_save(sender, instance, created, **kwargs):
     triage = created
 
+    if created:
+        ReportHit.add_delta(instance.reported_at, 1)
+
     if instance.bucket_id != instance._original_bucket:
         if instance._original_bucket is not None:
             # remove BucketHit for old bucket
-            BucketHit.decrement_count(instance._original_bucket, instance.reported_at)
+            BucketHit.add_delta(instance._original_bucket, instance.reported_at, -1)
+            BucketStats.add_change(
+                instance._original_bucket, instance.pk, instance.reported_at, -1
+            )
 
         if instance.bucket is not None:
             # add BucketHit for new bucket
-            BucketHit.increment_count(instance.bucket_id, instance.reported_at)
+            BucketHit.add_delta(instance.bucket_id, instance.reported_at, 1)
+            BucketStats.add_change(
+                instance.bucket_id, instance.pk, instance.reported_at, 1
+            )
         else:
             triage = True
 
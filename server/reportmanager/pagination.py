@@ -0,0 +1,186 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""Pagination of the REST API."""
+
+import json
+import operator
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as Base64Error
+from datetime import date
+from functools import reduce
+from hashlib import sha1
+from uuid import UUID
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet, FieldDoesNotExist
+from django.db.models import F, JSONField, Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from .serializers import InvalidArgumentException
+
+COUNT_KEY_PREFIX = "reportmanager:count:"
+
+
+def _encode_value(value):
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, UUID):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class KeysetPagination(LimitOffsetPagination):
+    """Limit/offset pagination, with an opt-in keyset (cursor) mode.
+
+    Deep pages of limit/offset pagination run a large OFFSET, and every page runs a
+    COUNT over the filtered queryset. If the `cursor` query parameter is given
+    (empty for the first page), results are instead ordered by the active ordering
+    with `id` as a tiebreaker, and a page starts after the last row of the previous
+    one, so each page has the same cost. The `next` link holds the cursor of the
+    next page, there is no `previous` link. `count` is cached for
+    PAGINATION_COUNT_CACHE_TIMEOUT seconds.
+    """
+
+    cursor_query_param = "cursor"
+    invalid_cursor_message = "Invalid cursor"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor = request.query_params.get(self.cursor_query_param)
+        if self.cursor is None:
+            return super().paginate_queryset(queryset, request, view)
+
+        self.request = request
+        self.limit = self.get_limit(request)
+        if self.limit is None:
+            return None
+        self.ordering = self.get_ordering(queryset)
+        self.count = self.get_cached_count(queryset)
+        self.display_page_controls = False
+
+        queryset = queryset.order_by(
+            *(
+                F(name).desc(nulls_first=True) if desc else F(name).asc(nulls_last=True)
+                for name, desc in self.ordering
+            )
+        )
+        if self.cursor:
+            queryset = queryset.filter(self.get_keyset_filter(self.cursor))
+
+        page = list(queryset[: self.limit + 1])
+        self.next_cursor = None
+        if len(page) > self.limit:
+            page = page[: self.limit]
+            self.next_cursor = self.encode_cursor(
+                queryset.filter(pk=page[-1].pk)
+                .values_list(*(name for name, _ in self.ordering))
+                .get()
+            )
+        return page
+
+    def get_ordering(self, queryset):
+        """Return the ordering of queryset as a list of (name, descending) tuples,
+        ending with the primary key.
+        """
+        ordering = []
+        for name in queryset.query.order_by:
+            if not isinstance(name, str):
+                raise InvalidArgumentException(
+                    "ordering is not supported by cursor pagination"
+                )
+            desc = name.startswith("-")
+            name = name.lstrip("-")
+            if name == "pk":
+                name = "id"
+            try:
+                field = queryset.model._meta.get_field(name.split("__", 1)[0])
+            except FieldDoesNotExist:
+                # an annotation
+                field = None
+            if isinstance(field, JSONField):
+                raise InvalidArgumentException(
+                    f"ordering by {name} is not supported by cursor pagination"
+                )
+            ordering.append((name, desc))
+            if name == "id":
+                # unique, further fields never apply
+                return ordering
+        ordering.append(("id", ordering[-1][1] if ordering else False))
+        return ordering
+
+    def get_keyset_filter(self, cursor):
+        """Return a filter selecting the rows after the cursor position.
+
+        Nulls are ordered last for ascending and first for descending fields, on
+        all databases.
+        """
+        values = self.decode_cursor(cursor)
+        terms = []
+        equal = Q()
+        for (name, desc), value in zip(self.ordering, values):
+            if value is None:
+                if desc:
+                    terms.append(equal & Q(**{f"{name}__isnull": False}))
+                equal &= Q(**{f"{name}__isnull": True})
+            else:
+                after = Q(**{f"{name}__{'lt' if desc else 'gt'}": value})
+                if not desc:
+                    after |= Q(**{f"{name}__isnull": True})
+                terms.append(equal & after)
+                equal &= Q(**{name: value})
+        return reduce(operator.or_, terms)
+
+    def get_ordering_names(self):
+        return [f"-{name}" if desc else name for name, desc in self.ordering]
+
+    def encode_cursor(self, values):
+        data = {"o": self.get_ordering_names(), "v": values}
+        return urlsafe_b64encode(
+            json.dumps(data, default=_encode_value).encode()
+        ).decode()
+
+    def decode_cursor(self, cursor):
+        """Return the ordering values of the cursor position"""
+        try:
+            data = json.loads(urlsafe_b64decode(cursor.encode()))
+            ordering, values = data["o"], data["v"]
+        except (Base64Error, KeyError, TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        # the cursor of a page with another ordering
+        if ordering != self.get_ordering_names() or len(values) != len(ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return values
+
+    def get_cached_count(self, queryset):
+        """Count queryset, or return the count cached by a recent request"""
+        queryset = queryset.order_by()
+        try:
+            sql, params = queryset.query.sql_with_params()
+        except EmptyResultSet:
+            return 0
+        key = COUNT_KEY_PREFIX + sha1(repr((sql, params)).encode()).hexdigest()
+        count = cache.get(key)
+        if count is None:
+            count = self.get_count(queryset)
+            cache.set(
+                key, count, getattr(settings, "PAGINATION_COUNT_CACHE_TIMEOUT", 60)
+            )
+        return count
+
+    def get_next_link(self):
+        if self.cursor is None:
+            return super().get_next_link()
+        if self.next_cursor is None:
+            return None
+        url = remove_query_param(
+            self.request.build_absolute_uri(), self.offset_query_param
+        )
+        return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+    def get_previous_link(self):
+        if self.cursor is None:
+            return super().get_previous_link()
+        return None
@@ -0,0 +1,417 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""Partitioning of the ReportEntry table by reported_at.
+
+If REPORT_PARTITION_INTERVAL is "day" or "week", the table may be partitioned
+(PostgreSQL declarative partitioning, or MySQL RANGE COLUMNS partitioning) with
+one partition per interval. Partitions are named after their range, which is
+[begin, end) in UTC. Queries with constant bounds on reported_at only read the
+partitions covering them.
+
+Both databases require the partition key in every unique key, and MySQL doesn't
+support foreign keys on partitioned tables, so the table can't be partitioned by
+a migration without changing the schema of all installations. Instead,
+`ReportPartitions.conversion_sql()` returns the statements converting an existing
+table, to be reviewed and run in a maintenance window. After that, the
+create_report_partitions command creates partitions ahead of time, and
+cleanup_old_reports drops expired partitions instead of deleting their rows.
+"""
+
+import re
+from collections import namedtuple
+from datetime import datetime, timedelta
+from datetime import timezone as dt_timezone
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from .models import BucketHitRollup, BucketRepresentative, ReportEntry
+
+PARTITION_INTERVALS = ("day", "week")
+PARTITION_VENDORS = ("mysql", "postgresql")
+PARTITION_NAME_RE = re.compile(r"^p(\d{8})_(\d{8})$")
+INDEX_DEF_RE = re.compile(r"^CREATE INDEX \S+ ON \S+ ")
+
+Partition = namedtuple("Partition", ("name", "begin", "end"))
+
+
+def get_partition_interval():
+    """Return the configured REPORT_PARTITION_INTERVAL (None if not partitioned)"""
+    interval = getattr(settings, "REPORT_PARTITION_INTERVAL", None)
+    if interval not in (None, *PARTITION_INTERVALS):
+        raise ImproperlyConfigured(
+            f"REPORT_PARTITION_INTERVAL must be one of {PARTITION_INTERVALS}"
+        )
+    return interval
+
+
+class ReportPartitions:
+    """The partitions of the ReportEntry table in a database."""
+
+    def __init__(self, using=DEFAULT_DB_ALIAS):
+        self.connection = connections[using]
+        self.interval = get_partition_interval()
+        self.table = ReportEntry._meta.db_table
+
+    @property
+    def supported(self):
+        """Whether partitioning is configured, for a database supporting it"""
+        return self.interval is not None and self.connection.vendor in PARTITION_VENDORS
+
+    def get_partition(self, time):
+        """Return the partition (which may not exist) containing time"""
+        begin = BucketHitRollup.get_begin(
+            time.astimezone(dt_timezone.utc), self.interval
+        )
+        end = begin + timedelta(days=7 if self.interval == "week" else 1)
+        return Partition(f"p{begin:%Y%m%d}_{end:%Y%m%d}", begin, end)
+
+    def get_partitions(self):
+        """Return the existing partitions, ordered by range.
+
+        Partitions not named after their range (eg. a default partition) are left
+        out.
+
+        @rtype: list
+        @return: Partition tuples, empty if the table isn't partitioned
+        """
+        if not self.supported:
+            return []
+        if self.connection.vendor == "postgresql":
+            query = (
+                "SELECT child.relname FROM pg_inherits"
+                " JOIN pg_class child ON child.oid = pg_inherits.inhrelid"
+                " JOIN pg_class parent ON parent.oid = pg_inherits.inhparent"
+                " WHERE parent.relname = %s"
+                " AND pg_catalog.pg_table_is_visible(parent.oid)"
+            )
+        else:
+            query = (
+                "SELECT PARTITION_NAME FROM information_schema.PARTITIONS"
+                " WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s"
+                " AND PARTITION_NAME IS NOT NULL"
+            )
+        with self.connection.cursor() as cursor:
+            cursor.execute(query, [self.table])
+            names = [name for (name,) in cursor.fetchall()]
+
+        partitions = []
+        for name in names:
+            # postgres partitions are tables, prefixed with the table name
+            name = name.removeprefix(f"{self.table}_")
+            match = PARTITION_NAME_RE.match(name)
+            if match is not None:
+                begin, end = (
+                    datetime.strptime(value, "%Y%m%d").replace(tzinfo=dt_timezone.utc)
+                    for value in match.groups()
+                )
+                partitions.append(Partition(name, begin, end))
+        return sorted(partitions, key=lambda partition: partition.begin)
+
+    def get_missing(self, until, partitions=None):
+        """Return the partitions to create so that partitions exist up to until.
+
+        Partitions are only added right after the last existing one, starting
+        with the current one if there is none. MySQL can only add ranges at the
+        end, and a range there starts at the end of the previous one, so a gap
+        would end up in the new partition.
+        """
+        if partitions is None:
+            partitions = self.get_partitions()
+        if partitions:
+            begin = partitions[-1].end
+        else:
+            begin = self.get_partition(timezone.now()).begin
+        missing = []
+        while begin < until:
+            partition = self.get_partition(begin)
+            missing.append(partition)
+            begin = partition.end
+        return missing
+
+    def get_range(self, partition):
+        """Return the range of reported_at of the entries stored in a partition.
+
+        On MySQL, a partition holds all entries after the previous partition, so
+        the lowest partition also holds the entries older than its name says.
+
+        @rtype: tuple
+        @return: (begin, end) where begin may be None (no lower bound)
+        """
+        if self.connection.vendor == "postgresql":
+            return partition.begin, partition.end
+        return (
+            max(
+                (
+                    other.end
+                    for other in self.get_partitions()
+                    if other.end <= partition.begin
+                ),
+                default=None,
+            ),
+            partition.end,
+        )
+
+    def get_expired(self, expiry_date):
+        """Return the partitions only holding entries older than expiry_date"""
+        return [
+            partition
+            for partition in self.get_partitions()
+            if partition.end <= expiry_date
+        ]
+
+    def _quote(self, name):
+        return self.connection.ops.quote_name(name)
+
+    def _literal(self, time):
+        # reported_at is stored in UTC by both databases
+        if self.connection.vendor == "postgresql":
+            return f"'{time:%Y-%m-%d %H:%M:%S}+00:00'"
+        return f"'{time:%Y-%m-%d %H:%M:%S}'"
+
+    def _partition_sql(self, partition, parent=None):
+        if self.connection.vendor == "postgresql":
+            # named after the table, even when created for the converted table
+            return (
+                f"CREATE TABLE {self._quote(f'{self.table}_{partition.name}')}"
+                f" PARTITION OF {self._quote(parent or self.table)} FOR VALUES"
+                f" FROM ({self._literal(partition.begin)})"
+                f" TO ({self._literal(partition.end)})"
+            )
+        return (
+            f"PARTITION {self._quote(partition.name)}"
+            f" VALUES LESS THAN ({self._literal(partition.end)})"
+        )
+
+    def create(self, partition):
+        """Create a partition after the existing ones.
+
+        Entries already in the catch-all partition which belong to the new one are
+        moved to it.
+        """
+        if self.connection.vendor == "postgresql":
+            self._create_postgresql(partition)
+            return
+        # split the catch-all partition
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f"ALTER TABLE {self._quote(self.table)} REORGANIZE PARTITION pmax"
+                f" INTO ({self._partition_sql(partition)},"
+                " PARTITION pmax VALUES LESS THAN (MAXVALUE))"
+            )
+
+    def _create_postgresql(self, partition):
+        table = self._quote(self.table)
+        default_name = f"{self.table}_default"
+        default = self._quote(default_name)
+        in_range = (
+            f"reported_at >= {self._literal(partition.begin)}"
+            f" AND reported_at < {self._literal(partition.end)}"
+        )
+        with (
+            transaction.atomic(using=self.connection.alias),
+            self.connection.cursor() as cursor,
+        ):
+            cursor.execute("SELECT to_regclass(%s) IS NOT NULL", [default_name])
+            (conflict,) = cursor.fetchone()
+            if conflict:
+                cursor.execute(
+                    f"SELECT EXISTS (SELECT 1 FROM {default} WHERE {in_range})"
+                )
+                (conflict,) = cursor.fetchone()
+            if not conflict:
+                cursor.execute(self._partition_sql(partition))
+                return
+            # a partition can't be created while the default partition holds
+            # entries in its range
+            cursor.execute(f"ALTER TABLE {table} DETACH PARTITION {default}")
+            cursor.execute(self._partition_sql(partition))
+            cursor.execute(
+                f"INSERT INTO {table} SELECT * FROM {default} WHERE {in_range}"
+            )
+            cursor.execute(f"DELETE FROM {default} WHERE {in_range}")
+            cursor.execute(f"ALTER TABLE {table} ATTACH PARTITION {default} DEFAULT")
+
+    def lock(self, partition):
+        """Prevent changes to the entries of a partition until the end of the
+        current transaction.
+
+        This is only supported by PostgreSQL. On MySQL, entries changed while a
+        partition is dropped may be miscounted.
+        """
+        if self.connection.vendor == "postgresql":
+            with self.connection.cursor() as cursor:
+                cursor.execute(
+                    f"LOCK TABLE {self._quote(f'{self.table}_{partition.name}')}"
+                    " IN SHARE MODE"
+                )
+
+    def drop(self, partition):
+        """Drop a partition, and the entries it holds.
+
+        The counter changes must be computed and the representatives of these
+        entries deleted before (see `EntryCleanup.delete_partition()`). MySQL
+        commits the current transaction before dropping.
+        """
+        if self.connection.vendor == "postgresql":
+            sql = f"DROP TABLE {self._quote(f'{self.table}_{partition.name}')}"
+        else:
+            sql = (
+                f"ALTER TABLE {self._quote(self.table)}"
+                f" DROP PARTITION {self._quote(partition.name)}"
+            )
+        with self.connection.cursor() as cursor:
+            cursor.execute(sql)
+
+    def conversion_sql(self, until):
+        """Return the statements converting the unpartitioned table.
+
+        The primary key and unique keys get reported_at added. Partitions are
+        created for the existing entries and up to until, plus a catch-all
+        partition for entries out of range. Foreign keys to the table are dropped
+        (and on MySQL, foreign keys of the table too). On PostgreSQL, the old
+        table is kept with the suffix "_unpartitioned".
+
+        @rtype: list
+        @return: SQL statements
+        """
+        if not self.supported:
+            raise ImproperlyConfigured(
+                "REPORT_PARTITION_INTERVAL must be set, for a PostgreSQL or MySQL "
+                "database"
+            )
+        bounds = ReportEntry.objects.aggregate(Min("reported_at"), Max("reported_at"))
+        partitions = []
+        begin = self.get_partition(bounds["reported_at__min"] or timezone.now()).begin
+        last = max(until, (bounds["reported_at__max"] or until) + timedelta(seconds=1))
+        while begin < last:
+            partitions.append(self.get_partition(begin))
+            begin = partitions[-1].end
+
+        with self.connection.cursor() as cursor:
+            introspection = self.connection.introspection
+            constraints = introspection.get_constraints(cursor, self.table)
+            rep_constraints = introspection.get_constraints(
+                cursor, BucketRepresentative._meta.db_table
+            )
+            index_defs = []
+            id_sequence = id_identity = None
+            if self.connection.vendor == "postgresql":
+                # the definitions include operator classes, unlike the introspection
+                cursor.execute(
+                    "SELECT indexdef FROM pg_indexes WHERE tablename = %s",
+                    [self.table],
+                )
+                index_defs = [
+                    index_def
+                    for (index_def,) in cursor.fetchall()
+                    if not index_def.startswith("CREATE UNIQUE ")
+                ]
+                # tables created by older Django versions have a serial id column
+                # instead of an identity column
+                cursor.execute(
+                    "SELECT pg_get_serial_sequence(%s, 'id'),"
+                    " attidentity != '' FROM pg_attribute"
+                    " WHERE attrelid = to_regclass(%s) AND attname = 'id'",
+                    [self.table, self.table],
+                )
+                id_sequence, id_identity = cursor.fetchone()
+
+        table = self._quote(self.table)
+        drop_fk = (
+            "CONSTRAINT" if self.connection.vendor == "postgresql" else "FOREIGN KEY"
+        )
+        statements = [
+            f"ALTER TABLE {self._quote(BucketRepresentative._meta.db_table)}"
+            f" DROP {drop_fk} {self._quote(name)}"
+            for name, info in sorted(rep_constraints.items())
+            if info["foreign_key"] and info["foreign_key"][0] == self.table
+        ]
+
+        if self.connection.vendor == "postgresql":
+            new_name = f"{self.table}_partitioned"
+            new_table = self._quote(new_name)
+            statements.append(
+                f"CREATE TABLE {new_table} (LIKE {table} INCLUDING DEFAULTS"
+                " INCLUDING IDENTITY) PARTITION BY RANGE (reported_at)"
+            )
+            for name, info in sorted(constraints.items()):
+                columns = ", ".join(self._quote(column) for column in info["columns"])
+                if info["primary_key"]:
+                    statements.append(
+                        f"ALTER TABLE {new_table}"
+                        f" ADD PRIMARY KEY ({columns}, reported_at)"
+                    )
+                elif info["unique"]:
+                    statements.append(
+                        f"ALTER TABLE {new_table} ADD UNIQUE ({columns}, reported_at)"
+                    )
+                elif info["foreign_key"]:
+                    ref_table, ref_column = (
+                        self._quote(name) for name in info["foreign_key"]
+                    )
+                    statements.append(
+                        f"ALTER TABLE {new_table} ADD FOREIGN KEY ({columns})"
+                        f" REFERENCES {ref_table} ({ref_column})"
+                        " DEFERRABLE INITIALLY DEFERRED"
+                    )
+            # index names are unique per schema, let postgres name the new ones
+            statements.extend(
+                INDEX_DEF_RE.sub(f"CREATE INDEX ON {new_table} ", index_def)
+                for index_def in sorted(index_defs)
+            )
+            statements.extend(
+                self._partition_sql(partition, new_name) for partition in partitions
+            )
+            statements.extend(
+                (
+                    f"CREATE TABLE {self._quote(f'{self.table}_default')}"
+                    f" PARTITION OF {new_table} DEFAULT",
+                    f"INSERT INTO {new_table} SELECT * FROM {table}",
+                    # the identity column of the new table has its own sequence,
+                    # a serial column default uses the sequence of the old table
+                    (
+                        f"SELECT setval(pg_get_serial_sequence('{new_name}', 'id'),"
+                        f" (SELECT COALESCE(MAX(id), 0) + 1 FROM {new_table}),"
+                        " false)"
+                        if id_identity
+                        else f"ALTER SEQUENCE {id_sequence} OWNED BY {new_table}.id"
+                    ),
+                    f"ALTER TABLE {table} RENAME TO"
+                    f" {self._quote(f'{self.table}_unpartitioned')}",
+                    f"ALTER TABLE {new_table} RENAME TO {table}",
+                )
+            )
+            return ["BEGIN", *statements, "COMMIT"]
+
+        alterations = []
+        for name, info in sorted(constraints.items()):
+            columns = ", ".join(self._quote(column) for column in info["columns"])
+            if info["primary_key"]:
+                alterations.extend(
+                    (
+                        "DROP PRIMARY KEY",
+                        f"ADD PRIMARY KEY ({columns}, reported_at)",
+                    )
+                )
+            elif info["unique"]:
+                alterations.extend(
+                    (
+                        f"DROP INDEX {self._quote(name)}",
+                        f"ADD UNIQUE INDEX {self._quote(name)}"
+                        f" ({columns}, reported_at)",
+                    )
+                )
+            elif info["foreign_key"]:
+                alterations.append(f"DROP FOREIGN KEY {self._quote(name)}")
+        statements.append(f"ALTER TABLE {table} {', '.join(alterations)}")
+        statements.append(
+            f"ALTER TABLE {table} PARTITION BY RANGE COLUMNS(reported_at) ("
+            + ", ".join(self._partition_sql(partition) for partition in partitions)
+            + ", PARTITION pmax VALUES LESS THAN (MAXVALUE))"
+        )
+        return statements
@@ -0,0 +1,326 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""Translation of signatures into database filters on ReportEntry.
+
+`compile_signature()` translates the symptoms of a signature which map onto
+ReportEntry columns into a Q object, so the database can select candidate
+entries. The Q object never excludes an entry the signature matches, but it may
+include entries it doesn't match: symptoms which are not translated exactly are
+returned as a residual list, to be checked in Python.
+
+Pattern symptoms are translated into a database regular expression by
+`translate_pattern()` if the pattern only uses syntax which the supported
+backends (PostgreSQL, MySQL and SQLite) interpret like Python does. These are
+never exact, the pattern is always checked again in Python.
+"""
+
+import string
+import sys
+
+from django.db import connection
+from django.db.models import Q
+
+from webcompat.symptoms import (
+    NullMatcher,
+    PatternMatcher,
+    ReportedAtSymptom,
+    StringPropertySymptom,
+    TimeMatcher,
+    TimeRangeMatcher,
+    URLSymptom,
+    ValueMatcher,
+)
+
+from .models import URL_PART_MAX_LENGTH
+
+if sys.version_info[:2] < (3, 11):
+    import sre_constants
+    import sre_parse
+else:
+    from re import _constants as sre_constants
+    from re import _parser as sre_parse
+
+# Report attribute -> ReportEntry lookup
+PROPERTY_LOOKUPS = {
+    "app_channel": "app__channel",
+    "app_name": "app__name",
+    "app_version": "app__version",
+    "breakage_category": "breakage_category__value",
+    "comments": "comments",
+    "os": "os__name",
+}
+
+# lookups used to test Report attributes for None
+PROPERTY_NULL_LOOKUPS = {
+    **PROPERTY_LOOKUPS,
+    "breakage_category": "breakage_category",
+}
+
+# URL part -> ReportEntry field
+URL_PART_FIELDS = {
+    "hostname": "hostname",
+    "path": "path",
+    "scheme": "scheme",
+}
+
+
+# vendors on which the regex lookup understands the syntax generated by
+# translate_pattern()
+REGEX_VENDORS = {"mysql", "postgresql", "sqlite"}
+
+# largest bound of a repetition supported by PostgreSQL
+REGEX_MAX_REPEAT = 255
+
+# characters which are escaped in translated patterns
+REGEX_SPECIAL_CHARS = frozenset(string.punctuation)
+
+# characters which may be special in brackets on any backend (eg. "[:" starts a
+# POSIX class in ICU, "&&" is an intersection)
+REGEX_BRACKET_CHARS = frozenset("$&-.:=[\\]^{|}~")
+
+
+def _translate_char(code):
+    char = chr(code)
+    if char in REGEX_SPECIAL_CHARS:
+        return "\\" + char
+    return char
+
+
+def _translate_in(items):
+    negate = False
+    members = []
+    branches = []
+    for op, av in items:
+        if op is sre_constants.NEGATE:
+            negate = True
+        elif op is sre_constants.LITERAL:
+            if chr(av) in REGEX_BRACKET_CHARS:
+                # escapes in brackets aren't portable, match these separately
+                branches.append(_translate_char(av))
+            else:
+                members.append(chr(av))
+        elif op is sre_constants.RANGE:
+            low, high = av
+            if chr(low) in REGEX_BRACKET_CHARS or chr(high) in REGEX_BRACKET_CHARS:
+                return None
+            members.append(f"{chr(low)}-{chr(high)}")
+        else:
+            # categories (\d, \w, ...) differ between backends
+            return None
+    if negate:
+        if branches or not members:
+            return None
+        return f"[^{''.join(members)}]"
+    if members:
+        branches.insert(0, f"[{''.join(members)}]")
+    if not branches:
+        return None
+    if len(branches) == 1:
+        return branches[0]
+    return f"(?:{'|'.join(branches)})"
+
+
+def _translate_repeat(low, high, item):
+    low = min(low, REGEX_MAX_REPEAT)
+    if high is sre_constants.MAXREPEAT or high > REGEX_MAX_REPEAT:
+        # widening a repetition only makes the result match more
+        high = None
+    if (low, high) == (0, None):
+        suffix = "*"
+    elif (low, high) == (1, None):
+        suffix = "+"
+    elif (low, high) == (0, 1):
+        suffix = "?"
+    elif high is None:
+        suffix = f"{{{low},}}"
+    else:
+        suffix = f"{{{low},{high}}}"
+    return f"(?:{item}){suffix}"
+
+
+def _translate_subpattern(subpattern):
+    result = []
+    for op, av in subpattern:
+        if op is sre_constants.LITERAL:
+            result.append(_translate_char(av))
+        elif op is sre_constants.NOT_LITERAL:
+            part = _translate_in(
+                [(sre_constants.NEGATE, None), (sre_constants.LITERAL, av)]
+            )
+            if part is None:
+                return None
+            result.append(part)
+        elif op is sre_constants.ANY:
+            # `.` doesn't match the same line terminators in every backend (eg. \r
+            # and U+2028 on MySQL), Python only excludes \n
+            result.append("[^\n]")
+        elif op is sre_constants.IN:
+            part = _translate_in(av)
+            if part is None:
+                return None
+            result.append(part)
+        elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT):
+            # greediness doesn't change whether a pattern matches
+            low, high, item = av
+            item = _translate_subpattern(item)
+            if item is None:
+                return None
+            result.append(_translate_repeat(low, high, item))
+        elif op is sre_constants.SUBPATTERN:
+            _group, add_flags, del_flags, item = av
+            if add_flags or del_flags:
+                return None
+            item = _translate_subpattern(item)
+            if item is None:
+                return None
+            result.append(f"(?:{item})")
+        elif op is sre_constants.BRANCH:
+            branches = [_translate_subpattern(item) for item in av[1]]
+            if None in branches:
+                return None
+            result.append(f"(?:{'|'.join(branches)})")
+        elif op is sre_constants.AT:
+            if av in (sre_constants.AT_BEGINNING, sre_constants.AT_BEGINNING_STRING):
+                result.append("^")
+            elif av is sre_constants.AT_END:
+                # Python's $ also matches before a newline at the end
+                result.append("(?:\\n)?$")
+            elif av is sre_constants.AT_END_STRING:
+                result.append("$")
+            else:
+                # word boundaries
+                return None
+        else:
+            # back references, lookarounds, atomic groups, ...
+            return None
+    return "".join(result)
+
+
+def translate_pattern(pattern):
+    """Translate a PatternMatcher pattern into a regex for the database.
+
+    The result is anchored like `re.match()`, and uses only syntax which is
+    interpreted the same by the backends in REGEX_VENDORS, except that it may
+    match more than the pattern in Python (eg. repetitions are capped at
+    REGEX_MAX_REPEAT).
+
+    @rtype: str or None
+    @return: the database regex, or None if the pattern uses unsupported syntax
+    """
+    try:
+        parsed = sre_parse.parse(pattern)
+    except sre_constants.error:
+        return None
+    if parsed.state.flags & ~sre_constants.SRE_FLAG_UNICODE:
+        return None
+    result = _translate_subpattern(parsed)
+    if result is None:
+        return None
+    return f"^(?:{result})"
+
+
+def regex_supported():
+    """Return whether translated patterns can be used with the current database"""
+    return connection.vendor in REGEX_VENDORS
+
+
+def strings_compare_exactly():
+    """Return whether string equality in the database is the same as in Python.
+
+    MySQL compares strings case-insensitively (and ignoring trailing spaces) with
+    the default collations.
+    """
+    return connection.vendor != "mysql"
+
+
+def compile_symptom(symptom):
+    """Translate a single symptom.
+
+    @rtype: tuple
+    @return: (Q or None, exact), where Q is None if the symptom can't be translated,
+             and exact is True if Q selects exactly the entries the symptom matches.
+    """
+    exact_strings = strings_compare_exactly()
+    matcher = symptom.matcher
+
+    if isinstance(symptom, StringPropertySymptom):
+        if symptom.attr not in PROPERTY_LOOKUPS:
+            return None, False
+        if isinstance(matcher, NullMatcher):
+            return Q(**{f"{PROPERTY_NULL_LOOKUPS[symptom.attr]}__isnull": True}), True
+        if isinstance(matcher, ValueMatcher):
+            return Q(**{PROPERTY_LOOKUPS[symptom.attr]: matcher.value}), exact_strings
+        if isinstance(matcher, PatternMatcher) and regex_supported():
+            regex = translate_pattern(matcher.pattern.pattern)
+            if regex is not None:
+                return Q(**{f"{PROPERTY_LOOKUPS[symptom.attr]}__regex": regex}), False
+
+    elif isinstance(symptom, URLSymptom):
+        field = URL_PART_FIELDS.get(symptom.part)
+        if field is None:
+            return None, False
+        if isinstance(matcher, NullMatcher):
+            # parts which don't fit in their column are stored as NULL
+            return Q(**{f"{field}__isnull": True}), False
+        if isinstance(matcher, ValueMatcher):
+            if field != "path" and len(matcher.value) > URL_PART_MAX_LENGTH:
+                return None, False
+            return Q(**{field: matcher.value}), exact_strings
+        if isinstance(matcher, PatternMatcher) and regex_supported():
+            regex = translate_pattern(matcher.pattern.pattern)
+            if regex is not None:
+                result = Q(**{f"{field}__regex": regex})
+                if field != "path":
+                    result |= Q(**{f"{field}__isnull": True})
+                return result, False
+
+    elif isinstance(symptom, ReportedAtSymptom):
+        if isinstance(matcher, TimeRangeMatcher):
+            result = Q()
+            if matcher.after is not None:
+                result &= Q(reported_at__gt=matcher.after)
+            if matcher.before is not None:
+                result &= Q(reported_at__lt=matcher.before)
+            return result, True
+        if isinstance(matcher, TimeMatcher):
+            return Q(reported_at=matcher.value), True
+
+    return None, False
+
+
+def compile_signature(signature):
+    """Translate the symptoms of signature into a filter on ReportEntry.
+
+    @rtype: tuple
+    @return: (Q, residual), where residual is the list of symptoms which still
+             have to be checked for entries selected by Q.
+    """
+    result = Q()
+    residual = []
+    for symptom in signature.symptoms:
+        symptom_q, exact = compile_symptom(symptom)
+        if symptom_q is not None:
+            result &= symptom_q
+        if not exact:
+            residual.append(symptom)
+    return result, residual
+
+
+def matches_residual(residual, report):
+    """Check the residual symptoms returned by `compile_signature()` against report"""
+    return all(symptom.matches(report) for symptom in residual)
+
+
+def match_residual_batch(residual, batch):
+    """Same as `matches_residual()`, for all reports of a `ReportBatch`
+
+    @rtype: int
+    @return: Bitmask of the rows in batch matching all residual symptoms
+    """
+    mask = batch.all
+    for symptom in residual:
+        if not mask:
+            break
+        mask = symptom.match_batch(batch, mask)
+    return mask
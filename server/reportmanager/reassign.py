@@ -0,0 +1,129 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""Matching of report entries against a bucket signature for reassignment.
+
+Matching is CPU bound, so for large reassignments the candidate entry ids are
+partitioned across a process pool. Each worker loads its partition from the
+database and matches it with the (pickled) signature of the bucket. The results
+are the same as when matching serially.
+"""
+
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from logging import getLogger
+from multiprocessing import get_context
+
+from django.conf import settings
+from django.db import connection
+
+from webcompat.models import ReportBatch
+
+if sys.version_info[:2] < (3, 12):
+    from server.utils import batched
+else:
+    from itertools import batched
+
+LOG = getLogger("reportmanager.reassign")
+
+MATCH_BATCH_SIZE = 100
+
+
+def match_entries(signature, bucket_id, entry_ids):
+    """Match the given entries against signature.
+
+    Returns a tuple of lists of entry ids: (in_ids, out_ids), where `in_ids` are
+    entries matching signature that are not yet in bucket `bucket_id`, and
+    `out_ids` are entries in the bucket that don't match anymore.
+    """
+    from .models import ReportEntry
+
+    in_ids, out_ids = [], []
+    # only load the fields used by the signature
+    fields = signature.report_fields
+    for entry_ids_batch in batched(entry_ids, MATCH_BATCH_SIZE):
+        rows = ReportEntry.load_reports(
+            ReportEntry.objects.filter(id__in=entry_ids_batch), fields
+        )
+        matched = signature.match_batch(ReportBatch(report for _, _, report in rows))
+        for row, (entry_id, entry_bucket_id, _) in enumerate(rows):
+            match = matched >> row & 1
+            if match and entry_bucket_id != bucket_id:
+                in_ids.append(entry_id)
+            elif not match and entry_bucket_id == bucket_id:
+                out_ids.append(entry_id)
+    return in_ids, out_ids
+
+
+def _init_worker(db_name):
+    # workers are spawned, so Django must be set up again
+    import django
+    from django.db import connections
+
+    django.setup()
+    # use the database of the parent process (which may differ from the settings,
+    # e.g. a test database)
+    connections["default"].settings_dict["NAME"] = db_name
+
+
+class ReassignMatcher:
+    """Match entries for reassignment, in parallel if worthwhile.
+
+    Arguments:
+        workers: Number of worker processes (default: REASSIGN_WORKERS setting,
+                 or the number of CPUs, up to 4).
+        threshold: Minimum number of entries to use the process pool for (default:
+                   REASSIGN_PARALLEL_THRESHOLD setting, or 5000).
+    """
+
+    def __init__(self, workers=None, threshold=None):
+        if workers is None:
+            workers = getattr(settings, "REASSIGN_WORKERS", min(os.cpu_count() or 1, 4))
+        if threshold is None:
+            threshold = getattr(settings, "REASSIGN_PARALLEL_THRESHOLD", 5000)
+        self.workers = workers
+        self.threshold = threshold
+
+    def use_pool(self, n_entries):
+        if self.workers <= 1 or n_entries < self.threshold:
+            return False
+        # worker processes can't see an in-memory database
+        return not (connection.vendor == "sqlite" and connection.is_in_memory_db())
+
+    def match(self, signature, bucket_id, entry_ids):
+        """Same as `match_entries()`, partitioning entry_ids across workers."""
+        entry_ids = list(entry_ids)
+        if not self.use_pool(len(entry_ids)):
+            return match_entries(signature, bucket_id, entry_ids)
+
+        # use several partitions per worker so a slow partition doesn't dominate
+        n_parts = self.workers * 4
+        part_size = -(-len(entry_ids) // n_parts)
+        partitions = [
+            entry_ids[start : start + part_size]
+            for start in range(0, len(entry_ids), part_size)
+        ]
+        LOG.debug(
+            "matching %d entries in %d partitions using %d workers",
+            len(entry_ids),
+            len(partitions),
+            self.workers,
+        )
+        in_ids, out_ids = [], []
+        with ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(connection.settings_dict["NAME"],),
+        ) as pool:
+            futures = [
+                pool.submit(match_entries, signature, bucket_id, partition)
+                for partition in partitions
+            ]
+            # merge in partition order
+            for future in futures:
+                part_in, part_out = future.result()
+                in_ids.extend(part_in)
+                out_ids.extend(part_out)
+        return in_ids, out_ids
@@ -0,0 +1,50 @@
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
+
+import pytest
+
+from webcompat.models import Report
+
+
+@pytest.fixture
+def make_report():
+    """Return a function building a report. The uuid is made from the index given
+    as first argument, the url from `hostname`, and other fields can be given as
+    keyword arguments.
+    """
+
+    def _make_report(idx, hostname="example.com", **fields):
+        values = {
+            "app_channel": "release",
+            "app_name": "Firefox",
+            "app_version": "1",
+            "breakage_category": None,
+            "comments": "",
+            "details": {},
+            "os": "Linux",
+            "reported_at": datetime(2024, 1, 1, tzinfo=timezone.utc),
+            "url": urlsplit(f"https://{hostname}/"),
+            "uuid": f"00000000-0000-0000-0000-{idx:012d}",
+        }
+        values.update(fields)
+        return Report(**values)
+
+    return _make_report
+
+
+@pytest.fixture
+def create_entry(make_report):
+    """Return a function creating a report entry in the given bucket (or None),
+    from the arguments of `make_report()`.
+    """
+
+    # Django is only set up by pytest-django, which the test modules require
+    from reportmanager.models import ReportEntry
+
+    def _create_entry(idx, bucket=None, **fields):
+        return ReportEntry.objects.create_from_report(
+            make_report(idx, **fields),
+            bucket_id=None if bucket is None else bucket.pk,
+        )
+
+    return _create_entry
@@ -0,0 +1,94 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+pytest.importorskip("pytest_django")
+
+from django.core.management import CommandError, call_command  # noqa: E402
+
+from reportmanager.models import Bucket, BucketStats, ReportEntry  # noqa: E402
+
+pytestmark = pytest.mark.django_db
+
+NOW = datetime(2024, 3, 6, 12, tzinfo=timezone.utc)
+
+
+def _stats():
+    return {
+        bucket_id: (size, latest_report, latest_entry_id)
+        for bucket_id, size, latest_report, latest_entry_id in (
+            BucketStats.objects.values_list(
+                "bucket_id", "size", "latest_report", "latest_entry_id"
+            )
+        )
+    }
+
+
+def test_bucket_stats_01(create_entry):
+    """test that bucket stats follow entries added to and removed from buckets"""
+    a, b = (
+        Bucket.objects.create(description=str(idx), signature="{}") for idx in range(2)
+    )
+    first = create_entry(1, a, reported_at=NOW)
+    second = create_entry(2, a, reported_at=NOW + timedelta(hours=1))
+    third = create_entry(3, b, reported_at=NOW - timedelta(hours=1))
+    create_entry(4, reported_at=NOW)
+    assert _stats() == {
+        a.pk: (2, NOW + timedelta(hours=1), second.pk),
+        b.pk: (1, NOW - timedelta(hours=1), third.pk),
+    }
+
+    # the latest entry of a moves to b, which has a more recently created entry
+    second = ReportEntry.objects.get(pk=second.pk)
+    second.bucket = b
+    second.save()
+    assert _stats() == {
+        a.pk: (1, NOW, first.pk),
+        b.pk: (2, NOW + timedelta(hours=1), third.pk),
+    }
+    call_command("rebuild_bucket_stats", check=True)
+
+    first.delete()
+    assert _stats() == {
+        a.pk: (0, None, None),
+        b.pk: (2, NOW + timedelta(hours=1), third.pk),
+    }
+    call_command("rebuild_bucket_stats", check=True)
+
+
+def test_bucket_stats_02(create_entry):
+    """test applying many changes at once"""
+    a, b = (
+        Bucket.objects.create(description=str(idx), signature="{}") for idx in range(2)
+    )
+    first = create_entry(1, reported_at=NOW)
+    second = create_entry(2, reported_at=NOW - timedelta(hours=1))
+    # moved without signals
+    ReportEntry.objects.update(bucket=a)
+    BucketStats.apply_changes(
+        [
+            (a.pk, first.pk, first.reported_at, 1),
+            (a.pk, second.pk, second.reported_at, 1),
+            # removing from a bucket without stats is a no-op
+            (b.pk, second.pk, second.reported_at, -1),
+        ]
+    )
+    assert _stats() == {a.pk: (2, NOW, second.pk)}
+
+    # the latest entry is looked up once it is removed
+    ReportEntry.objects.filter(pk=second.pk).update(bucket=None)
+    BucketStats.apply_changes([(a.pk, second.pk, second.reported_at, -1)])
+    assert _stats() == {a.pk: (1, NOW, first.pk)}
+
+
+def test_bucket_stats_03(create_entry):
+    """test rebuilding stale bucket stats"""
+    bucket = Bucket.objects.create(description="a", signature="{}")
+    entry = create_entry(1, bucket, reported_at=NOW)
+    BucketStats.objects.filter(bucket=bucket).update(size=5)
+    with pytest.raises(CommandError):
+        call_command("rebuild_bucket_stats", check=True)
+
+    call_command("rebuild_bucket_stats")
+    assert _stats() == {bucket.pk: (1, NOW, entry.pk)}
+    call_command("rebuild_bucket_stats", check=True)
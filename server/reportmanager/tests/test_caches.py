@@ -0,0 +1,152 @@
+import json
+
+import pytest
+
+pytest.importorskip("pytest_django")
+
+from django.db import transaction  # noqa: E402
+
+from reportmanager.caches import (  # noqa: E402
+    SIGNATURE_CACHE,
+    DimensionCache,
+    SignatureCache,
+)
+from reportmanager.models import OS, Bucket  # noqa: E402
+from webcompat.models import AdaptiveSignature, Signature  # noqa: E402
+
+pytestmark = pytest.mark.django_db
+
+
+def _signature(hostname):
+    return json.dumps(
+        {"symptoms": [{"type": "url", "part": "hostname", "value": hostname}]},
+        sort_keys=True,
+    )
+
+
+def test_signature_cache_01():
+    """test that parsed signatures are shared, and evicted least recently used
+    first
+    """
+    cache = SignatureCache(2)
+    a = cache.get(_signature("a"))
+    assert isinstance(a, Signature) and not isinstance(a, AdaptiveSignature)
+    assert a.raw_signature == _signature("a")
+    assert cache.get(_signature("a")) is a
+    b = cache.get(_signature("b"))
+    # "a" is used more recently than "b"
+    assert cache.get(_signature("a")) is a
+    cache.get(_signature("c"))
+    assert len(cache) == 2
+    assert cache.get(_signature("a")) is a
+    assert cache.get(_signature("b")) is not b
+    assert cache.stats() == {
+        "size": 2,
+        "max_size": 2,
+        "hits": 3,
+        "misses": 4,
+        "evictions": 2,
+    }
+
+    cache.discard(_signature("a"))
+    cache.discard(_signature("x"))
+    assert cache.get(_signature("a")) is not a
+    cache.clear()
+    assert cache.stats()["size"] == cache.stats()["hits"] == 0
+
+
+def test_signature_cache_02():
+    """test that invalid signatures are not cached"""
+    cache = SignatureCache(2)
+    with pytest.raises(RuntimeError):
+        cache.get(json.dumps({"symptoms": [{"type": "unknown"}]}))
+    assert len(cache) == 0
+
+
+def test_signature_cache_03():
+    """test adaptive signatures and their statistics"""
+    cache = SignatureCache(2, adaptive=True)
+    signature = cache.get(_signature("a"))
+    assert isinstance(signature, AdaptiveSignature)
+    assert cache.symptom_stats() == [
+        {"signature": _signature("a"), "symptoms": signature.get_stats()}
+    ]
+
+
+def test_signature_cache_04():
+    """test that buckets don't return the signature they had before an edit"""
+    bucket = Bucket.objects.create(description="a", signature=_signature("a"))
+    signature = bucket.get_signature()
+    assert bucket.get_signature() is signature
+    assert SIGNATURE_CACHE.get(_signature("a")) is signature
+
+    bucket.signature = _signature("b")
+    bucket.save()
+    assert bucket.get_signature().raw_signature == _signature("b")
+    assert SIGNATURE_CACHE.get(_signature("a")) is not signature
+    assert Bucket.objects.get(pk=bucket.pk).get_signature() is bucket.get_signature()
+
+    # deleting the bucket drops its signature
+    signature = bucket.get_signature()
+    bucket.delete()
+    assert SIGNATURE_CACHE.get(_signature("b")) is not signature
+
+
+def test_dimension_cache_01(django_capture_on_commit_callbacks):
+    """test looking up and creating rows of a lookup table"""
+    linux = OS.objects.create(name="Linux").pk
+    cache = DimensionCache(OS, ("name",), 2)
+    with django_capture_on_commit_callbacks(execute=True):
+        # warmed on first use, even in a transaction
+        assert cache.get_id(name="Linux") == linux
+        windows = cache.get_id(name="Windows")
+        # created rows are found until the transaction is committed
+        assert cache.get_id(name="Windows") == windows
+        assert len(cache) == 1
+    assert OS.objects.get(name="Windows").pk == windows
+    assert cache.get_id(name="Linux") == linux
+    assert cache.get_id(name="Windows") == windows
+    assert cache.stats() == {"size": 2, "max_size": 2, "hits": 4, "misses": 1}
+
+    # the least recently used key is evicted
+    with django_capture_on_commit_callbacks(execute=True):
+        mac = cache.get_id(name="Mac")
+    assert cache.get_id(name="Windows") == windows
+    assert len(cache) == 2
+    assert cache.stats()["hits"] == 5
+    assert cache.get_id(name="Linux") == linux
+    assert cache.stats()["misses"] == 3
+
+    # the most recent rows are loaded when warming
+    cache.clear()
+    cache.warm()
+    assert cache.get_id(name="Mac") == mac
+    assert cache.get_id(name="Windows") == windows
+    assert cache.stats() == {"size": 2, "max_size": 2, "hits": 2, "misses": 0}
+
+
+def test_dimension_cache_02(django_capture_on_commit_callbacks):
+    """test that rows created in a savepoint which is rolled back are not cached"""
+    cache = DimensionCache(OS, ("name",), 2)
+    with django_capture_on_commit_callbacks(execute=True):
+        with transaction.atomic():
+            linux = cache.get_id(name="Linux")
+        with pytest.raises(ValueError), transaction.atomic():
+            assert cache.get_id(name="Linux") == linux
+            cache.get_id(name="Windows")
+            raise ValueError()
+        assert cache.stats()["misses"] == 2
+        # the row of the released savepoint is still found
+        assert cache.get_id(name="Linux") == linux
+        windows = cache.get_id(name="Windows")
+        assert cache.stats()["misses"] == 3
+    assert cache.get_id(name="Windows") == windows
+    assert OS.objects.get(name="Windows").pk == windows
+    assert sorted(OS.objects.values_list("name", flat=True)) == ["Linux", "Windows"]
+    assert len(cache) == 2
+
+    with pytest.raises(ValueError), transaction.atomic():
+        cache.get_id(name="Mac")
+        raise ValueError()
+    assert len(cache) == 2
+    assert not OS.objects.filter(name="Mac").exists()
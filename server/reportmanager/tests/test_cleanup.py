@@ -0,0 +1,114 @@
+from datetime import timedelta
+
+import pytest
+
+pytest.importorskip("pytest_django")
+
+from django.core.management import call_command  # noqa: E402
+from django.db import transaction  # noqa: E402
+from django.utils import timezone  # noqa: E402
+
+from reportmanager.models import (  # noqa: E402
+    Bucket,
+    BucketHit,
+    BucketHitRollup,
+    BucketRepresentative,
+    BucketStats,
+    Bug,
+    BugProvider,
+    ReportEntry,
+    ReportHit,
+)
+
+pytestmark = pytest.mark.django_db
+
+
+def _state():
+    return (
+        sorted(Bucket.objects.values_list("id", flat=True)),
+        sorted(ReportEntry.objects.values_list("id", flat=True)),
+        sorted(BucketHit.objects.values_list("bucket_id", "begin", "count")),
+        sorted(
+            BucketHitRollup.objects.values_list(
+                "bucket_id", "resolution", "begin", "count"
+            )
+        ),
+        sorted(ReportHit.objects.values_list("last_update", "count")),
+        sorted(
+            BucketStats.objects.values_list(
+                "bucket_id", "size", "latest_report", "latest_entry_id"
+            )
+        ),
+        sorted(BucketRepresentative.objects.values_list("bucket_id", "entry_id")),
+    )
+
+
+@pytest.fixture
+def entries(create_entry):
+    now = timezone.now().replace(minute=0, second=0, microsecond=0)
+    buckets = [
+        Bucket.objects.create(description=str(idx), signature="{}") for idx in range(3)
+    ]
+    # bucket 2 is empty
+    times = (
+        # on the hour, and just after it
+        now - timedelta(days=20),
+        now - timedelta(days=20, microseconds=-1),
+        now - timedelta(days=20, minutes=30),
+        now - timedelta(days=15, minutes=1),
+        now - timedelta(days=1),
+        now,
+    )
+    idx = 0
+    for bucket in (buckets[0], buckets[1], None):
+        for reported_at in times:
+            create_entry(idx, bucket, reported_at=reported_at)
+            idx += 1
+    BucketRepresentative.refresh()
+    return buckets
+
+
+def test_cleanup_01(entries):
+    """test that counters are the same as when deleting entries one by one"""
+    expiry_date = timezone.now() - timedelta(days=14)
+    with transaction.atomic():
+        with BucketHit.deferred():
+            ReportEntry.objects.filter(reported_at__lt=expiry_date).delete()
+        Bucket.objects.filter(pk=entries[2].pk).delete()
+        expected = _state()
+        transaction.set_rollback(True)
+
+    call_command("cleanup_old_reports", chunk_size=4)
+    assert _state() == expected
+    assert ReportEntry.objects.count() == 6
+    assert BucketStats.objects.get(bucket=entries[0]).size == 2
+
+
+def test_cleanup_02(entries, caplog):
+    """test that a dry run doesn't delete anything"""
+    provider = BugProvider.objects.create(
+        classname="BugzillaProvider", hostname="example.com"
+    )
+    bug = Bug.objects.create(
+        external_id="1",
+        external_type=provider,
+        closed=timezone.now() - timedelta(days=30),
+    )
+    Bucket.objects.filter(pk=entries[1].pk).update(bug=bug)
+    before = _state()
+    caplog.set_level("INFO", logger="reportmanager")
+
+    call_command("cleanup_old_reports", dry_run=True)
+    assert _state() == before
+    messages = [record.getMessage() for record in caplog.records]
+    assert messages == [
+        "Would remove 6 ReportEntry objects from buckets assigned to closed bugs",
+        "Would remove 1 closed Bug objects",
+        "Would remove 1 empty buckets",
+        "Would remove 8 old reports",
+    ]
+
+    call_command("cleanup_old_reports")
+    assert ReportEntry.objects.count() == 4
+    assert not Bug.objects.exists()
+    assert sorted(Bucket.objects.values_list("pk", flat=True)) == [entries[0].pk]
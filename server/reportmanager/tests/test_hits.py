@@ -0,0 +1,127 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+pytest.importorskip("pytest_django")
+
+from reportmanager.cron import update_report_stats  # noqa: E402
+from reportmanager.models import (  # noqa: E402
+    Bucket,
+    BucketHit,
+    BucketHitRollup,
+    ReportEntry,
+    ReportHit,
+)
+
+pytestmark = pytest.mark.django_db
+
+# a Wednesday
+NOW = datetime(2024, 3, 6, 12, tzinfo=timezone.utc)
+
+
+def _bucket_hits():
+    return sorted(BucketHit.objects.values_list("bucket_id", "begin", "count"))
+
+
+def _report_hits(*fields):
+    # the migrations create counters for the recent history
+    return sorted(
+        ReportHit.objects.filter(
+            last_update__range=(NOW - timedelta(days=1), NOW + timedelta(days=1))
+        ).values_list("last_update", *(fields or ("count",)))
+    )
+
+
+def test_hits_01():
+    """test applying changes to many BucketHit counters at once"""
+    buckets = [
+        Bucket.objects.create(description=str(idx), signature="{}") for idx in range(2)
+    ]
+    a, b = (bucket.pk for bucket in buckets)
+    hour = NOW - timedelta(hours=1)
+
+    BucketHit.apply_deltas(
+        {
+            # merged into the same hour
+            (a, hour + timedelta(minutes=5)): 1,
+            (a, hour + timedelta(minutes=59)): 2,
+            (a, NOW + timedelta(minutes=30)): 3,
+            (b, NOW): -1,
+            (b, hour): 0,
+        }
+    )
+    # counters are only created for increments
+    assert _bucket_hits() == [(a, hour, 3), (a, NOW, 3)]
+    rollups = sorted(
+        BucketHitRollup.objects.values_list("bucket_id", "resolution", "count")
+    )
+    assert rollups == [(a, "day", 6), (a, "week", 6)]
+
+    BucketHit.apply_deltas(
+        {
+            # counters never go below zero
+            (a, hour): -10,
+            (a, NOW): -1,
+            (b, NOW): 1,
+            (b, NOW + timedelta(minutes=1)): -1,
+        }
+    )
+    assert _bucket_hits() == [(a, hour, 0), (a, NOW, 2)]
+
+
+def test_hits_02():
+    """test applying changes to many ReportHit counters at once"""
+    ReportHit.objects.create(last_update=NOW, count=2)
+    ReportHit.apply_deltas(
+        {
+            NOW - timedelta(minutes=30): 1,
+            NOW: 1,
+            NOW + timedelta(minutes=1): 4,
+            NOW + timedelta(hours=1): -1,
+            NOW + timedelta(hours=2): 0,
+        }
+    )
+    assert _report_hits() == [
+        (NOW, 4),
+        (NOW + timedelta(hours=1), 3),
+    ]
+
+    ReportHit.apply_deltas({NOW: -5, NOW + timedelta(hours=1): -1})
+    assert _report_hits() == [
+        (NOW, 0),
+        (NOW + timedelta(hours=1), 2),
+    ]
+
+
+def test_hits_03(create_entry, mocker):
+    """test that only counters changed after the end of their hour are recounted"""
+    mocker.patch("django.utils.timezone.now", return_value=NOW + timedelta(minutes=30))
+    old = ReportHit.objects.create(last_update=NOW - timedelta(days=15), dirty=True)
+    create_entry(1, reported_at=NOW - timedelta(minutes=10))
+    create_entry(2, reported_at=NOW + timedelta(minutes=10))
+    create_entry(3, reported_at=NOW + timedelta(minutes=20)).delete()
+    # the hour ended, or an entry was removed
+    assert _report_hits("count", "dirty") == [
+        (NOW, 1, True),
+        (NOW + timedelta(hours=1), 1, True),
+    ]
+
+    # moved without signals
+    ReportEntry.objects.filter(uuid__endswith="1").update(
+        reported_at=NOW + timedelta(minutes=5)
+    )
+    update_report_stats()
+    assert not ReportHit.objects.filter(pk=old.pk).exists()
+    assert _report_hits("count", "dirty") == [
+        (NOW, 0, False),
+        (NOW + timedelta(hours=1), 2, False),
+    ]
+
+    # counters of the current hour are not recounted
+    create_entry(4, reported_at=NOW + timedelta(minutes=40))
+    ReportEntry.objects.filter(uuid__endswith="4").update(reported_at=NOW)
+    update_report_stats()
+    assert _report_hits("count", "dirty") == [
+        (NOW, 0, False),
+        (NOW + timedelta(hours=1), 3, False),
+    ]
@@ -0,0 +1,166 @@
+import json
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("pytest_django")
+
+from django.core.management import call_command  # noqa: E402
+
+from reportmanager.importer import KNOWN_BUCKET_IDS  # noqa: E402
+from reportmanager.models import (  # noqa: E402
+    OS,
+    App,
+    BreakageCategory,
+    Bucket,
+    BucketHit,
+    BucketStats,
+    ReportEntry,
+    ReportHit,
+)
+from reportmanager.triage import invalidate_signature_index  # noqa: E402
+
+pytestmark = pytest.mark.django_db
+
+NOW = datetime(2024, 3, 6, 12, tzinfo=timezone.utc)
+
+
+@pytest.fixture(autouse=True)
+def _forget_buckets():
+    # buckets are memoized and indexed per process, and the database is rolled
+    # back after each test
+    KNOWN_BUCKET_IDS.clear()
+    invalidate_signature_index()
+    yield
+    KNOWN_BUCKET_IDS.clear()
+    invalidate_signature_index()
+
+
+def _row(idx, hostname, hours=0, **fields):
+    values = {
+        "app_channel": "release",
+        "app_name": "Firefox",
+        "app_version": "1",
+        "breakage_category": None,
+        "comments": f"comment {idx}",
+        "details": {},
+        "language_code": None,
+        "ml_label": None,
+        "ml_probability": None,
+        "os": "Linux",
+        # naive, as returned for DATETIME columns
+        "reported_at": (NOW + timedelta(hours=hours)).replace(tzinfo=None),
+        "translated_text": None,
+        "url": f"https://{hostname}/",
+        "uuid": f"00000000-0000-0000-0000-{idx:012d}",
+    }
+    values.update(fields)
+    return SimpleNamespace(**values)
+
+
+def test_importer_01(mocker):
+    """test importing rows of BigQuery in chunks"""
+    bucket = Bucket.objects.create(
+        description="a",
+        signature=json.dumps(
+            {"symptoms": [{"type": "url", "part": "hostname", "value": "a"}]}
+        ),
+    )
+    rows = [
+        _row(1, "a", ml_label="invalid", ml_probability=0.75),
+        _row(2, "b", os="Windows", breakage_category="site"),
+        _row(3, "a", hours=1, app_version="2", breakage_category="site"),
+        # duplicate of a row of the previous chunk
+        _row(1, "a"),
+        _row(4, "b", hours=1, os="Windows", ml_label="valid", ml_probability=0.5),
+    ]
+    # rows are fetched page by page from an iterator
+    get_rows = mocker.patch(
+        "reportmanager.management.commands.import_reports_from_bigquery.get_rows",
+        return_value=iter(rows),
+    )
+    call_command("import_reports_from_bigquery", since=NOW, chunk_size=2)
+    get_rows.assert_called_once_with(NOW, 5000)
+
+    entries = list(ReportEntry.objects.order_by("uuid").select_related("bucket"))
+    assert [entry.uuid.int for entry in entries] == [1, 2, 3, 4]
+    assert [entry.reported_at for entry in entries] == [
+        NOW,
+        NOW,
+        NOW + timedelta(hours=1),
+        NOW + timedelta(hours=1),
+    ]
+    assert [entry.ml_valid_probability for entry in entries] == [0.25, None, None, 0.5]
+    assert entries[0].get_report().url.hostname == "a"
+
+    # a bucket is created for the new domain, and reused for the next chunk
+    b_bucket = Bucket.objects.get(domain="b")
+    assert [entry.bucket_id for entry in entries] == [
+        bucket.pk,
+        b_bucket.pk,
+        bucket.pk,
+        b_bucket.pk,
+    ]
+
+    # dimension rows are created once
+    assert sorted(App.objects.values_list("version", flat=True)) == ["1", "2"]
+    assert sorted(OS.objects.values_list("name", flat=True)) == ["Linux", "Windows"]
+    assert list(BreakageCategory.objects.values_list("value", flat=True)) == ["site"]
+    assert entries[1].os_id == entries[3].os_id
+    assert entries[1].breakage_category_id == entries[2].breakage_category_id
+    assert entries[0].app_id == entries[1].app_id != entries[2].app_id
+
+    # counters are updated for each chunk
+    hits = sorted(BucketHit.objects.values_list("bucket_id", "begin", "count"))
+    assert hits == sorted(
+        [
+            (bucket.pk, NOW, 1),
+            (bucket.pk, NOW + timedelta(hours=1), 1),
+            (b_bucket.pk, NOW, 1),
+            (b_bucket.pk, NOW + timedelta(hours=1), 1),
+        ]
+    )
+    report_hits = sorted(
+        ReportHit.objects.filter(
+            last_update__range=(NOW, NOW + timedelta(hours=1))
+        ).values_list("last_update", "count")
+    )
+    assert report_hits == [(NOW, 2), (NOW + timedelta(hours=1), 2)]
+    stats = sorted(
+        BucketStats.objects.values_list("bucket_id", "size", "latest_entry_id")
+    )
+    assert stats == sorted(
+        [(bucket.pk, 2, entries[2].pk), (b_bucket.pk, 2, entries[3].pk)]
+    )
+
+    # importing again skips all rows
+    get_rows.return_value = iter(rows)
+    call_command("import_reports_from_bigquery", since=NOW)
+    assert ReportEntry.objects.count() == 4
+    assert BucketHit.objects.filter(count__gt=1).count() == 0
+
+
+def test_importer_02(mocker):
+    """test that imported reports are triaged into the highest priority bucket,
+    not only into the bucket of their domain
+    """
+    bucket = Bucket.objects.create(
+        description="a",
+        signature=json.dumps(
+            {"symptoms": [{"type": "url", "part": "hostname", "value": "a"}]}
+        ),
+    )
+    video = Bucket.objects.create(
+        description="video",
+        priority=1,
+        signature=json.dumps({"symptoms": [{"type": "comments", "pattern": "video"}]}),
+    )
+    mocker.patch(
+        "reportmanager.management.commands.import_reports_from_bigquery.get_rows",
+        return_value=iter([_row(1, "a"), _row(2, "a", comments="video")]),
+    )
+    call_command("import_reports_from_bigquery", since=NOW)
+    assert list(
+        ReportEntry.objects.order_by("uuid").values_list("bucket_id", flat=True)
+    ) == [bucket.pk, video.pk]
@@ -0,0 +1,121 @@
+import json
+
+import pytest
+
+pytest.importorskip("pytest_django")
+
+from reportmanager.models import (  # noqa: E402
+    Bucket,
+    BucketRepresentative,
+    Bug,
+    BugProvider,
+    ReportEntry,
+)
+from reportmanager.views import signature_optimize  # noqa: E402
+
+pytestmark = pytest.mark.django_db
+
+HOSTNAME = {"type": "url", "part": "hostname", "value": "a.com"}
+OS = {"type": "os", "value": "Windows"}
+# unbucketed entries, oldest first: (hostname, os)
+UNBUCKETED = [
+    ("a.com", "Windows"),
+    ("c.com", "Windows"),
+    ("a.com", "Linux"),
+    # fitted to the hostname symptom
+    ("b.com", "Windows"),
+    # fitted to the os symptom, which matches the other bucket
+    ("a.com", "Linux"),
+    # matches the bucket already
+    ("a.com", "Windows"),
+]
+
+
+@pytest.fixture
+def buckets(create_entry, mocker):
+    # few entries per chunk, so candidates and their matches span chunks
+    mocker.patch("reportmanager.models.OPTIMIZE_CHUNK_SIZE", 2)
+    bucket = Bucket.objects.create(
+        description="a", signature=json.dumps({"symptoms": [HOSTNAME, OS]})
+    )
+    other = Bucket.objects.create(
+        description="f",
+        signature=json.dumps(
+            {"symptoms": [{"type": "url", "part": "hostname", "value": "f.com"}]}
+        ),
+    )
+    create_entry(0, other, hostname="f.com", os="Windows")
+    BucketRepresentative.refresh()
+    for idx, (hostname, os) in enumerate(UNBUCKETED, 1):
+        create_entry(idx, hostname=hostname, os=os)
+    return bucket, other
+
+
+def _optimize(bucket):
+    entries = ReportEntry.objects.filter(bucket=None).order_by("-id")
+    signature, entry_ids = bucket.optimize_signature(entries)
+    uuids = dict(ReportEntry.objects.values_list("id", "uuid"))
+    return (
+        None if signature is None else json.loads(signature.raw_signature),
+        [uuids[entry_id].int for entry_id in entry_ids],
+    )
+
+
+def test_optimize_01(buckets):
+    """test that the first fitted signature not matching other buckets is returned
+    with all unbucketed entries it matches
+    """
+    bucket, _ = buckets
+    assert _optimize(bucket) == ({"symptoms": [HOSTNAME]}, [6, 5, 3, 1])
+
+
+def test_optimize_02(buckets):
+    """test that other buckets linked to the same bug may be matched"""
+    bucket, other = buckets
+    provider = BugProvider.objects.create(
+        classname="BugzillaProvider", hostname="example.com"
+    )
+    bug = Bug.objects.create(external_id="1", external_type=provider)
+    Bucket.objects.filter(pk__in=(bucket.pk, other.pk)).update(bug=bug)
+    bucket.refresh_from_db()
+    assert _optimize(bucket) == ({"symptoms": [OS]}, [6, 4, 2, 1])
+
+
+def test_optimize_03(buckets):
+    """test that there is no signature if all entries match the bucket, or if
+    fitted signatures only match other buckets
+    """
+    bucket, other = buckets
+    ReportEntry.objects.exclude(hostname="a.com", os__name="Windows").update(
+        bucket=other
+    )
+    assert _optimize(bucket) == (None, [])
+
+    ReportEntry.objects.filter(uuid__endswith="5").update(bucket=None)
+    assert _optimize(bucket) == (None, [])
+
+
+def test_optimize_04(buckets, mocker, rf):
+    """test the optimize view when the matching entries were triaged since"""
+    bucket, other = buckets
+    render = mocker.patch("reportmanager.views.render")
+    signature_optimize(rf.get("/"), bucket.pk)
+    context = render.call_args[0][2]
+    assert context["optimized_signature"] is not None
+    assert [entry.uuid.int for entry in context["matching_entries"]] == [6, 5, 3, 1]
+    assert context["diff"]
+
+    mocker.patch.object(
+        Bucket,
+        "optimize_signature",
+        side_effect=lambda entries: (
+            bucket.get_signature(),
+            list(entries.values_list("id", flat=True)),
+        ),
+    )
+    ReportEntry.objects.update(bucket=other)
+    signature_optimize(rf.get("/"), bucket.pk)
+    context = render.call_args[0][2]
+    assert context["optimized_signature"] is None
+    assert context["diff"] is None
+    assert context["matching_entries"] == []
@@ -0,0 +1,76 @@
+from datetime import datetime, timedelta, timezone
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+pytest.importorskip("pytest_django")
+
+from rest_framework.exceptions import NotFound  # noqa: E402
+from rest_framework.request import Request  # noqa: E402
+from rest_framework.test import APIRequestFactory  # noqa: E402
+
+from reportmanager.models import ReportEntry  # noqa: E402
+from reportmanager.pagination import KeysetPagination  # noqa: E402
+
+pytestmark = pytest.mark.django_db
+
+BEGIN = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def _paginate(queryset, **params):
+    paginator = KeysetPagination()
+    request = Request(APIRequestFactory().get("/", params))
+    page = paginator.paginate_queryset(queryset, request)
+    next_link = paginator.get_next_link()
+    if next_link is not None:
+        next_link = parse_qs(urlsplit(next_link).query)
+    return [entry.pk for entry in page], next_link, paginator.count
+
+
+@pytest.mark.parametrize(
+    "ordering",
+    (
+        (),
+        ("-id",),
+        ("ml_valid_probability",),
+        ("-ml_valid_probability", "reported_at"),
+        ("-comments__length",),
+    ),
+)
+def test_pagination_01(create_entry, settings, ordering):
+    """test that cursor pagination returns all entries in order"""
+    settings.ALLOWED_HOSTS = ["testserver"]
+    for idx in range(25):
+        create_entry(
+            idx,
+            comments="x" * (idx % 4),
+            ml_valid_probability=(None, 0.5, 0.9)[idx % 3],
+            reported_at=BEGIN + timedelta(hours=idx % 5),
+        )
+    queryset = ReportEntry.objects.order_by(*ordering)
+    tiebreaker = "-id" if ordering and ordering[-1].startswith("-") else "id"
+    expected, _, _ = _paginate(queryset.order_by(*ordering, tiebreaker), limit=100)
+    if ordering and ordering[0].lstrip("-") == "ml_valid_probability":
+        # the database may order nulls differently, pagination orders them last
+        # (first if descending)
+        nulls = set(
+            ReportEntry.objects.filter(ml_valid_probability=None).values_list(
+                "pk", flat=True
+            )
+        )
+        non_null = [pk for pk in expected if pk not in nulls]
+        null = [pk for pk in expected if pk in nulls]
+        expected = null + non_null if ordering[0].startswith("-") else non_null + null
+
+    result = []
+    cursor = ""
+    while cursor is not None:
+        page, next_link, count = _paginate(queryset, cursor=cursor, limit=4)
+        assert count == 25
+        assert len(page) <= 4
+        result.extend(page)
+        cursor = next_link["cursor"][0] if next_link else None
+    assert result == expected
+
+    with pytest.raises(NotFound):
+        _paginate(queryset, cursor="invalid")
@@ -0,0 +1,293 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+pytest.importorskip("pytest_django")
+
+from django.core.exceptions import ImproperlyConfigured  # noqa: E402
+from django.core.management import call_command  # noqa: E402
+from django.db import transaction  # noqa: E402
+
+from reportmanager.cleanup import EntryCleanup  # noqa: E402
+from reportmanager.models import (  # noqa: E402
+    Bucket,
+    BucketHit,
+    BucketRepresentative,
+    BucketStats,
+    ReportEntry,
+    ReportHit,
+)
+from reportmanager.partitions import Partition, ReportPartitions  # noqa: E402
+
+pytestmark = pytest.mark.django_db
+
+# a Wednesday
+NOW = datetime(2024, 3, 6, 12, tzinfo=timezone.utc)
+
+
+def _partition(begin, days=1):
+    end = begin + timedelta(days=days)
+    return Partition(f"p{begin:%Y%m%d}_{end:%Y%m%d}", begin, end)
+
+
+def test_partitions_01(mocker, settings):
+    """test partition ranges"""
+    mocker.patch("django.utils.timezone.now", return_value=NOW)
+    today = NOW.replace(hour=0)
+
+    settings.REPORT_PARTITION_INTERVAL = "day"
+    partitions = ReportPartitions()
+    # not supported by sqlite
+    assert not partitions.supported
+    assert partitions.get_partitions() == []
+    assert partitions.get_partition(NOW) == Partition(
+        "p20240306_20240307", today, today + timedelta(days=1)
+    )
+    assert partitions.get_missing(today + timedelta(days=2), []) == [
+        _partition(today),
+        _partition(today + timedelta(days=1)),
+    ]
+    # only after the last existing partition
+    assert partitions.get_missing(
+        today + timedelta(days=3), [_partition(today + timedelta(days=1))]
+    ) == [_partition(today + timedelta(days=2))]
+    assert partitions.get_missing(today, [_partition(today)]) == []
+    # without gaps, even if partitions were not created in time
+    assert partitions.get_missing(
+        today + timedelta(days=1), [_partition(today - timedelta(days=2))]
+    ) == [_partition(today - timedelta(days=1)), _partition(today)]
+    # on mysql, the lowest partition holds older entries, and a partition those
+    # in a gap before it
+    existing = [_partition(today), _partition(today + timedelta(days=2))]
+    other_partitions = ReportPartitions()
+    mocker.patch.object(other_partitions, "get_partitions", return_value=existing)
+    other_partitions.connection = mocker.Mock(vendor="mysql")
+    assert other_partitions.get_range(existing[0]) == (None, existing[0].end)
+    assert other_partitions.get_range(existing[1]) == (
+        existing[0].end,
+        existing[1].end,
+    )
+    other_partitions.connection.vendor = "postgresql"
+    assert other_partitions.get_range(existing[1]) == existing[1][1:]
+    with pytest.raises(ImproperlyConfigured):
+        partitions.conversion_sql(today)
+
+    settings.REPORT_PARTITION_INTERVAL = "week"
+    partitions = ReportPartitions()
+    monday = today - timedelta(days=2)
+    assert partitions.get_partition(NOW + timedelta(days=5)) == _partition(
+        monday + timedelta(days=7), 7
+    )
+    assert partitions.get_missing(monday + timedelta(days=8), []) == [
+        _partition(monday, 7),
+        _partition(monday + timedelta(days=7), 7),
+    ]
+
+    settings.REPORT_PARTITION_INTERVAL = "month"
+    with pytest.raises(ImproperlyConfigured):
+        ReportPartitions()
+
+
+def _drop(partitions, partition):
+    # dropping a partition deletes its rows, without signals
+    entries = ReportEntry.objects.filter(
+        reported_at__gte=partition.begin, reported_at__lt=partition.end
+    )
+    entries._raw_delete(entries.db)
+
+
+def _state():
+    return (
+        sorted(ReportEntry.objects.values_list("id", flat=True)),
+        sorted(BucketHit.objects.values_list("bucket_id", "begin", "count")),
+        sorted(ReportHit.objects.values_list("last_update", "count")),
+        sorted(
+            BucketStats.objects.values_list(
+                "bucket_id", "size", "latest_report", "latest_entry_id"
+            )
+        ),
+        sorted(BucketRepresentative.objects.values_list("bucket_id", "entry_id")),
+    )
+
+
+def test_partitions_02(create_entry, mocker, settings):
+    """test that expired partitions are dropped by cleanup_old_reports"""
+    settings.CLEANUP_REPORTS_AFTER_DAYS = 14
+    settings.REPORT_PARTITION_INTERVAL = "day"
+    mocker.patch("django.utils.timezone.now", return_value=NOW)
+    bucket = Bucket.objects.create(description="a", signature="{}")
+    day = NOW.replace(hour=0) - timedelta(days=16)
+    for idx, reported_at in enumerate(
+        (
+            day,
+            day + timedelta(hours=1),
+            day + timedelta(hours=23, minutes=59),
+            day + timedelta(days=1, hours=6),
+            # the third partition ends after the expiry date, its old entries are
+            # deleted row by row
+            day + timedelta(days=2, hours=3),
+            day + timedelta(days=2, hours=13),
+            NOW,
+        )
+    ):
+        create_entry(idx, None if idx == 1 else bucket, reported_at=reported_at)
+    BucketRepresentative.refresh()
+
+    expiry_date = NOW - timedelta(days=14)
+    with transaction.atomic():
+        with BucketHit.deferred():
+            ReportEntry.objects.filter(reported_at__lt=expiry_date).delete()
+        expected = _state()
+        transaction.set_rollback(True)
+
+    partitions = [_partition(day + timedelta(days=idx)) for idx in range(4)]
+    mocker.patch.object(ReportPartitions, "supported", True)
+    mocker.patch.object(ReportPartitions, "get_partitions", return_value=partitions)
+    mocker.patch.object(ReportPartitions, "lock")
+    drop = mocker.patch.object(
+        ReportPartitions, "drop", autospec=True, side_effect=_drop
+    )
+    call_command("cleanup_old_reports", leave_empty_buckets=True)
+    assert [call.args[1] for call in drop.call_args_list] == partitions[:2]
+    assert _state() == expected
+    assert ReportEntry.objects.count() == 2
+
+
+def test_partitions_03(create_entry, mocker, settings):
+    """test that dropping mysql partitions accounts for all the entries they hold"""
+    settings.REPORT_PARTITION_INTERVAL = "day"
+    bucket = Bucket.objects.create(description="a", signature="{}")
+    day = NOW.replace(hour=0) - timedelta(days=16)
+    partitions = [
+        _partition(day),
+        # no partition was created for the day after
+        _partition(day + timedelta(days=2)),
+        _partition(day + timedelta(days=3)),
+    ]
+    for idx, reported_at in enumerate(
+        (
+            # imported late, in the lowest partition
+            day - timedelta(days=3),
+            day + timedelta(hours=1),
+            # in the gap, held by the next partition
+            day + timedelta(days=1, hours=6),
+            day + timedelta(days=2, hours=3),
+            day + timedelta(days=3, hours=3),
+        )
+    ):
+        create_entry(idx, bucket, reported_at=reported_at)
+    BucketRepresentative.refresh()
+
+    with transaction.atomic():
+        with BucketHit.deferred():
+            ReportEntry.objects.filter(reported_at__lt=partitions[1].end).delete()
+        expected = _state()
+        transaction.set_rollback(True)
+
+    def drop(partition):
+        # as done by mysql, the partitions before were dropped already
+        entries = ReportEntry.objects.filter(reported_at__lt=partition.end)
+        entries._raw_delete(entries.db)
+
+    report_partitions = ReportPartitions()
+    report_partitions.connection = mocker.Mock(vendor="mysql")
+    mocker.patch.object(report_partitions, "lock")
+    mocker.patch.object(report_partitions, "drop", side_effect=drop)
+    cleanup = EntryCleanup()
+    for idx in range(2):
+        mocker.patch.object(
+            report_partitions, "get_partitions", return_value=partitions[idx:]
+        )
+        assert cleanup.delete_partition(report_partitions, partitions[idx]) == 2
+    assert _state() == expected
+
+
+def _postgresql(mocker, partitions, fetchone=()):
+    connection = mocker.MagicMock(vendor="postgresql", alias="default")
+    connection.ops.quote_name = lambda name: f'"{name}"'
+    connection.introspection.get_constraints.return_value = {
+        "pkey": {
+            "columns": ["id"],
+            "primary_key": True,
+            "unique": True,
+            "foreign_key": None,
+        }
+    }
+    cursor = connection.cursor.return_value.__enter__.return_value
+    cursor.fetchall.return_value = []
+    cursor.fetchone.side_effect = fetchone
+    partitions.connection = connection
+    return cursor
+
+
+@pytest.mark.parametrize("conflict", (False, True))
+def test_partitions_04(mocker, settings, conflict):
+    """test creating a partition when the postgresql default partition holds
+    entries in its range
+    """
+    settings.REPORT_PARTITION_INTERVAL = "day"
+    partitions = ReportPartitions()
+    cursor = _postgresql(mocker, partitions, [(True,), (conflict,)])
+    partition = _partition(NOW.replace(hour=0))
+    partitions.create(partition)
+    statements = [call.args[0] for call in cursor.execute.call_args_list[2:]]
+    create = (
+        'CREATE TABLE "reportmanager_reportentry_p20240306_20240307" PARTITION OF'
+        ' "reportmanager_reportentry" FOR VALUES'
+        " FROM ('2024-03-06 00:00:00+00:00') TO ('2024-03-07 00:00:00+00:00')"
+    )
+    if not conflict:
+        assert statements == [create]
+        return
+    in_range = (
+        "reported_at >= '2024-03-06 00:00:00+00:00'"
+        " AND reported_at < '2024-03-07 00:00:00+00:00'"
+    )
+    assert statements == [
+        'ALTER TABLE "reportmanager_reportentry"'
+        ' DETACH PARTITION "reportmanager_reportentry_default"',
+        create,
+        'INSERT INTO "reportmanager_reportentry"'
+        f' SELECT * FROM "reportmanager_reportentry_default" WHERE {in_range}',
+        f'DELETE FROM "reportmanager_reportentry_default" WHERE {in_range}',
+        'ALTER TABLE "reportmanager_reportentry"'
+        ' ATTACH PARTITION "reportmanager_reportentry_default" DEFAULT',
+    ]
+
+
+@pytest.mark.parametrize("identity", (False, True))
+def test_partitions_05(mocker, settings, identity):
+    """test that the id sequence is carried over by the postgresql conversion"""
+    settings.REPORT_PARTITION_INTERVAL = "week"
+    mocker.patch("django.utils.timezone.now", return_value=NOW)
+    partitions = ReportPartitions()
+    _postgresql(
+        mocker,
+        partitions,
+        [("public.reportmanager_reportentry_id_seq", identity)],
+    )
+    statements = partitions.conversion_sql(NOW + timedelta(days=7))
+    assert statements[0] == "BEGIN"
+    assert statements[-1] == "COMMIT"
+    assert (
+        'ALTER TABLE "reportmanager_reportentry_partitioned"'
+        ' ADD PRIMARY KEY ("id", reported_at)' in statements
+    )
+    assert sum(" PARTITION OF " in statement for statement in statements) == 3
+    sequence_statements = [
+        statement
+        for statement in statements
+        if "setval" in statement or "SEQUENCE" in statement
+    ]
+    if identity:
+        assert sequence_statements == [
+            "SELECT setval(pg_get_serial_sequence("
+            "'reportmanager_reportentry_partitioned', 'id'),"
+            " (SELECT COALESCE(MAX(id), 0) + 1"
+            ' FROM "reportmanager_reportentry_partitioned"), false)'
+        ]
+    else:
+        assert sequence_statements == [
+            "ALTER SEQUENCE public.reportmanager_reportentry_id_seq"
+            ' OWNED BY "reportmanager_reportentry_partitioned".id'
+        ]
@@ -0,0 +1,232 @@
+import json
+import random
+import re
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlsplit
+
+import pytest
+
+pytest.importorskip("pytest_django")
+
+from django.db import connection  # noqa: E402
+
+from reportmanager.models import ReportEntry  # noqa: E402
+from reportmanager.pushdown import (  # noqa: E402
+    compile_signature,
+    match_residual_batch,
+    matches_residual,
+    translate_pattern,
+)
+from webcompat.models import Report, ReportBatch, Signature  # noqa: E402
+
+pytestmark = pytest.mark.django_db
+
+BEGIN = datetime(2024, 1, 1, tzinfo=timezone.utc)
+TIMES = [BEGIN + timedelta(hours=n) for n in range(6)]
+VALUES = {
+    "app_channel": ["release", "nightly", None],
+    "app_name": ["Firefox", "Fenix"],
+    "app_version": ["1", "2"],
+    "breakage_category": ["site", "video", None],
+    "comments": ["it broke", "It Broke", "video"],
+    "os": ["Linux", "Windows"],
+}
+# pattern -> whether it can be translated
+PATTERNS = {
+    "": True,
+    "abc": True,
+    "a.c": True,
+    "a|bc|": True,
+    "(ab)+c?": True,
+    "a{2,3}?b{300}": True,
+    "[a-c_.]+$": True,
+    "[^a-c]x": True,
+    "[-a$]|^b": True,
+    "[$&~]": True,
+    "https?://example\\.com/.*": True,
+    "(?:x|y)*\\Z": True,
+    "\\.\\*\\(\\[\\{\\\\": True,
+    "\u00e4+\n": True,
+    "[^-a]": False,
+    "\\d+": False,
+    "\\w": False,
+    "[\\s]": False,
+    "\\bx": False,
+    "(a)\\1": False,
+    "a(?=b)": False,
+    "a(?!b)": False,
+    "(?<=a)b": False,
+    "(?i)abc": False,
+    "(?i:a)b": False,
+    "(?s).": False,
+    "(?m)a$": False,
+    "(": False,
+}
+STRINGS = [
+    "",
+    "a",
+    "abc",
+    "ABC",
+    "abcx",
+    "a\nc",
+    # line terminators which `.` doesn't match on MySQL
+    "a\rc",
+    "a\u0085c",
+    "a\u2028c",
+    "a\u2029c",
+    "aac",
+    "bc",
+    "ababc",
+    "aabbb",
+    "a" * 3 + "b" * 300,
+    "a" * 2 + "b" * 299,
+    "_.a\n",
+    "_.a\n\n",
+    "dx",
+    "ax",
+    "\nx",
+    "-",
+    "$",
+    "b",
+    "~",
+    "https://example.com/x",
+    "http://exampleXcom/",
+    "xyxy",
+    "xyxy\n",
+    ".*([{\\",
+    "\u00e4\u00e4\n",
+    "\u00c4\n",
+]
+URLS = [
+    "https://a.example.com/",
+    "https://A.example.com/p?q",
+    "http://b.example.com:8080/p",
+    "about:blank",
+    "file:///tmp/x",
+]
+
+
+def _random_symptom(rnd):
+    kind = rnd.choice(("property", "url", "reported_at", "details"))
+    if kind == "property":
+        attr = rnd.choice((*VALUES, "uuid"))
+        value = rnd.choice(VALUES.get(attr, ["x"]))
+        # entries return uuid as UUID, which patterns can't match
+        if value is not None and attr != "uuid" and rnd.random() < 0.3:
+            return {"type": attr, "pattern": value[:2]}
+        return {"type": attr, "value": value}
+    if kind == "url":
+        url = urlsplit(rnd.choice(URLS))
+        part = rnd.choice(("hostname", "path", "scheme", "port", None))
+        symptom = {"type": "url"}
+        if part is not None:
+            symptom["part"] = part
+        value = url.geturl() if part is None else getattr(url, part)
+        value = "" if value is None else str(value)
+        if rnd.random() < 0.2:
+            symptom["value"] = None
+        elif rnd.random() < 0.3:
+            symptom["pattern"] = value[:3]
+        else:
+            symptom["value"] = value
+        return symptom
+    if kind == "reported_at":
+        after, before = sorted(rnd.sample(TIMES, 2))
+        return rnd.choice(
+            (
+                {"type": "reported_at", "time": after.isoformat()},
+                {"type": "reported_at", "after": after.isoformat()},
+                {"type": "reported_at", "before": before.isoformat()},
+                {
+                    "type": "reported_at",
+                    "after": after.isoformat(),
+                    "before": before.isoformat(),
+                },
+            )
+        )
+    return {"type": "details", "path": "$.a", "value": rnd.choice(("1", "2"))}
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_pushdown_01(seed):
+    """test that filtering with the pushdown and residual symptoms is the same as
+    matching each entry
+    """
+    rnd = random.Random(seed)
+    for idx in range(40):
+        ReportEntry.objects.create_from_report(
+            Report(
+                **{attr: rnd.choice(values) for attr, values in VALUES.items()},
+                details={"a": rnd.choice(("1", "2"))},
+                reported_at=rnd.choice(TIMES),
+                url=urlsplit(rnd.choice(URLS)),
+                uuid=f"{seed:08d}-0000-0000-0000-{idx:012d}",
+            )
+        )
+    entries = list(ReportEntry.objects.select_related("app", "breakage_category", "os"))
+
+    for _ in range(50):
+        signature = Signature(
+            json.dumps(
+                {"symptoms": [_random_symptom(rnd) for _ in range(rnd.randint(1, 3))]}
+            )
+        )
+        expected = {
+            entry.pk for entry in entries if signature.matches(entry.get_report())
+        }
+        pushdown, residual = compile_signature(signature)
+        result = {
+            entry.pk
+            for entry in ReportEntry.objects.filter(pushdown).select_related(
+                "app", "breakage_category", "os"
+            )
+            if matches_residual(residual, entry.get_report())
+        }
+        assert result == expected, signature.raw_signature
+        # the same, streaming only the fields of the residual symptoms
+        rows = list(
+            ReportEntry.iter_reports(
+                ReportEntry.objects.filter(pushdown),
+                {symptom.report_field for symptom in residual},
+                chunk_size=7,
+            )
+        )
+        matched = match_residual_batch(
+            residual, ReportBatch(report for _, _, report in rows)
+        )
+        result = {
+            entry_id for row, (entry_id, _, _) in enumerate(rows) if matched >> row & 1
+        }
+        assert result == expected, signature.raw_signature
+
+
+@pytest.mark.parametrize("pattern", PATTERNS)
+def test_pushdown_02(pattern):
+    """test that patterns with unsupported syntax are not translated, and that the
+    translation matches everything the pattern matches (with Python regexes)
+    """
+    regex = translate_pattern(pattern)
+    assert (regex is not None) == PATTERNS[pattern]
+    if regex is not None:
+        compiled = re.compile(pattern)
+        for value in STRINGS:
+            if compiled.match(value):
+                assert re.search(regex, value), value
+
+
+def test_pushdown_03(create_entry):
+    """test translated patterns with the regex lookup of the database backend"""
+    for idx, value in enumerate(STRINGS):
+        create_entry(idx, comments=value, reported_at=BEGIN, url=urlsplit(URLS[0]))
+    for pattern, supported in PATTERNS.items():
+        if not supported:
+            continue
+        compiled = re.compile(pattern)
+        expected = {value for value in STRINGS if compiled.match(value)}
+        result = set(
+            ReportEntry.objects.filter(
+                comments__regex=translate_pattern(pattern)
+            ).values_list("comments", flat=True)
+        )
+        # the result may include more, eg. with repetitions capped
+        assert result >= expected, (connection.vendor, pattern)
@@ -0,0 +1,71 @@
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+pytest.importorskip("pytest_django")
+
+from django.core.management import call_command  # noqa: E402
+from django.db import connection  # noqa: E402
+
+from reportmanager.models import (  # noqa: E402
+    APP_CACHE,
+    BREAKAGE_CATEGORY_CACHE,
+    OS_CACHE,
+    Bucket,
+)
+from reportmanager.reassign import ReassignMatcher, match_entries  # noqa: E402
+from webcompat.models import Signature  # noqa: E402
+
+NOW = datetime(2024, 3, 6, 12, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def file_db(django_db_blocker, tmp_path):
+    """Use a migrated sqlite file instead of the in-memory test database, which
+    worker processes can't see."""
+    with django_db_blocker.unblock():
+        saved = connection.settings_dict["NAME"], connection.connection
+        connection.connection = None
+        connection.settings_dict["NAME"] = str(tmp_path / "db.sqlite3")
+        try:
+            call_command("migrate", verbosity=0)
+            yield
+        finally:
+            # the cached ids are those of the file database
+            for dimension_cache in (APP_CACHE, BREAKAGE_CATEGORY_CACHE, OS_CACHE):
+                dimension_cache.clear()
+            connection.close()
+            connection.settings_dict["NAME"], connection.connection = saved
+
+
+@pytest.mark.parametrize(
+    "symptom",
+    (
+        {"type": "details", "path": "$.frames[*].name", "pattern": "^init.*"},
+        {"type": "comments", "pattern": "(?i)broken (video|layout)"},
+    ),
+)
+def test_reassign_01(create_entry, file_db, symptom):
+    """test that matching in worker processes gives the same results as serially"""
+    buckets = [
+        Bucket.objects.create(description=str(idx), signature="{}") for idx in range(2)
+    ]
+    entry_ids = []
+    for idx in range(60):
+        entry = create_entry(
+            idx,
+            (*buckets, None)[idx % 5 % 3],
+            comments=("Broken video", "broken LAYOUT here", "works")[idx % 3],
+            details={"frames": [{"name": ("initPlayer", "run")[idx % 2]}, {"line": 1}]},
+            reported_at=NOW - timedelta(minutes=idx),
+        )
+        entry_ids.append(entry.pk)
+    signature = Signature(json.dumps({"symptoms": [symptom]}))
+
+    expected = match_entries(signature, buckets[0].pk, entry_ids)
+    assert expected[0]
+    assert expected[1]
+    matcher = ReassignMatcher(workers=2, threshold=10)
+    assert matcher.use_pool(len(entry_ids))
+    assert matcher.match(signature, buckets[0].pk, entry_ids) == expected
@@ -0,0 +1,95 @@
+from dataclasses import replace
+from datetime import datetime, timezone
+
+import pytest
+
+pytest.importorskip("pytest_django")
+
+from reportmanager.models import Bucket, ReportEntry  # noqa: E402
+from webcompat.models import LazyReport, Signature  # noqa: E402
+
+pytestmark = pytest.mark.django_db
+
+NOW = datetime(2024, 3, 6, 12, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def reports(make_report):
+    return [
+        make_report(
+            idx,
+            hostname=f"example{idx}.com",
+            app_version=str(idx),
+            breakage_category="site-broken" if idx % 2 else None,
+            comments=f"comment {idx}",
+            details={"frames": [{"name": f"f{idx}"}]},
+            reported_at=NOW,
+        )
+        for idx in range(3)
+    ]
+
+
+def test_reports_01(reports):
+    """test loading reports of entries with only the fields used by a signature"""
+    bucket = Bucket.objects.create(description="a", signature="{}")
+    entries = [
+        ReportEntry.objects.create_from_report(
+            report, bucket_id=bucket.pk if idx else None
+        )
+        for idx, report in enumerate(reports)
+    ]
+    signature = Signature(
+        '{"symptoms": [{"type": "details", "path": "$.frames[0].name", "value": "f1"},'
+        '{"type": "url", "part": "hostname", "pattern": "example"},'
+        '{"type": "breakage_category", "value": "site-broken"}]}'
+    )
+    assert signature.report_fields == {"breakage_category", "details", "url"}
+
+    queryset = ReportEntry.objects.order_by("id")
+    rows = ReportEntry.load_reports(queryset, signature.report_fields)
+    assert [(pk, bucket_id, repr(lazy)) for pk, bucket_id, lazy in rows] == [
+        (pk, bucket_id, repr(lazy))
+        for pk, bucket_id, lazy in ReportEntry.iter_reports(
+            queryset, signature.report_fields, chunk_size=2
+        )
+    ]
+    assert [(pk, bucket_id) for pk, bucket_id, _ in rows] == [
+        (entries[0].pk, None),
+        (entries[1].pk, bucket.pk),
+        (entries[2].pk, bucket.pk),
+    ]
+    # pages follow the order of descending ids
+    assert [
+        pk
+        for pk, _, _ in ReportEntry.iter_reports(
+            ReportEntry.objects.order_by("-id"), {"url"}, chunk_size=2
+        )
+    ] == [entry.pk for entry in reversed(entries)]
+    for (_, _, lazy), report in zip(rows, reports):
+        assert isinstance(lazy, LazyReport)
+        assert lazy.breakage_category == report.breakage_category
+        assert lazy.details == report.details
+        assert lazy.url == report.url
+        # the other fields are not loaded
+        with pytest.raises(AttributeError):
+            lazy.comments
+        with pytest.raises(AttributeError):
+            lazy.reported_at
+    assert [signature.matches(lazy) for _, _, lazy in rows] == [False, True, False]
+
+    rows = ReportEntry.load_reports(queryset, {"reported_at", "app_version"})
+    assert [(lazy.app_version, lazy.reported_at) for _, _, lazy in rows] == [
+        (report.app_version, NOW) for report in reports
+    ]
+
+
+def test_reports_02(reports):
+    """test the report of an entry"""
+    report = reports[1]
+    entry = ReportEntry.objects.create_from_report(report)
+    entry = ReportEntry.objects.get(pk=entry.pk)
+    lazy = entry.get_report()
+    assert lazy is entry.get_report()
+    assert repr(lazy) == repr(replace(report, uuid=entry.uuid)).replace(
+        "Report(", "LazyReport(", 1
+    )
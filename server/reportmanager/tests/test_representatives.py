@@ -0,0 +1,65 @@
+import json
+
+import pytest
+
+pytest.importorskip("pytest_django")
+
+from reportmanager.models import (  # noqa: E402
+    Bucket,
+    BucketRepresentative,
+    BucketSamples,
+)
+from webcompat.models import Signature  # noqa: E402
+
+pytestmark = pytest.mark.django_db
+
+
+def _signature(hostname):
+    return Signature(
+        json.dumps(
+            {"symptoms": [{"type": "url", "part": "hostname", "value": hostname}]}
+        )
+    )
+
+
+def test_representatives_01(create_entry, settings):
+    """test sampling of representatives and matching them"""
+    settings.BUCKET_REPRESENTATIVES = 3
+    buckets = {}
+    for hostname, size in (("a.com", 5), ("b.com", 2), ("c.com", 0)):
+        buckets[hostname] = Bucket.objects.create(
+            description=hostname, signature=_signature(hostname).raw_signature
+        )
+        for idx in range(size):
+            create_entry(len(buckets) * 100 + idx, buckets[hostname], hostname=hostname)
+
+    # buckets without representatives are sampled by their first entry
+    samples = BucketSamples({"url"})
+    assert sorted(samples.bucket_ids) == [buckets["a.com"].pk, buckets["b.com"].pk]
+    assert samples.matching_buckets(_signature("b.com")) == {buckets["b.com"].pk}
+
+    assert BucketRepresentative.refresh() == 5
+    assert BucketRepresentative.refresh() == 0
+    samples = BucketSamples({"url"})
+    assert (
+        sorted(samples.bucket_ids)
+        == [buckets["a.com"].pk] * 3 + [buckets["b.com"].pk] * 2
+    )
+    assert samples.matching_buckets(_signature("a.com")) == {buckets["a.com"].pk}
+    assert samples.matching_buckets(_signature("c.com")) == set()
+
+    # entries moved to another bucket are ignored, then replaced
+    moved = buckets["a.com"].representatives.first().entry
+    moved.bucket = buckets["c.com"]
+    moved.save()
+    samples = BucketSamples({"url"})
+    assert samples.bucket_ids.count(buckets["a.com"].pk) == 2
+    assert samples.bucket_ids.count(buckets["c.com"].pk) == 1
+    # the moved entry is sampled for its new bucket
+    assert BucketRepresentative.refresh() == 2
+    assert set(
+        BucketRepresentative.objects.filter(bucket=buckets["a.com"]).values_list(
+            "entry__bucket", flat=True
+        )
+    ) == {buckets["a.com"].pk}
+    assert buckets["c.com"].representatives.get().entry == moved
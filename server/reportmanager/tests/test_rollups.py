@@ -0,0 +1,101 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+pytest.importorskip("pytest_django")
+
+from rest_framework.request import Request  # noqa: E402
+from rest_framework.test import APIRequestFactory  # noqa: E402
+
+from reportmanager.models import Bucket, BucketHitRollup, ReportEntry  # noqa: E402
+from reportmanager.serializers import InvalidArgumentException  # noqa: E402
+from reportmanager.views import BucketViewSet  # noqa: E402
+
+pytestmark = pytest.mark.django_db
+
+# a Wednesday
+NOW = datetime(2024, 3, 6, 12, tzinfo=timezone.utc)
+
+
+def _rollups(bucket, resolution):
+    return list(
+        BucketHitRollup.objects.filter(
+            bucket=bucket, resolution=resolution, count__gt=0
+        )
+        .order_by("begin")
+        .values_list("begin", "count")
+    )
+
+
+def _history(bucket_ids, **params):
+    view = BucketViewSet()
+    view.request = Request(APIRequestFactory().get("/", params))
+    return view.get_report_history(bucket_ids)
+
+
+def test_rollups_01(create_entry):
+    """test that day and week rollups follow changes of the hourly counters"""
+    buckets = [
+        Bucket.objects.create(description=str(idx), signature="{}") for idx in range(2)
+    ]
+    entries = [
+        create_entry(idx, buckets[0], reported_at=NOW - timedelta(hours=hours))
+        for idx, hours in enumerate((0, 1, 13, 24 * 3))
+    ]
+    today = NOW.replace(hour=0)
+    monday = today - timedelta(days=2)
+    assert _rollups(buckets[0], "day") == [
+        (today - timedelta(days=3), 1),
+        (today - timedelta(days=1), 1),
+        (today, 2),
+    ]
+    assert _rollups(buckets[0], "week") == [
+        (monday - timedelta(days=7), 1),
+        (monday, 3),
+    ]
+
+    moved = ReportEntry.objects.get(pk=entries[0].pk)
+    moved.bucket = buckets[1]
+    moved.save()
+    entries[3].delete()
+    assert _rollups(buckets[0], "day") == [
+        (today - timedelta(days=1), 1),
+        (today, 1),
+    ]
+    assert _rollups(buckets[0], "week") == [(monday, 2)]
+    assert _rollups(buckets[1], "week") == [(monday, 1)]
+
+
+def test_rollups_02(create_entry, mocker, settings):
+    """test report history of buckets at each resolution"""
+    settings.CLEANUP_REPORTS_AFTER_DAYS = 14
+    mocker.patch("django.utils.timezone.now", return_value=NOW)
+    buckets = [
+        Bucket.objects.create(description=str(idx), signature="{}") for idx in range(3)
+    ]
+    for idx, hours in enumerate((0, 1, 2, 30, 24 * 20)):
+        create_entry(
+            idx, buckets[0], reported_at=NOW - timedelta(minutes=hours * 60 + 10)
+        )
+    create_entry(100, buckets[1], reported_at=NOW)
+
+    ids = [bucket.pk for bucket in buckets]
+    history = _history(ids)
+    # the oldest entry is outside CLEANUP_REPORTS_AFTER_DAYS
+    assert [hit["count"] for hit in history[buckets[0].pk]] == [1, 1, 1, 1]
+    assert history[buckets[1].pk] == [{"begin": NOW, "count": 1}]
+    assert buckets[2].pk not in history
+
+    history = _history(ids, resolution="day")
+    assert history[buckets[0].pk] == [
+        {"begin": NOW.replace(hour=0) - timedelta(days=1), "count": 1},
+        {"begin": NOW.replace(hour=0), "count": 3},
+    ]
+
+    history = _history(ids, resolution="week")
+    assert history[buckets[0].pk] == [
+        {"begin": NOW.replace(hour=0) - timedelta(days=2), "count": 4}
+    ]
+
+    with pytest.raises(InvalidArgumentException):
+        _history(ids, resolution="month")
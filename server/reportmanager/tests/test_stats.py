@@ -0,0 +1,51 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+pytest.importorskip("pytest_django")
+
+from django.core.cache import cache  # noqa: E402
+
+from reportmanager.cron import update_report_stats  # noqa: E402
+from reportmanager.models import Bucket, ReportEntry  # noqa: E402
+from reportmanager.views import ReportStatsViewSet  # noqa: E402
+
+pytestmark = pytest.mark.django_db
+
+NOW = datetime(2024, 3, 1, 12, tzinfo=timezone.utc)
+
+
+def test_report_stats_01(create_entry, mocker):
+    """test the totals and per-bucket counts of the report statistics"""
+    mocker.patch("django.utils.timezone.now", return_value=NOW)
+    # the cache is kept between tests
+    cache.clear()
+    buckets = [
+        Bucket.objects.create(description=str(idx), signature="{}") for idx in range(12)
+    ]
+    # (bucket index or None, hours ago)
+    hits = [(None, 2), (None, 100), (0, 1), (0, 30), (0, 200), (1, 3), (1, 800)]
+    # buckets 2-11 get 4 entries each in the last week
+    hits.extend((idx, 48) for idx in range(2, 12) for _ in range(4))
+    for uuid_idx, (bucket_idx, hours) in enumerate(hits):
+        create_entry(
+            uuid_idx,
+            None if bucket_idx is None else buckets[bucket_idx],
+            reported_at=NOW - timedelta(hours=hours, minutes=30),
+        )
+
+    stats = ReportStatsViewSet().retrieve(None).data
+    assert stats["totals"] == [3, 45, 46]
+    # buckets 0 and 1 are only in the top 10 of the last day
+    assert stats["frequent_buckets"][buckets[0].pk] == [1, 2, 3]
+    assert stats["frequent_buckets"][buckets[1].pk] == [1, 1, 1]
+    assert stats["frequent_buckets"][buckets[2].pk] == [0, 4, 4]
+    assert len(stats["frequent_buckets"]) == 12
+    # all but the entry older than REPORT_STATS_MAX_HISTORY_DAYS
+    assert sum(stats["graph_data"]) == 46
+
+    # cached until the stats are updated
+    ReportEntry.objects.filter(bucket=None).delete()
+    assert ReportStatsViewSet().retrieve(None).data["totals"] == [3, 45, 46]
+    update_report_stats()
+    assert ReportStatsViewSet().retrieve(None).data["totals"] == [2, 43, 44]
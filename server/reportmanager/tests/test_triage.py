@@ -0,0 +1,137 @@
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+pytest.importorskip("pytest_django")
+
+from reportmanager.models import (  # noqa: E402
+    Bucket,
+    BucketHit,
+    BucketRevision,
+    BucketStats,
+    ReportEntry,
+)
+from reportmanager.triage import (  # noqa: E402
+    BulkTriage,
+    get_signature_index,
+    invalidate_signature_index,
+)
+
+pytestmark = pytest.mark.django_db
+
+NOW = datetime(2024, 3, 6, 12, tzinfo=timezone.utc)
+
+
+@pytest.fixture(autouse=True)
+def _invalidate_index():
+    # the index is process-wide, and the database is rolled back after each test
+    invalidate_signature_index()
+    yield
+    invalidate_signature_index()
+
+
+def _signature(hostname):
+    return json.dumps(
+        {"symptoms": [{"type": "url", "part": "hostname", "value": hostname}]}
+    )
+
+
+def test_triage_01(django_capture_on_commit_callbacks, make_report):
+    """test that the signature index follows bucket changes of all processes"""
+    with django_capture_on_commit_callbacks(execute=True):
+        bucket = Bucket.objects.create(description="a", signature=_signature("a"))
+    index = get_signature_index()
+    assert index.find_bucket(make_report(0, hostname="a")) == bucket.pk
+    assert get_signature_index() is index
+
+    # changes committed by this process update the index in place
+    with django_capture_on_commit_callbacks(execute=True):
+        other = Bucket.objects.create(description="b", signature=_signature("b"))
+    assert get_signature_index() is index
+    assert index.find_bucket(make_report(0, hostname="b")) == other.pk
+    with django_capture_on_commit_callbacks(execute=True):
+        Bucket.objects.get(pk=bucket.pk).delete()
+    assert get_signature_index() is index
+    assert index.find_bucket(make_report(0, hostname="a")) is None
+
+    # changes of other processes are only seen in the revision
+    Bucket.objects.filter(pk=other.pk).update(signature=_signature("c"))
+    BucketRevision.bump()
+    index = get_signature_index()
+    assert index.find_bucket(make_report(0, hostname="b")) is None
+    assert index.find_bucket(make_report(0, hostname="c")) == other.pk
+    assert get_signature_index() is index
+
+    # a change committed after another process changed buckets as well can't be
+    # applied in place
+    BucketRevision.bump()
+    with django_capture_on_commit_callbacks(execute=True):
+        bucket = Bucket.objects.create(description="a", signature=_signature("a"))
+    assert get_signature_index() is not index
+    assert get_signature_index().find_bucket(make_report(0, hostname="a")) == bucket.pk
+
+
+def test_triage_02(create_entry):
+    """test triaging all unbucketed entries in one pass"""
+    bucket = Bucket.objects.create(description="a", signature=_signature("a"))
+    video = Bucket.objects.create(
+        description="video",
+        priority=1,
+        signature=json.dumps({"symptoms": [{"type": "comments", "pattern": "video"}]}),
+    )
+    triaged = create_entry(0, bucket, hostname="a", reported_at=NOW)
+    hostnames = ["a", "b", "a", "c", "b", "a"]
+    for idx, hostname in enumerate(hostnames, 1):
+        create_entry(
+            idx,
+            hostname=hostname,
+            comments="video" if idx == 3 else "",
+            reported_at=NOW + timedelta(hours=idx % 2),
+        )
+
+    # buckets are created for "b" and "c", and the one of "b" is found for the
+    # entry in the next chunk
+    triage = BulkTriage(chunk_size=2)
+    assert triage.run() == len(hostnames)
+    assert triage.created_buckets == 2
+    assert not ReportEntry.objects.filter(bucket__isnull=True).exists()
+    assert ReportEntry.objects.get(pk=triaged.pk).bucket_id == bucket.pk
+
+    # one bucket per new domain
+    b_id, c_id = (Bucket.objects.get(domain=hostname).pk for hostname in "bc")
+    assignments = ReportEntry.objects.order_by("uuid").values_list(
+        "bucket_id", flat=True
+    )
+    assert list(assignments) == [
+        bucket.pk,
+        bucket.pk,
+        b_id,
+        video.pk,
+        c_id,
+        b_id,
+        bucket.pk,
+    ]
+
+    hits = sorted(BucketHit.objects.values_list("bucket_id", "begin", "count"))
+    assert hits == sorted(
+        [
+            (bucket.pk, NOW, 2),
+            (bucket.pk, NOW + timedelta(hours=1), 1),
+            (video.pk, NOW + timedelta(hours=1), 1),
+            (b_id, NOW, 1),
+            (b_id, NOW + timedelta(hours=1), 1),
+            (c_id, NOW, 1),
+        ]
+    )
+    stats = sorted(
+        BucketStats.objects.values_list("bucket_id", "size", "latest_report")
+    )
+    assert stats == sorted(
+        [
+            (bucket.pk, 3, NOW + timedelta(hours=1)),
+            (video.pk, 1, NOW + timedelta(hours=1)),
+            (b_id, 2, NOW + timedelta(hours=1)),
+            (c_id, 1, NOW),
+        ]
+    )
@@ -0,0 +1,98 @@
+import json
+from importlib import import_module
+from urllib.parse import urlsplit
+
+import pytest
+
+pytest.importorskip("pytest_django")
+
+from django.apps import apps  # noqa: E402
+
+from reportmanager.models import ReportEntry  # noqa: E402
+from reportmanager.pushdown import compile_signature, matches_residual  # noqa: E402
+from webcompat.models import Signature  # noqa: E402
+
+pytestmark = pytest.mark.django_db
+
+LONG_HOSTNAME = "a" * 250 + ".example.com"
+# url -> (hostname, path, scheme)
+URLS = {
+    "https://Www.Example.com:8080/a/b?c#d": ("www.example.com", "/a/b", "https"),
+    "http://example.com": ("example.com", "", "http"),
+    f"https://{LONG_HOSTNAME}/x": (None, "/x", "https"),
+    "about:blank": (None, "blank", "about"),
+    "file:///tmp/x": (None, "/tmp/x", "file"),
+}
+
+
+def _url_parts():
+    return {
+        url: (hostname, path, scheme)
+        for url, hostname, path, scheme in ReportEntry.objects.values_list(
+            "url", "hostname", "path", "scheme"
+        )
+    }
+
+
+def test_url_parts_01(create_entry):
+    """test storing the parts of urls in their own columns"""
+    for url, parts in URLS.items():
+        assert tuple(ReportEntry.get_url_parts(urlsplit(url)).values()) == parts
+    for idx, url in enumerate(URLS):
+        create_entry(idx, url=urlsplit(url))
+    assert _url_parts() == URLS
+
+    # entries inserted in bulk are sanitized first
+    entry = ReportEntry.objects.get(url="about:blank")
+    entry.pk = entry.hostname = entry.path = entry.scheme = None
+    entry.uuid = "00000000-0000-0000-0000-000000000100"
+    entry.url = "https://example.org/y"
+    assert entry.sanitize() >= {"hostname", "path", "scheme"}
+    ReportEntry.objects.bulk_create([entry])
+    assert _url_parts()["https://example.org/y"] == ("example.org", "/y", "https")
+
+
+def test_url_parts_02(create_entry):
+    """test filling the url part columns of existing entries"""
+    migration = import_module("reportmanager.migrations.0013_reportentry_url_parts")
+    for idx, url in enumerate(URLS):
+        create_entry(idx, url=urlsplit(url))
+    ReportEntry.objects.update(hostname=None, path=None, scheme=None)
+    migration.fill_url_parts(apps, None)
+    assert _url_parts() == URLS
+
+
+@pytest.mark.parametrize(
+    "symptom",
+    [
+        {"type": "url", "part": "hostname", "value": "www.example.com"},
+        {"type": "url", "part": "hostname", "value": LONG_HOSTNAME},
+        {"type": "url", "part": "hostname", "value": None},
+        {"type": "url", "part": "hostname", "pattern": "a+\\.example"},
+        {"type": "url", "part": "path", "value": "/x"},
+        {"type": "url", "part": "path", "pattern": "/"},
+        {"type": "url", "part": "scheme", "value": "about"},
+        {"type": "url", "part": "scheme", "pattern": "htt"},
+    ],
+)
+def test_url_parts_03(create_entry, symptom):
+    """test that filtering on the url part columns selects all matching entries,
+    including those with parts too long for their column
+    """
+    for idx, url in enumerate(URLS):
+        create_entry(idx, url=urlsplit(url))
+    signature = Signature(json.dumps({"symptoms": [symptom]}))
+    expected = {
+        entry.url
+        for entry in ReportEntry.objects.all()
+        if signature.matches(entry.get_report())
+    }
+    assert expected
+    pushdown, residual = compile_signature(signature)
+    assert pushdown is not None
+    candidates = list(ReportEntry.objects.filter(pushdown))
+    assert {
+        entry.url
+        for entry in candidates
+        if matches_residual(residual, entry.get_report())
+    } == expected
@@ -0,0 +1,414 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""In-process index of bucket signatures used for triage.
+
+Instead of loading and parsing every candidate bucket for each report, all
+bucket signatures are parsed once and stored in lists keyed on the most
+selective exact-match symptom they contain (hostname, or an app/os/channel
+value). A lookup only has to evaluate the buckets sharing a key with the report,
+plus the residual buckets that could not be keyed. In large lists, buckets with
+a pattern symptom not matching the report are skipped, testing all the patterns
+of a list at once.
+"""
+
+import heapq
+import json
+import threading
+import time
+from bisect import insort
+from collections import Counter
+from logging import getLogger
+
+from django.db import transaction
+
+from webcompat.models import ReportBatch
+from webcompat.symptoms import (
+    DetailsSymptom,
+    MultiPatternMatcher,
+    PatternMatcher,
+    StringPropertySymptom,
+    URLSymptom,
+    ValueMatcher,
+    get_url_part,
+)
+
+LOG = getLogger("reportmanager.triage")
+
+# string properties usable as index keys, in order of preference
+INDEXED_PROPERTIES = ("app_name", "app_channel", "os")
+
+# index lists with at least this many entries use a PatternPrefilter
+PREFILTER_MIN_SIZE = 16
+
+
+def _get_index_key(signature):
+    """Return the (kind, value) key to store a signature under, or None if
+    the signature has no symptom that can be used as a key.
+    """
+    props = {}
+    for symptom in signature.symptoms:
+        if not isinstance(symptom.matcher, ValueMatcher):
+            continue
+        if isinstance(symptom, URLSymptom) and symptom.part == "hostname":
+            return ("hostname", symptom.matcher.value)
+        if isinstance(symptom, StringPropertySymptom):
+            props.setdefault(symptom.attr, symptom.matcher.value)
+    for attr in INDEXED_PROPERTIES:
+        if attr in props:
+            return (attr, props[attr])
+    return None
+
+
+def _get_pattern_kind(symptom):
+    """Return the kind of value a pattern symptom is tested against, or None if it
+    isn't a pattern symptom with a single value.
+    """
+    if not isinstance(symptom.matcher, PatternMatcher):
+        return None
+    if isinstance(symptom, StringPropertySymptom):
+        return ("attr", symptom.attr)
+    if isinstance(symptom, URLSymptom):
+        return ("url", symptom.part)
+    if isinstance(symptom, DetailsSymptom) and symptom.path is None:
+        return ("details", None)
+    return None
+
+
+def _get_value(report, kind):
+    source, name = kind
+    if source == "attr":
+        return getattr(report, name)
+    if source == "url":
+        return get_url_part(report.url, name)
+    return json.dumps(report.details)
+
+
+class PatternPrefilter:
+    """Find the buckets in a list of index entries which can't match a report,
+    because one of their pattern symptoms doesn't match.
+
+    The patterns of all buckets are grouped by the value they are tested against,
+    and each group is matched in one call (see MultiPatternMatcher). Only one
+    pattern per bucket and value is used, so this never rejects a matching bucket.
+    """
+
+    def __init__(self, entries):
+        self.entries = entries
+        patterns = {}
+        for _, bucket_id, signature in entries:
+            for symptom in signature.symptoms:
+                kind = _get_pattern_kind(symptom)
+                if kind is not None:
+                    patterns.setdefault(kind, {}).setdefault(
+                        bucket_id, symptom.matcher.pattern.pattern
+                    )
+        self._matchers = [
+            (kind, MultiPatternMatcher(kind_patterns.items()), set(kind_patterns))
+            for kind, kind_patterns in patterns.items()
+        ]
+
+    def rejected(self, report):
+        """Return the ids of buckets which don't match report"""
+        result = set()
+        for kind, matcher, bucket_ids in self._matchers:
+            result |= bucket_ids - matcher.matches(_get_value(report, kind))
+        return result
+
+
+class SignatureIndex:
+    """Index of all bucket signatures, returning the highest priority bucket
+    matching a report.
+
+    Entries are stored as `(-priority, bucket_id, signature)` tuples in lists
+    sorted by priority (and id for buckets of equal priority). Lists are replaced
+    rather than modified in place, so lookups never need to take the lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._keyed = {}
+        self._residual = []
+        # bucket_id -> (index key, entry)
+        self._entries = {}
+        # index key -> PatternPrefilter
+        self._prefilters = {}
+        self.revision = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    @classmethod
+    def build(cls, buckets):
+        """Create an index for the given buckets"""
+        index = cls()
+        for bucket in buckets:
+            index.add(bucket)
+        return index
+
+    def _get_list(self, key):
+        if key is None:
+            return self._residual
+        return self._keyed.get(key, [])
+
+    def _set_list(self, key, entries):
+        self._prefilters.pop(key, None)
+        if key is None:
+            self._residual = entries
+        elif entries:
+            self._keyed[key] = entries
+        else:
+            self._keyed.pop(key, None)
+
+    def _rejected(self, key, entries, report):
+        if len(entries) < PREFILTER_MIN_SIZE:
+            return set()
+        prefilter = self._prefilters.get(key)
+        if prefilter is None or prefilter.entries is not entries:
+            # built on first use after the list changed
+            prefilter = PatternPrefilter(entries)
+            self._prefilters[key] = prefilter
+        return prefilter.rejected(report)
+
+    def add(self, bucket):
+        """Add or update the given bucket in the index"""
+        try:
+            signature = bucket.get_signature()
+        except RuntimeError as exc:
+            LOG.warning("Bucket %d has an invalid signature: %s", bucket.pk, exc)
+            self.remove(bucket.pk)
+            return
+        key = _get_index_key(signature)
+        entry = (-bucket.priority, bucket.pk, signature)
+        with self._lock:
+            self._remove(bucket.pk)
+            entries = list(self._get_list(key))
+            insort(entries, entry)
+            self._set_list(key, entries)
+            self._entries[bucket.pk] = (key, entry)
+
+    def remove(self, bucket_id):
+        """Remove the bucket with the given id from the index"""
+        with self._lock:
+            self._remove(bucket_id)
+
+    def _remove(self, bucket_id):
+        existing = self._entries.pop(bucket_id, None)
+        if existing is None:
+            return
+        key, _ = existing
+        self._set_list(
+            key, [other for other in self._get_list(key) if other[1] != bucket_id]
+        )
+
+    def candidates(self, report):
+        """Iterate over `(bucket_id, signature)` for all buckets which could match
+        the given report, highest priority first.
+        """
+        keys = [("hostname", report.url.hostname)]
+        for attr in INDEXED_PROPERTIES:
+            value = getattr(report, attr)
+            if value is not None:
+                keys.append((attr, value))
+        sources = [self._keyed.get(key, ()) for key in keys]
+        sources.append(self._residual)
+        keys.append(None)
+
+        rejected = set()
+        for key, entries in zip(keys, sources):
+            rejected |= self._rejected(key, entries, report)
+
+        for _, bucket_id, signature in heapq.merge(*sources):
+            if bucket_id not in rejected:
+                yield bucket_id, signature
+
+    def find_bucket(self, report):
+        """Return the id of the highest priority bucket matching report, or None"""
+        for bucket_id, signature in self.candidates(report):
+            if signature.matches(report):
+                return bucket_id
+        return None
+
+    def find_buckets(self, reports):
+        """Same as `find_bucket()` for many reports at once.
+
+        Candidate buckets for all reports are matched against the whole batch in
+        priority order, and each report is assigned to the first bucket it matches.
+
+        @rtype: list
+        @return: bucket id or None for each report
+        """
+        batch = ReportBatch(reports)
+        sources = [
+            self._keyed.get(("hostname", hostname), ())
+            for hostname in batch.url_column("hostname").distinct
+        ]
+        for attr in INDEXED_PROPERTIES:
+            sources.extend(
+                self._keyed.get((attr, value), ())
+                for value in batch.attr_column(attr).distinct
+                if value is not None
+            )
+        sources.append(self._residual)
+
+        result = [None] * len(batch)
+        remaining = batch.all
+        for _, bucket_id, signature in heapq.merge(*sources):
+            matched = signature.match_batch(batch, remaining)
+            if matched:
+                for row in batch.iter_rows(matched):
+                    result[row] = bucket_id
+                remaining &= ~matched
+                if not remaining:
+                    break
+        return result
+
+
+_INDEX = None
+_INDEX_LOCK = threading.Lock()
+
+
+def get_signature_index():
+    """Return the process-wide signature index, (re)building it if buckets were
+    changed by another process since it was built (see `BucketRevision`).
+    """
+    global _INDEX
+
+    from .models import Bucket, BucketRevision
+
+    revision = BucketRevision.get()
+    index = _INDEX
+    if index is None or index.revision != revision:
+        with _INDEX_LOCK:
+            # buckets are loaded after the revision, so a concurrent change can
+            # only cause another rebuild
+            index = SignatureIndex.build(Bucket.objects.all())
+            index.revision = revision
+            LOG.debug("built signature index of %d buckets", len(index))
+            _INDEX = index
+    return index
+
+
+def invalidate_signature_index():
+    """Drop the process-wide signature index, it is rebuilt on next use"""
+    global _INDEX
+    _INDEX = None
+
+
+def _update_index(update, revision):
+    index = _INDEX
+    if index is None or index.revision != revision - 1:
+        # index was already stale, it will be rebuilt on next use
+        return
+    update(index)
+    index.revision = revision
+
+
+def bucket_saved(bucket, revision):
+    """Update the signature index for a created or modified bucket, committed with
+    the given BucketRevision.
+    """
+    _update_index(lambda index: index.add(bucket), revision)
+
+
+def bucket_deleted(bucket_id, revision):
+    """Update the signature index for a deleted bucket, committed with the given
+    BucketRevision.
+    """
+    _update_index(lambda index: index.remove(bucket_id), revision)
+
+
+class BulkTriage:
+    """Triage all unbucketed report entries in one pass.
+
+    The signature index is built once, and unbucketed entries are processed in
+    chunks. Each chunk is locked, matched as a batch and assigned with one UPDATE
+    per bucket. BucketHit counters are updated once per (bucket, hour) pair, and
+    BucketStats once per bucket.
+    """
+
+    def __init__(self, chunk_size=500):
+        assert chunk_size > 0
+        self.chunk_size = chunk_size
+        self.index = None
+        self.created_buckets = 0
+        self.triaged = 0
+        self.elapsed = 0.0
+
+    @property
+    def rate(self):
+        """Triage throughput in reports/sec"""
+        if not self.elapsed:
+            return 0.0
+        return self.triaged / self.elapsed
+
+    def run(self):
+        from .models import Bucket, ReportEntry
+
+        start = time.perf_counter()
+        self.index = SignatureIndex.build(Bucket.objects.all())
+        entries = ReportEntry.objects.filter(bucket__isnull=True).order_by("id")
+        last_id = 0
+        while True:
+            chunk = list(
+                entries.filter(id__gt=last_id).values_list("id", flat=True)[
+                    : self.chunk_size
+                ]
+            )
+            if not chunk:
+                break
+            last_id = chunk[-1]
+            self.triaged += self._triage_chunk(chunk)
+        self.elapsed = time.perf_counter() - start
+        return self.triaged
+
+    def _create_bucket(self, report):
+        from .models import Bucket
+
+        bucket = Bucket.objects.create(
+            description=f"domain is {report.url.hostname}",
+            signature=report.create_signature().raw_signature,
+        )
+        self.index.add(bucket)
+        self.created_buckets += 1
+        return bucket.pk
+
+    @transaction.atomic
+    def _triage_chunk(self, entry_ids):
+        from .models import BucketHit, BucketStats, ReportEntry, notify_bucket_hits
+
+        # entries may have been triaged by someone else since the ids were fetched
+        entries = list(
+            ReportEntry.objects.select_for_update()
+            .filter(id__in=entry_ids, bucket__isnull=True)
+            .select_related("app", "breakage_category", "os")
+        )
+
+        assignments = {}
+        hits = Counter()
+        reports = [entry.get_report() for entry in entries]
+        bucket_ids = self.index.find_buckets(reports)
+        for entry, report, bucket_id in zip(entries, reports, bucket_ids):
+            if bucket_id is None:
+                # may match a bucket created for a previous entry of this chunk
+                bucket_id = self.index.find_bucket(report)
+            if bucket_id is None:
+                bucket_id = self._create_bucket(report)
+            assignments.setdefault(bucket_id, []).append(entry)
+            hits[(bucket_id, entry.reported_at)] += 1
+
+        for bucket_id, bucket_entries in assignments.items():
+            ReportEntry.objects.filter(
+                id__in=[entry.pk for entry in bucket_entries]
+            ).update(bucket_id=bucket_id)
+
+        BucketHit.apply_deltas(hits)
+        BucketStats.apply_changes(
+            (bucket_id, entry.pk, entry.reported_at, 1)
+            for bucket_id, bucket_entries in assignments.items()
+            for entry in bucket_entries
+        )
+
+        notify_bucket_hits(assignments)
+
+        return len(entries)
@@ -1,17 +1,21 @@
 # This Source Code Form is subject to the terms of the Mozilla Public
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
+import heapq
 import json
 import sys
-from collections import OrderedDict
+from collections import Counter, OrderedDict
 from datetime import datetime, timedelta
 from logging import getLogger
+from operator import itemgetter
 
 from dateutil.relativedelta import relativedelta
 from django.conf import settings as django_settings
+from django.core.cache import cache
 from django.core.exceptions import FieldError, PermissionDenied, SuspiciousOperation
 from django.db.models import F, Q
-from django.db.models.aggregates import Count, Max
+from django.db.models.aggregates import Count, Sum
+from django.db.models.functions import Coalesce
 from django.http import Http404
 from django.shortcuts import get_object_or_404, redirect, render
 from django.urls import reverse, reverse_lazy
@@ -36,8 +40,11 @@ from .forms import (
     UserSettingsForm,
 )
 from .models import (
+    REPORT_STATS_CACHE_KEY,
     Bucket,
     BucketHit,
+    BucketHitRollup,
+    BucketSamples,
     BucketWatch,
     Bug,
     BugProvider,
@@ -387,7 +394,8 @@ def signature_delete(request, sig_id):
             ReportEntry.objects.filter(bucket=bucket).update(bucket=None)
             triage_new_reports.delay()
 
-        bucket.delete()
+        with BucketHit.deferred():
+            bucket.delete()
         return redirect("reportmanager:buckets")
 
     elif request.method == "GET":
@@ -430,9 +438,8 @@ def signature_find(request, report_id):
     similar_buckets = []
     matching_bucket = None
 
-    # Avoid hitting the database multiple times when looking for the first
-    # entry of a bucket. Keeping these in memory is less expensive.
-    first_entry_per_bucket_cache = {}
+    # representatives of all buckets, loaded once a candidate is found
+    samples = None
 
     for bucket in buckets:
         signature = bucket.get_signature()
@@ -451,37 +458,24 @@ def signature_find(request, report_id):
                 # buckets. If the signature matches lots of other buckets as well, it is
                 # likely too broad and we should not consider it (or later rate it worse
                 # than others).
-                matches_in_other_buckets = 0
-                matches_in_other_buckets_limit_exceeded = False
-                non_matches_in_other_buckets = 0
-                other_matching_bucket_ids = []
-                for other_bucket in buckets:
-                    if other_bucket.pk == bucket.pk:
-                        continue
-
-                    if other_bucket.pk not in first_entry_per_bucket_cache:
-                        c = ReportEntry.objects.filter(bucket=other_bucket).first()
-                        first_entry_per_bucket_cache[other_bucket.pk] = c
-                        if c:
-                            first_entry_per_bucket_cache[other_bucket.pk] = (
-                                c.get_report()
+                if samples is None:
+                    samples = BucketSamples(
+                        set().union(
+                            *(
+                                other_bucket.get_signature().report_fields
+                                for other_bucket in buckets
                             )
-
-                    first_entry_report_info = first_entry_per_bucket_cache[
-                        other_bucket.pk
-                    ]
-                    if first_entry_report_info:
-                        if proposed_report_signature.matches(first_entry_report_info):
-                            matches_in_other_buckets += 1
-                            other_matching_bucket_ids.append(other_bucket.pk)
-
-                            # We already match too many foreign buckets. Abort our
-                            # search here to speed up the response time.
-                            if matches_in_other_buckets > 5:
-                                matches_in_other_buckets_limit_exceeded = True
-                                break
-                        else:
-                            non_matches_in_other_buckets += 1
+                        )
+                    )
+                    sampled_bucket_ids = set(samples.bucket_ids)
+                other_matching_bucket_ids = sorted(
+                    samples.matching_buckets(proposed_report_signature) - {bucket.pk}
+                )
+                matches_in_other_buckets = len(other_matching_bucket_ids)
+                matches_in_other_buckets_limit_exceeded = matches_in_other_buckets > 5
+                non_matches_in_other_buckets = (
+                    len(sampled_bucket_ids - {bucket.pk}) - matches_in_other_buckets
+                )
 
                 bucket.off_count = distance
 
@@ -553,18 +547,26 @@ def signature_optimize(request, sig_id):
     bucket = get_object_or_404(Bucket, pk=sig_id)
 
     # Get all unbucketed entries
-    entries = (
-        ReportEntry.objects.filter(bucket=None)
-        .order_by("-id")
-        .select_related("app", "breakage_category", "os")
-    )
+    entries = ReportEntry.objects.filter(bucket=None).order_by("-id")
 
-    (optimized_signature, matching_entries) = bucket.optimize_signature(entries)
+    (optimized_signature, matching_entry_ids) = bucket.optimize_signature(entries)
     diff = None
+    matching_entries = []
     if optimized_signature:
+        # only show the first entries, there may be many
+        matching_entries = list(
+            entries.filter(pk__in=matching_entry_ids[:100]).select_related(
+                "app", "breakage_category", "os"
+            )
+        )
+    if matching_entries:
+        matching_entries[0].reportinfo = matching_entries[0].get_report()
         diff = bucket.get_signature().get_signature_unified_diff_tuples(
             matching_entries[0].reportinfo
         )
+    else:
+        # the entries may have been triaged or deleted since they were matched
+        optimized_signature = None
 
     return render(
         request,
@@ -657,13 +659,13 @@ class JsonQueryFilterBackend(BaseFilterBackend):
 
 
 class BucketAnnotateFilterBackend(BaseFilterBackend):
-    """Annotates bucket queryset with size"""
+    """Annotates bucket queryset with size and latest entry from BucketStats"""
 
     def filter_queryset(self, request, queryset, view):
         return queryset.annotate(
-            size=Count("reportentry"),
-            latest_report=Max("reportentry__reported_at"),
-            latest_entry_id=Max("reportentry__id"),
+            size=Coalesce(F("stats__size"), 0),
+            latest_report=F("stats__latest_report"),
+            latest_entry_id=F("stats__latest_entry_id"),
         )
 
 
@@ -749,7 +751,8 @@ class ReportEntryViewSet(
 
         deleted = 0
         for chunk in batched(queryset.values_list("id", flat=True), 100):
-            delete_stats = ReportEntry.objects.filter(pk__in=tuple(chunk)).delete()
+            with BucketHit.deferred():
+                delete_stats = ReportEntry.objects.filter(pk__in=tuple(chunk)).delete()
             deleted += delete_stats[1]["reportmanager.ReportEntry"]
 
         return Response(
@@ -813,33 +816,48 @@ class BucketViewSet(
         else:
             return super().get_serializer(*args, **kwds)
 
+    def get_report_history(self, bucket_ids):
+        """Return the number of entries of each bucket over time.
+
+        The `resolution` query parameter selects hourly (the default), daily or
+        weekly counts, covering the last CLEANUP_REPORTS_AFTER_DAYS days.
+
+        @rtype: dict
+        @return: mapping of bucket id to a list of {"begin", "count"} dicts, ordered
+                 by begin. Periods without entries are left out.
+        """
+        resolution = self.request.query_params.get("resolution", "hour")
+        since = timezone.now() - timedelta(
+            days=getattr(django_settings, "CLEANUP_REPORTS_AFTER_DAYS", 14)
+        )
+        if resolution == "hour":
+            hits = BucketHit.objects.filter(begin__gte=BucketHit.get_begin(since))
+        elif resolution in BucketHitRollup.RESOLUTIONS:
+            hits = BucketHitRollup.objects.filter(
+                resolution=resolution,
+                begin__gte=BucketHitRollup.get_begin(since, resolution),
+            )
+        else:
+            raise InvalidArgumentException(f"invalid resolution: {resolution}")
+
+        history = {}
+        for bucket_id, begin, count in (
+            hits.filter(bucket_id__in=bucket_ids, count__gt=0)
+            .order_by("begin")
+            .values_list("bucket_id", "begin", "count")
+        ):
+            history.setdefault(bucket_id, []).append({"begin": begin, "count": count})
+        return history
+
     def list(self, request, *args, **kwargs):
         response = super().list(request, *args, **kwargs)
 
         if self.vue and response.status_code == 200:
-            hits = (
-                BucketHit.objects.all()
-                .filter(
-                    begin__gte=timezone.now()
-                    - timedelta(
-                        days=getattr(django_settings, "CLEANUP_REPORTS_AFTER_DAYS", 14)
-                    ),
-                    bucket_id__in=[bucket["id"] for bucket in response.data["results"]],
-                )
-                .order_by("begin")
+            history = self.get_report_history(
+                [bucket["id"] for bucket in response.data["results"]]
             )
-
-            bucket_hits = {}
-            for bucket, begin, num in hits.values_list("bucket_id", "begin", "count"):
-                bucket_hits.setdefault(bucket, {})
-                bucket_hits[bucket].setdefault(begin, 0)
-                bucket_hits[bucket][begin] += num
-
             for bucket in response.data["results"]:
-                bucket["report_history"] = [
-                    {"begin": begin, "count": num}
-                    for begin, num in bucket_hits.get(bucket["id"], {}).items()
-                ]
+                bucket["report_history"] = history.get(bucket["id"], [])
 
         return response
 
@@ -850,19 +868,9 @@ class BucketViewSet(
         response = Response(serializer.data)
 
         if self.vue and response.status_code == 200:
-            hits = (
-                BucketHit.objects.all()
-                .filter(
-                    begin__gte=timezone.now()
-                    - timedelta(
-                        days=getattr(django_settings, "CLEANUP_REPORTS_AFTER_DAYS", 14)
-                    ),
-                    bucket_id=response.data["id"],
-                )
-                .order_by("begin")
-            )
-
-            response.data["report_history"] = list(hits.values("begin", "count"))
+            response.data["report_history"] = self.get_report_history(
+                [response.data["id"]]
+            ).get(response.data["id"], [])
 
         return response
 
@@ -1221,45 +1229,6 @@ class InboxView(TemplateView):
     template_name = "inbox.html"
 
 
-class _FreqCount:
-    def __init__(self):
-        self.hour = 0
-        self.day = 0
-        self.week = 0
-        self.month = 0
-        self.bucket_hour = {}
-        self.bucket_day = {}
-        self.bucket_week = {}
-        self.bucket_month = {}
-
-    def add_hour(self, bucket):
-        self.hour += 1
-        if bucket is not None:
-            self.bucket_hour.setdefault(bucket, 0)
-            self.bucket_hour[bucket] += 1
-        self.add_day(bucket)
-
-    def add_day(self, bucket):
-        self.day += 1
-        if bucket is not None:
-            self.bucket_day.setdefault(bucket, 0)
-            self.bucket_day[bucket] += 1
-        self.add_week(bucket)
-
-    def add_week(self, bucket):
-        self.week += 1
-        if bucket is not None:
-            self.bucket_week.setdefault(bucket, 0)
-            self.bucket_week[bucket] += 1
-        self.add_month(bucket)
-
-    def add_month(self, bucket):
-        self.month += 1
-        if bucket is not None:
-            self.bucket_month.setdefault(bucket, 0)
-            self.bucket_month[bucket] += 1
-
-
 class ReportStatsViewSet(viewsets.GenericViewSet):
     """
     API endpoint that allows retrieving ReportManager statistics
@@ -1270,78 +1239,82 @@ class ReportStatsViewSet(viewsets.GenericViewSet):
     filter_backends = ()
 
     def retrieve(self, request, *_args, **_kwds):
-        LOG.error("in retrieve")
-        entries = self.filter_queryset(self.get_queryset())
+        # the stats are the same for all users, and are invalidated when the
+        # update_report_stats cron task recounts hits
+        stats = cache.get(REPORT_STATS_CACHE_KEY)
+        if stats is None:
+            stats = self.get_stats()
+            cache.set(
+                REPORT_STATS_CACHE_KEY,
+                stats,
+                getattr(django_settings, "REPORT_STATS_CACHE_TIMEOUT", 60),
+            )
+        return Response(stats, status=status.HTTP_200_OK)
 
+    def get_stats(self):
         now = timezone.now()
-        last_day = now - timedelta(days=1)
-        last_week = now - timedelta(days=7)
-        last_month = now - relativedelta(months=1)
-        entries = entries.filter(reported_at__gt=last_month)
-
-        totals = _FreqCount()
-        for reported_at, bucket_id in entries.values_list("reported_at", "bucket_id"):
-            if reported_at > last_day:
-                totals.add_day(bucket_id)
-            elif reported_at > last_week:
-                totals.add_week(bucket_id)
-            else:
-                totals.add_month(bucket_id)
+        # bucket hits are counted per hour, so all periods start on the hour
+        last_day = BucketHit.get_begin(now - timedelta(days=1))
+        last_week = BucketHit.get_begin(now - timedelta(days=7))
+        last_month = BucketHit.get_begin(now - relativedelta(months=1))
+
+        totals = (
+            self.filter_queryset(self.get_queryset())
+            .filter(reported_at__gte=last_month)
+            .aggregate(
+                day=Count("id", filter=Q(reported_at__gte=last_day)),
+                week=Count("id", filter=Q(reported_at__gte=last_week)),
+                month=Count("id"),
+            )
+        )
 
-        # this gives all the bucket ids
-        #   where the bucket is top10 for any period (day, week, month)
-        top10s = (
-            {
-                b_id
-                for b_id, _ in sorted(
-                    totals.bucket_day.items(), key=lambda t: t[1], reverse=True
-                )[:10]
-            }
-            | {
-                b_id
-                for b_id, _ in sorted(
-                    totals.bucket_week.items(), key=lambda t: t[1], reverse=True
-                )[:10]
-            }
-            | {
-                b_id
-                for b_id, _ in sorted(
-                    totals.bucket_month.items(), key=lambda t: t[1], reverse=True
-                )[:10]
-            }
+        # (bucket_id, day, week, month) for each bucket with hits in the last month
+        bucket_counts = list(
+            BucketHit.objects.filter(begin__gte=last_month, count__gt=0)
+            .values("bucket_id")
+            .annotate(
+                day=Coalesce(Sum("count", filter=Q(begin__gte=last_day)), 0),
+                week=Coalesce(Sum("count", filter=Q(begin__gte=last_week)), 0),
+                month=Sum("count"),
+            )
+            .values_list("bucket_id", "day", "week", "month")
         )
 
-        frequent_buckets = {}
-        for b_id in top10s:
-            frequent_buckets[b_id] = [
-                totals.bucket_day.get(b_id, 0),
-                totals.bucket_week.get(b_id, 0),
-                totals.bucket_month[b_id],  # only one that's guaranteed to exist
-            ]
+        # this gives all the bucket ids
+        #   where the bucket is top10 for any period (day, week, month)
+        top10s = set()
+        for column in (1, 2, 3):
+            top10s.update(
+                counts[0]
+                for counts in heapq.nlargest(
+                    10,
+                    (counts for counts in bucket_counts if counts[column]),
+                    key=itemgetter(column),
+                )
+            )
+        frequent_buckets = {
+            counts[0]: list(counts[1:])
+            for counts in bucket_counts
+            if counts[0] in top10s
+        }
 
         n_periods = getattr(django_settings, "REPORT_STATS_MAX_HISTORY_DAYS", 14) * 24
         cur_period = ReportHit.get_period(now)
         periods = [cur_period - timedelta(hours=n) for n in range(n_periods)]
         periods.reverse()
-        hits_per_hour = [0 for _ in periods]
-        hit_idx = 0
-        for hit in ReportHit.objects.filter(
+        hits = Counter()
+        for last_update, count in ReportHit.objects.filter(
             last_update__gt=periods[0] - timedelta(hours=1),
             last_update__lte=periods[-1],
-        ).order_by("last_update"):
-            hit_period = ReportHit.get_period(hit.last_update)
-            hit_idx = periods.index(hit_period, hit_idx)
-            hits_per_hour[hit_idx] += hit.count
-
-        return Response(
-            {
-                # [int, int, int] (day, week, month)
-                "totals": [totals.day, totals.week, totals.month],
-                # { bucket_id: [day, week, month] }
-                # includes the top 10 for each time-frame, which usually overlap
-                "frequent_buckets": frequent_buckets,
-                # [int, ...] hits per hour for last max_history_days
-                "graph_data": hits_per_hour,
-            },
-            status=status.HTTP_200_OK,
-        )
+        ).values_list("last_update", "count"):
+            hits[ReportHit.get_period(last_update)] += count
+
+        return {
+            # [int, int, int] (day, week, month)
+            "totals": [totals["day"], totals["week"], totals["month"]],
+            # { bucket_id: [day, week, month] }
+            # includes the top 10 for each time-frame, which usually overlap
+            "frequent_buckets": frequent_buckets,
+            # [int, ...] hits per hour for last max_history_days
+            "graph_data": [hits[period] for period in periods],
+        }
@@ -213,7 +213,7 @@ STATICFILES_DIRS = [BASE_DIR / "frontend/dist"]
 
 REST_FRAMEWORK = {
     "DEFAULT_PERMISSION_CLASSES": ("server.auth.CheckAppPermission",),
-    "DEFAULT_PAGINATION_CLASS": "rest_framework.pagination.LimitOffsetPagination",
+    "DEFAULT_PAGINATION_CLASS": "reportmanager.pagination.KeysetPagination",
     "PAGE_SIZE": 100,
 }
 
@@ -274,11 +274,45 @@ CSRF_TRUSTED_ORIGINS = ["http://localhost:8000", "http://127.0.0.1:8000"]
 # BUGZILLA_PASSWORD = "secret"
 # CLEANUP_REPORTS_AFTER_DAYS = 14
 # CLEANUP_FIXED_BUCKETS_AFTER_DAYS = 3
+# Maximum number of parsed bucket signatures kept in memory by each process
+# SIGNATURE_CACHE_SIZE = 4096
+# Reorder the symptoms of cached signatures by how many reports they reject, and
+# record per-symptom statistics (see `triage_new_reports --symptom-stats`)
+# ADAPTIVE_SYMPTOM_ORDER = False
+# Number of worker processes used to match entries when reassigning buckets,
+# and the minimum number of entries for which the process pool is used
+# REASSIGN_WORKERS = 4
+# REASSIGN_PARALLEL_THRESHOLD = 5000
+# Maximum number of cached App, OS and BreakageCategory ids per process (each)
+# DIMENSION_CACHE_SIZE = 1024
+# Number of sampled entries kept per bucket, to check whether a proposed signature
+# also matches other buckets
+# BUCKET_REPRESENTATIVES = 5
+# Seconds for which the total count of cursor paginated API results is cached
+# PAGINATION_COUNT_CACHE_TIMEOUT = 60
+# Seconds for which the report statistics are cached (they are also invalidated
+# by the update_report_stats task, if the cache is shared, see CACHES below)
+# REPORT_STATS_CACHE_TIMEOUT = 60
+# Partition the ReportEntry table by "day" or "week" of reported_at (PostgreSQL and
+# MySQL only). The table must be converted first, see
+# `create_report_partitions --conversion-sql`.
+# REPORT_PARTITION_INTERVAL = None
 ALLOW_EMAIL_EDITION = True
 
 # Redis configuration
 REDIS_URL = "redis://localhost:6379?db=0"  # unix sockets, use unix:///path/to/sock?db=0
 
+# Cache configuration
+# The default cache is local to each process. With several web processes (or
+# celery workers), a shared cache is required, so the report statistics are
+# invalidated everywhere by the update_report_stats task.
+# CACHES = {
+#     "default": {
+#         "BACKEND": "django.core.cache.backends.redis.RedisCache",
+#         "LOCATION": REDIS_URL,
+#     }
+# }
+
 # Celery configuration
 USE_CELERY = True
 CELERY_ACCEPT_CONTENT = ["json", "pickle"]
@@ -311,6 +345,14 @@ CELERY_BEAT_SCHEDULE = {
         "task": "reportmanager.cron.unhide_buckets",
         "schedule": 60,
     },
+    "Refresh bucket representatives every 10 minutes": {
+        "task": "reportmanager.cron.refresh_bucket_representatives",
+        "schedule": 10 * 60,
+    },
+    "Create ReportEntry partitions every day": {
+        "task": "reportmanager.cron.create_report_partitions",
+        "schedule": 24 * 60 * 60,
+    },
 }
 
 # Email
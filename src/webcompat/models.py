@@ -7,18 +7,22 @@ import difflib
 import json
 from dataclasses import dataclass, field
 from datetime import datetime, timezone
+from functools import cached_property
 from logging import getLogger
 from pathlib import Path
+from time import perf_counter
 from typing import TYPE_CHECKING, Any
 from urllib.parse import SplitResult, urlsplit
 
 from dateutil.parser import isoparse
 from jsonschema import Draft202012Validator as Validator
 
-from .symptoms import Symptom
+from .symptoms import NullMatcher, Symptom, ValueMatcher, get_url_part
 
 if TYPE_CHECKING:
-    from collections.abc import Iterable
+    from collections.abc import Iterable, Iterator
+
+    from .symptoms import Matcher
 
 LOG = getLogger(__file__)
 
@@ -65,6 +69,11 @@ class Report:
         result["url"] = urlsplit(result["url"])
         return cls(**result)
 
+    @cached_property
+    def details_json(self) -> str:
+        """details serialized as JSON (cached, details must not be modified)"""
+        return json.dumps(self.details)
+
     def create_signature(self) -> Signature:
         """Create a default signature"""
         return Signature(
@@ -78,6 +87,216 @@ class Report:
         )
 
 
+class LazyReport:
+    """Report with the attributes of `Report`, which converts url, details and
+    reported_at from their serialized form on first access.
+
+    Arguments are the fields of `Report`, where url may be a string and
+    reported_at an ISO 8601 string, or `details_text` may be given instead of
+    details, to decode it on first access. Fields which are not given are not set,
+    so a report can be created with only the fields used by a signature (see
+    `Signature.report_fields`).
+    """
+
+    __slots__ = (
+        "_details",
+        "_details_json",
+        "_details_text",
+        "_reported_at",
+        "_url",
+        "app_channel",
+        "app_name",
+        "app_version",
+        "breakage_category",
+        "comments",
+        "comments_original_language",
+        "comments_translated",
+        "ml_valid_probability",
+        "os",
+        "uuid",
+    )
+
+    _details: dict[str, dict[str, Any]]
+    _details_json: str
+    _details_text: str
+    _reported_at: datetime | str
+    _url: SplitResult | str
+    app_channel: str | None
+    app_name: str
+    app_version: str
+    breakage_category: str | None
+    comments: str
+    comments_original_language: str | None
+    comments_translated: str | None
+    ml_valid_probability: float | None
+    os: str
+    uuid: str
+
+    LAZY_FIELDS = frozenset(("details", "details_text", "reported_at", "url"))
+
+    def __init__(self, **fields: Any) -> None:
+        for name, value in fields.items():
+            if name in self.LAZY_FIELDS:
+                name = f"_{name}"
+            setattr(self, name, value)
+
+    @classmethod
+    def load(cls, data: str) -> LazyReport:
+        """Same as `Report.load()`, without converting any field yet"""
+        result = json.loads(data)
+        result["details_text"] = result.pop("details")
+        return cls(**result)
+
+    @property
+    def url(self) -> SplitResult:
+        url = self._url
+        if isinstance(url, str):
+            url = self._url = urlsplit(url)
+        return url
+
+    @property
+    def reported_at(self) -> datetime:
+        reported_at = self._reported_at
+        if isinstance(reported_at, str):
+            reported_at = self._reported_at = isoparse(reported_at).replace(
+                tzinfo=timezone.utc
+            )
+        return reported_at
+
+    @property
+    def details(self) -> dict[str, dict[str, Any]]:
+        try:
+            return self._details
+        except AttributeError:
+            self._details = json.loads(self._details_text)
+            del self._details_text
+            return self._details
+
+    @property
+    def details_json(self) -> str:
+        """details serialized as JSON (cached, details must not be modified)"""
+        try:
+            return self._details_json
+        except AttributeError:
+            self._details_json = json.dumps(self.details)
+            return self._details_json
+
+    def __repr__(self) -> str:
+        # same as the dataclass repr of Report, without the fields which aren't set
+        values = []
+        for name in Report.__dataclass_fields__:
+            try:
+                value = getattr(self, name)
+            except AttributeError:
+                continue
+            values.append(f"{name}={value!r}")
+        return f"{type(self).__name__}({', '.join(values)})"
+
+    create_signature = Report.create_signature
+
+
+class ReportColumn:
+    """Values of one field for all reports of a ReportBatch.
+
+    Rows are grouped by distinct value, so a matcher can be evaluated once per
+    distinct value instead of once per report.
+    """
+
+    def __init__(self, values: list[Any]) -> None:
+        self.values = values
+        self._distinct: dict[Any, list[int]] | None = None
+        self._masks: dict[Any, int] = {}
+
+    @property
+    def distinct(self) -> dict[Any, list[int]]:
+        """Mapping of each distinct value to the rows having it"""
+        if self._distinct is None:
+            self._distinct = {}
+            for row, value in enumerate(self.values):
+                self._distinct.setdefault(value, []).append(row)
+        return self._distinct
+
+    def rows_mask(self, value: Any) -> int:
+        """Return the bitmask of rows having the given value"""
+        rows_mask = self._masks.get(value)
+        if rows_mask is None:
+            rows_mask = 0
+            for row in self.distinct.get(value, ()):
+                rows_mask |= 1 << row
+            self._masks[value] = rows_mask
+        return rows_mask
+
+    def match(self, matcher: Matcher, mask: int) -> int:
+        """Return the rows in mask with a value matched by matcher"""
+        if isinstance(matcher, NullMatcher):
+            return self.rows_mask(None) & mask
+        if isinstance(matcher, ValueMatcher):
+            return self.rows_mask(matcher.value) & mask
+        result = 0
+        if len(self.distinct) <= mask.bit_count():
+            for value in self.distinct:
+                if matcher.matches(value):
+                    result |= self.rows_mask(value)
+            return result & mask
+        for row in ReportBatch.iter_rows(mask):
+            if matcher.matches(self.values[row]):
+                result |= 1 << row
+        return result
+
+
+class ReportBatch:
+    """Many reports stored column-wise, to be matched against signatures at once
+    (see `Signature.match_batch()`).
+
+    Sets of rows are represented by int bitmasks, where bit N is set for row N.
+    Columns are created on first use. Bitmask operations are linear in the number of
+    rows, so batches should be kept to a few thousand reports.
+    """
+
+    def __init__(self, reports: Iterable[Report]) -> None:
+        self.reports = list(reports)
+        self._columns: dict[tuple[str, str | None], ReportColumn] = {}
+
+    def __len__(self) -> int:
+        return len(self.reports)
+
+    @property
+    def all(self) -> int:
+        """Bitmask of all rows"""
+        return (1 << len(self.reports)) - 1
+
+    @staticmethod
+    def iter_rows(mask: int) -> Iterator[int]:
+        """Iterate over the rows set in mask, in order"""
+        bits = bin(mask)[:1:-1]
+        row = bits.find("1")
+        while row != -1:
+            yield row
+            row = bits.find("1", row + 1)
+
+    def select(self, mask: int) -> list[Report]:
+        """Return the reports of the rows set in mask"""
+        return [self.reports[row] for row in self.iter_rows(mask)]
+
+    def attr_column(self, attr: str) -> ReportColumn:
+        """Return the column for the given Report attribute"""
+        key = ("attr", attr)
+        if key not in self._columns:
+            self._columns[key] = ReportColumn(
+                [getattr(report, attr) for report in self.reports]
+            )
+        return self._columns[key]
+
+    def url_column(self, part: str | None) -> ReportColumn:
+        """Return the column for the given URL part (or the whole URL if None)"""
+        key = ("url", part)
+        if key not in self._columns:
+            self._columns[key] = ReportColumn(
+                [get_url_part(report.url, part) for report in self.reports]
+            )
+        return self._columns[key]
+
+
 @dataclass
 class _DiffResult:
     offending: bool
@@ -110,7 +329,16 @@ class Signature:
         return cls(raw_signature=data)
 
     def __str__(self) -> str:
-        return json.dumps({"symptoms": self.symptoms}, indent=2, sort_keys=True)
+        return json.dumps(
+            {"symptoms": [symptom.json_obj for symptom in self.symptoms]},
+            indent=2,
+            sort_keys=True,
+        )
+
+    @property
+    def report_fields(self) -> set[str]:
+        """Names of the Report attributes used by the symptoms of this signature"""
+        return {symptom.report_field for symptom in self.symptoms}
 
     def matches(self, report: Report) -> bool:
         """
@@ -124,6 +352,28 @@ class Signature:
         """
         return all(symptom.matches(report) for symptom in self.symptoms)
 
+    def match_batch(self, batch: ReportBatch, mask: int | None = None) -> int:
+        """
+        Match this signature against many reports at once
+
+        @type batch: ReportBatch
+        @param batch: The reports to match the signature against
+
+        @type mask: int
+        @param mask: Bitmask of the rows in batch to match (default: all rows)
+
+        @rtype: int
+        @return: Bitmask of the rows which match the signature
+        """
+        if mask is None:
+            mask = batch.all
+        # symptoms are ordered by cost, so expensive ones only see the rows left
+        for symptom in self.symptoms:
+            if not mask:
+                break
+            mask = symptom.match_batch(batch, mask)
+        return mask
+
     def get_distance(self, report: Report) -> int:
         distance = 0
 
@@ -182,3 +432,96 @@ class Signature:
             diff_tuples.append((diff_line[0], diff_line[1:]))
 
         return diff_tuples
+
+
+@dataclass
+class SymptomStats:
+    """Evaluation statistics of one symptom of an AdaptiveSignature"""
+
+    evaluated: int = 0
+    rejected: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def cost(self) -> float:
+        """Time spent per rejected report (infinite if it never rejected one)"""
+        if not self.rejected:
+            return float("inf")
+        return self.elapsed / self.rejected
+
+
+class AdaptiveSignature(Signature):
+    """Signature which reorders its symptoms by observed selectivity.
+
+    The number of reports each symptom is evaluated for, how many it rejects and
+    the time spent evaluating it are recorded. Every REORDER_INTERVAL reports, the
+    symptoms are reordered by time spent per rejected report, so cheap symptoms
+    which reject most reports are evaluated first. Until then, the static order
+    of `Symptom.order()` is used.
+
+    `symptoms` keeps the static order. Statistics are not locked, so counts may be
+    slightly off if the signature is shared between threads.
+    """
+
+    REORDER_INTERVAL = 1000
+
+    def __post_init__(self) -> None:
+        super().__post_init__()
+        # evaluation order, replaced (never modified) when reordered
+        self._evaluation = [(symptom, SymptomStats()) for symptom in self.symptoms]
+        self._since_reorder = 0
+
+    def _evaluated(self, count: int) -> None:
+        self._since_reorder += count
+        if self._since_reorder >= self.REORDER_INTERVAL:
+            self._since_reorder = 0
+            self.reorder()
+
+    def reorder(self) -> None:
+        """Reorder the symptoms by the statistics recorded so far"""
+        self._evaluation = sorted(
+            self._evaluation,
+            key=lambda entry: (entry[1].cost, Symptom.order(entry[0])),
+        )
+
+    def matches(self, report: Report) -> bool:
+        result = True
+        for symptom, stats in self._evaluation:
+            start = perf_counter()
+            matched = symptom.matches(report)
+            stats.elapsed += perf_counter() - start
+            stats.evaluated += 1
+            if not matched:
+                stats.rejected += 1
+                result = False
+                break
+        self._evaluated(1)
+        return result
+
+    def match_batch(self, batch: ReportBatch, mask: int | None = None) -> int:
+        if mask is None:
+            mask = batch.all
+        self._evaluated(mask.bit_count())
+        for symptom, stats in self._evaluation:
+            if not mask:
+                break
+            start = perf_counter()
+            matched = symptom.match_batch(batch, mask)
+            stats.elapsed += perf_counter() - start
+            evaluated = mask.bit_count()
+            stats.evaluated += evaluated
+            stats.rejected += evaluated - matched.bit_count()
+            mask = matched
+        return mask
+
+    def get_stats(self) -> list[dict[str, Any]]:
+        """Return the statistics of each symptom, in evaluation order"""
+        return [
+            {
+                "symptom": symptom.json_obj,
+                "evaluated": stats.evaluated,
+                "rejected": stats.rejected,
+                "elapsed": stats.elapsed,
+            }
+            for symptom, stats in self._evaluation
+        ]
@@ -7,17 +7,30 @@ import inspect
 import json
 import re
 import sys
+import warnings
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
 from datetime import datetime, timezone
+from functools import partial
 from logging import getLogger
 from typing import TYPE_CHECKING, Any
 
 from dateutil.parser import isoparse
 from jsonpath_ng import parse as jsonpath  # type: ignore[import-untyped]
+from jsonpath_ng.jsonpath import (  # type: ignore[import-untyped]
+    Child,
+    Fields,
+    Index,
+    Root,
+    Slice,
+    This,
+)
 
 if TYPE_CHECKING:
-    from .models import Report
+    from collections.abc import Callable, Hashable, Iterable, Sequence
+    from urllib.parse import SplitResult
+
+    from .models import Report, ReportBatch
 
 LOG = getLogger(__file__)
 
@@ -36,6 +49,11 @@ class Symptom(ABC):
     def __str__(self):
         return json.dumps(self.json_obj, indent=2)
 
+    @property
+    @abstractmethod
+    def report_field(self) -> str:
+        """Name of the Report attribute matched by this symptom"""
+
     @staticmethod
     def order(symptom: Symptom) -> int:
         """Estimate a complexity for Symptoms.
@@ -88,6 +106,25 @@ class Symptom(ABC):
         @return: True if the symptom matches, False otherwise
         """
 
+    def match_batch(self, batch: ReportBatch, mask: int) -> int:
+        """
+        Check which reports of a batch the symptom matches
+
+        @type batch: ReportBatch
+        @param batch: The reports to check against
+
+        @type mask: int
+        @param mask: Bitmask of the rows in batch to check
+
+        @rtype: int
+        @return: Bitmask of the rows in mask which match
+        """
+        result = 0
+        for row in batch.iter_rows(mask):
+            if self.matches(batch.reports[row]):
+                result |= 1 << row
+        return result
+
 
 class Matcher(ABC):
     ORDER: int
@@ -133,6 +170,77 @@ class PatternMatcher(Matcher):
         return self.pattern.match(value) is not None
 
 
+class MultiPatternMatcher:
+    """Match a value against many patterns at once.
+
+    Patterns are combined into one regex made of an optional lookahead per pattern,
+    each capturing into its own group. A single `re.match` then tells which patterns
+    match at the start of the value, which is the same test as PatternMatcher.
+    Patterns that would behave differently when combined (backreferences, named
+    groups, conditionals, global flags) or fail to compile are matched separately.
+    """
+
+    # maximum number of patterns per combined regex
+    BLOCK_SIZE = 100
+
+    # constructs which depend on the group numbering or position of the pattern
+    UNCOMBINABLE_RE = re.compile(r"\\[1-9]|\(\?P[<=]|\(\?\(|\(\?[aiLmsux]+\)")
+
+    def __init__(self, patterns: Iterable[tuple[Hashable, str]]) -> None:
+        """
+        @type patterns: iterable
+        @param patterns: (key, pattern) pairs, keys are returned by matches()
+        """
+        self._combined: list[tuple[re.Pattern[str], list[tuple[int, Hashable]]]] = []
+        self._separate: list[tuple[Hashable, re.Pattern[str]]] = []
+
+        combinable = []
+        for key, pattern in patterns:
+            if self.UNCOMBINABLE_RE.search(pattern):
+                self._separate.append((key, re.compile(pattern)))
+            else:
+                combinable.append((key, pattern))
+
+        for start in range(0, len(combinable), self.BLOCK_SIZE):
+            self._add_block(combinable[start : start + self.BLOCK_SIZE])
+
+    def _add_block(self, block: list[tuple[Hashable, str]]) -> None:
+        combined = "".join(
+            f"(?:(?=(?P<p{idx}>{pattern})))?" for idx, (_, pattern) in enumerate(block)
+        )
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter("error")
+                regex = re.compile(combined)
+        except (re.error, DeprecationWarning, RecursionError):
+            if len(block) == 1:
+                key, pattern = block[0]
+                self._separate.append((key, re.compile(pattern)))
+            else:
+                # find the offending patterns
+                half = len(block) // 2
+                self._add_block(block[:half])
+                self._add_block(block[half:])
+            return
+        groups = [
+            (regex.groupindex[f"p{idx}"] - 1, key) for idx, (key, _) in enumerate(block)
+        ]
+        self._combined.append((regex, groups))
+
+    def matches(self, value: str | None) -> set[Hashable]:
+        """Return the keys of all patterns matching the given value"""
+        result: set[Hashable] = set()
+        if value is None:
+            return result
+        for regex, groups in self._combined:
+            captured = regex.match(value).groups()  # type: ignore[union-attr]
+            result.update(key for idx, key in groups if captured[idx] is not None)
+        for key, pattern in self._separate:
+            if pattern.match(value) is not None:
+                result.add(key)
+        return result
+
+
 class TimeMatcher(Matcher):
     ORDER = 0
 
@@ -186,12 +294,30 @@ class StringPropertySymptom(Symptom):
         self.attr = obj["type"]
         self.matcher = Matcher.create(obj)
 
+    @property
+    def report_field(self) -> str:
+        return self.attr
+
     def matches(self, report) -> bool:
         return self.matcher.matches(getattr(report, self.attr))
 
+    def match_batch(self, batch: ReportBatch, mask: int) -> int:
+        return batch.attr_column(self.attr).match(self.matcher, mask)
+
+
+def get_url_part(url: SplitResult, part: str | None) -> str | None:
+    """Return the given part of url as a string (or the whole url if part is None)"""
+    if part is None:
+        return url.geturl()
+    value = getattr(url, part)
+    if value is not None:
+        value = str(value)
+    return value
+
 
 class URLSymptom(Symptom):
     ORDER = 1
+    report_field = "url"
 
     def __init__(self, obj: dict[str, Any]) -> None:
         super().__init__(obj)
@@ -200,19 +326,20 @@ class URLSymptom(Symptom):
 
     def matches(self, report: Report) -> bool:
         LOG.debug("url: %r", report.url)
+        value = get_url_part(report.url, self.part)
         if self.part is None:
-            value = report.url.geturl()
             LOG.debug("matching against whole url: %s", value)
         else:
-            value = getattr(report.url, self.part)
-            if value is not None:
-                value = str(value)
             LOG.debug("matching against url part %s: %s", self.part, value)
         return self.matcher.matches(value)
 
+    def match_batch(self, batch: ReportBatch, mask: int) -> int:
+        return batch.url_column(self.part).match(self.matcher, mask)
+
 
 class ReportedAtSymptom(Symptom):
     ORDER = 2
+    report_field = "reported_at"
 
     def __init__(self, obj: dict[str, Any]) -> None:
         super().__init__(obj)
@@ -221,24 +348,154 @@ class ReportedAtSymptom(Symptom):
     def matches(self, report: Report) -> bool:
         return self.matcher.matches(report.reported_at)  # type: ignore[arg-type]
 
+    def match_batch(self, batch: ReportBatch, mask: int) -> int:
+        return batch.attr_column("reported_at").match(self.matcher, mask)
+
+
+def _jsonpath_steps(expr: Any, leftmost: bool = True) -> list[tuple[str, Any]] | None:
+    """Flatten a parsed JSONPath expression into a list of (kind, argument) steps.
+
+    Returns None if the expression uses anything but fields, non-negative indices
+    and `[*]`.
+    """
+    if isinstance(expr, Child):
+        left = _jsonpath_steps(expr.left, leftmost)
+        right = _jsonpath_steps(expr.right, False)
+        if left is None or right is None:
+            return None
+        return left + right
+    if isinstance(expr, Root | This):
+        return [] if leftmost else None
+    if isinstance(expr, Fields):
+        if "*" in expr.fields:
+            return [("values", None)]
+        if len(expr.fields) == 1:
+            return [("key", expr.fields[0])]
+        return [("keys", expr.fields)]
+    if isinstance(expr, Index):
+        # older jsonpath_ng versions support a single index only
+        indices = getattr(expr, "indices", None) or (getattr(expr, "index"),)
+        if all(isinstance(index, int) and index >= 0 for index in indices):
+            return [("indices", indices)]
+        return None
+    if (
+        isinstance(expr, Slice)
+        and expr.start is None
+        and expr.end is None
+        and expr.step is None
+    ):
+        return [("all", None)]
+    return None
+
+
+# the compiled steps are module level functions bound with partial(), so that
+# signatures stay picklable (see reportmanager.reassign)
+
+
+def _step_key(key: Any, value: Any) -> Sequence[Any]:
+    if isinstance(value, dict) and key in value:
+        return (value[key],)
+    return ()
+
+
+def _step_keys(keys: Sequence[Any], value: Any) -> Sequence[Any]:
+    if isinstance(value, dict):
+        return [value[key] for key in keys if key in value]
+    return ()
+
+
+def _step_values(_: Any, value: Any) -> Sequence[Any]:
+    if isinstance(value, dict):
+        return list(value.values())
+    return ()
+
+
+def _step_indices(indices: Sequence[int], value: Any) -> Sequence[Any]:
+    if isinstance(value, list | str):
+        return [value[index] for index in indices if index < len(value)]
+    return ()
+
+
+def _step_all(_: Any, value: Any) -> Sequence[Any]:
+    # jsonpath_ng treats anything but a list as a list of one item
+    if value is None:
+        return ()
+    if isinstance(value, list):
+        return value
+    return (value,)
+
+
+# each step behaves like find() of the jsonpath_ng class it replaces
+_JSONPATH_STEPS: dict[str, Callable[[Any, Any], Sequence[Any]]] = {
+    "key": _step_key,
+    "keys": _step_keys,
+    "values": _step_values,
+    "indices": _step_indices,
+    "all": _step_all,
+}
+
+
+def _find_jsonpath(expr: Any, data: Any) -> Sequence[Any]:
+    try:
+        return [match.value for match in expr.find(data)]
+    except TypeError:
+        # jsonpath_ng fails to index numbers, the compiled steps find nothing
+        return ()
+
+
+def _get_key_path(keys: Sequence[Any], data: Any) -> Sequence[Any]:
+    for key in keys:
+        if not isinstance(data, dict) or key not in data:
+            return ()
+        data = data[key]
+    return (data,)
+
+
+def _get_path(
+    funcs: Sequence[Callable[[Any], Sequence[Any]]], data: Any
+) -> Sequence[Any]:
+    values: Sequence[Any] = (data,)
+    for func in funcs:
+        values = [result for value in values for result in func(value)]
+    return values
+
+
+def compile_jsonpath(expr: Any) -> Callable[[Any], Sequence[Any]]:
+    """Compile a parsed JSONPath expression into a function returning the values
+    it finds in a JSON document.
+
+    Paths made of fields, fixed indices and `[*]` are evaluated directly, anything
+    else by jsonpath_ng. The returned function can be pickled.
+    """
+    steps = _jsonpath_steps(expr)
+    if steps is None:
+        return partial(_find_jsonpath, expr)
+    if all(kind == "key" for kind, _ in steps):
+        return partial(_get_key_path, [arg for _, arg in steps])
+    return partial(
+        _get_path, [partial(_JSONPATH_STEPS[kind], arg) for kind, arg in steps]
+    )
+
 
 class DetailsSymptom(Symptom):
     ORDER = 3
+    report_field = "details"
 
     def __init__(self, obj: dict[str, Any]) -> None:
         super().__init__(obj)
         if "path" in obj:
             self.path = jsonpath(obj["path"])
+            self.find = compile_jsonpath(self.path)
         else:
             self.path = None
         self.matcher = Matcher.create(obj)
 
     def matches(self, report: Report) -> bool:
         if self.path is None:
-            return self.matcher.matches(json.dumps(report.details))
+            return self.matcher.matches(report.details_json)
         # iterate over the jsonpath values
         return any(
-            self.matcher.matches(value.value)
-            for value in self.path.find(report.details)
-            if value.value is None or isinstance(value.value, bool | float | int | str)
+            self.matcher.matches(value)
+            for value in self.find(report.details)
+            if value is None or isinstance(value, bool | float | int | str)
         )
@@ -1,11 +1,21 @@
 import json
+import pickle
+from datetime import datetime, timezone
 from urllib.parse import urlsplit
 
 import pytest
+from jsonpath_ng import parse as jsonpath
 
-from webcompat.models import Report, Signature
+from webcompat.models import (
+    AdaptiveSignature,
+    LazyReport,
+    Report,
+    ReportBatch,
+    Signature,
+)
 from webcompat.symptoms import (
     DetailsSymptom,
+    MultiPatternMatcher,
     NullMatcher,
     PatternMatcher,
     ReportedAtSymptom,
@@ -14,6 +24,7 @@ from webcompat.symptoms import (
     TimeRangeMatcher,
     URLSymptom,
     ValueMatcher,
+    compile_jsonpath,
 )
 
 
@@ -376,3 +387,313 @@ def test_signature_08():
     assert isinstance(sig.symptoms[9].matcher, ValueMatcher)
     assert isinstance(sig.symptoms[10], DetailsSymptom)
     assert isinstance(sig.symptoms[10].matcher, PatternMatcher)
+
+
+@pytest.mark.parametrize(
+    "symptoms",
+    (
+        '{"type": "app_channel", "value": null}',
+        '{"type": "app_name", "value": "N1"}',
+        '{"type": "os", "pattern": "S[12]"}',
+        '{"type": "url", "part": "hostname", "value": "h1"}',
+        '{"type": "url", "part": "port", "value": "8080"}',
+        '{"type": "url", "pattern": ".*/p1"}',
+        '{"type": "comments", "pattern": "R"}',
+        '{"type": "reported_at", "after": "1999-01-01T12:00:00"}',
+        '{"type": "details", "path": "$.bi.env", "value": "var1"}',
+        '{"type": "app_name", "value": "N1"}, {"type": "comments", "pattern": "R.*1"}',
+    ),
+)
+def test_signature_09(symptoms):
+    """test batch matching is the same as matching each report"""
+    reports = [
+        Report.load(
+            json.dumps(
+                {
+                    "app_channel": None if i % 3 else "C",
+                    "app_name": f"N{i % 2}",
+                    "app_version": "V",
+                    "breakage_category": "B",
+                    "comments": f"R{i}",
+                    "details": json.dumps({"bi": {"env": f"var{i % 4}"}}),
+                    "os": f"S{i % 5}",
+                    "reported_at": f"1999-01-01T{i % 24:02d}:00:00",
+                    "url": f"s://h{i % 3}{':8080' if i % 2 else ''}/p{i % 4}",
+                    "uuid": f"U{i}",
+                }
+            )
+        )
+        for i in range(40)
+    ]
+    signature = Signature(f'{{"symptoms": [{symptoms}]}}')
+    batch = ReportBatch(reports)
+    expected = [signature.matches(report) for report in reports]
+    assert any(expected)
+    matched = signature.match_batch(batch)
+    assert [bool(matched >> row & 1) for row in range(len(reports))] == expected
+    assert batch.select(matched) == [r for r, m in zip(reports, expected) if m]
+    # only rows in the given mask are matched
+    assert signature.match_batch(batch, 0b1010) == matched & 0b1010
+
+
+@pytest.mark.parametrize("block_size", (1, 3, 100))
+def test_multi_pattern_01(block_size, monkeypatch):
+    """test matching many patterns at once is the same as matching each"""
+    monkeypatch.setattr(MultiPatternMatcher, "BLOCK_SIZE", block_size)
+    patterns = [
+        "ab",
+        "a(c|b)",
+        "x*",
+        "z",
+        "(a)\\1",
+        "(?P<n>b)",
+        "(?i)AB",
+        "(?i:AB)c",
+        ".*c$",
+        "",
+        "a|z",
+    ]
+    matcher = MultiPatternMatcher(enumerate(patterns))
+    for value in ("abc", "aa", "ABc", "", "zz", None):
+        expected = {
+            idx
+            for idx, pattern in enumerate(patterns)
+            if PatternMatcher(pattern).matches(value)
+        }
+        assert matcher.matches(value) == expected
+
+
+@pytest.mark.parametrize(
+    "path",
+    (
+        "$",
+        "a",
+        "$.a",
+        "$.a.b",
+        "$.a[0]",
+        "$.a[1].b",
+        "$.a[*]",
+        "$.a[*].b",
+        "$.a.*",
+        "$.*.b",
+        "$.a.b[0]",
+        "$.*[2]",
+        "$.a[-1]",
+        "$.a[1:]",
+        "$..b",
+    ),
+)
+def test_jsonpath_01(path):
+    """test compiled jsonpaths find the same values as jsonpath_ng"""
+    expr = jsonpath(path)
+    # compiled paths are pickled with signatures sent to worker processes
+    find = pickle.loads(pickle.dumps(compile_jsonpath(expr)))
+    for data in (
+        {},
+        None,
+        "abc",
+        [1, 2],
+        {"a": None},
+        {"a": "xyz"},
+        {"a": 1.5},
+        {"a": {"b": True}},
+        {"a": {"b": [1, None, "x"]}},
+        {"a": [{"b": 1}, {"b": 2}, {"c": 3}, 4]},
+        {"a": [], "c": {"b": "c"}},
+        {"a": [[1, 2, 3], "str", {"b": 1}]},
+        {"b": {"b": 0}, "c": [0, 1, 2, 3]},
+    ):
+        try:
+            expected = [match.value for match in expr.find(data)]
+        except TypeError:
+            # jsonpath_ng fails to index numbers, compiled paths find nothing
+            expected = []
+        assert list(find(data)) == expected, data
+
+
+def test_adaptive_signature_01(monkeypatch):
+    """test adaptive signatures match like signatures, and reorder their symptoms
+    by selectivity
+    """
+    monkeypatch.setattr(AdaptiveSignature, "REORDER_INTERVAL", 10)
+    reports = [
+        Report.load(
+            json.dumps(
+                {
+                    "app_name": "N",
+                    "app_version": "V",
+                    "comments": f"R{i}",
+                    "details": "{}",
+                    "os": "S",
+                    "reported_at": "1999-01-01T00:00:00",
+                    "url": f"s://h{i % 2}/",
+                    "uuid": f"U{i}",
+                }
+            )
+        )
+        for i in range(40)
+    ]
+    # os (static order 0) never rejects, the comments pattern rejects most reports
+    raw = (
+        '{"symptoms": [{"type": "os", "value": "S"},'
+        ' {"type": "comments", "pattern": "R1"},'
+        ' {"type": "url", "part": "hostname", "value": "h1"}]}'
+    )
+    signature = Signature(raw)
+    adaptive = AdaptiveSignature(raw)
+    assert list(map(str, adaptive.symptoms)) == list(map(str, signature.symptoms))
+    assert [s["symptom"]["type"] for s in adaptive.get_stats()] == [
+        "os",
+        "comments",
+        "url",
+    ]
+
+    for report in reports:
+        assert adaptive.matches(report) == signature.matches(report)
+    batch = ReportBatch(reports)
+    assert adaptive.match_batch(batch) == signature.match_batch(batch)
+
+    stats = adaptive.get_stats()
+    assert stats[-1]["symptom"]["type"] == "os"
+    assert stats[-1]["rejected"] == 0
+    assert sum(s["rejected"] for s in stats) == 80 - 2 * sum(
+        signature.matches(report) for report in reports
+    )
+    # symptoms keep the static order
+    assert list(map(str, adaptive.symptoms)) == list(map(str, signature.symptoms))
+
+
+def test_lazy_report_01():
+    """test lazy reports match like reports, and only convert the fields used"""
+    data = [
+        json.dumps(
+            {
+                "app_channel": None if i % 3 else "C",
+                "app_name": f"N{i % 2}",
+                "app_version": "V",
+                "breakage_category": "B",
+                "comments": f"R{i}",
+                "details": json.dumps({"bi": {"env": f"var{i % 4}"}}),
+                "os": f"S{i % 5}",
+                "reported_at": f"1999-01-01T{i % 24:02d}:00:00",
+                "url": f"s://h{i % 3}{':8080' if i % 2 else ''}/p{i % 4}",
+                "uuid": f"U{i}",
+            }
+        )
+        for i in range(20)
+    ]
+    reports = [Report.load(item) for item in data]
+    lazy_reports = [LazyReport.load(item) for item in data]
+    for symptoms in (
+        '{"type": "app_name", "value": "N1"}',
+        '{"type": "url", "part": "hostname", "value": "h1"}',
+        '{"type": "url", "pattern": ".*/p1"}',
+        '{"type": "reported_at", "after": "1999-01-01T12:00:00"}',
+        '{"type": "details", "path": "$.bi.env", "value": "var1"}',
+        '{"type": "details", "pattern": ".*var2"}',
+    ):
+        signature = Signature(f'{{"symptoms": [{symptoms}]}}')
+        assert [signature.matches(report) for report in lazy_reports] == [
+            signature.matches(report) for report in reports
+        ]
+        assert signature.match_batch(ReportBatch(lazy_reports)) == (
+            signature.match_batch(ReportBatch(reports))
+        )
+
+    lazy = LazyReport.load(data[1])
+    signature = Signature('{"symptoms": [{"type": "app_name", "value": "N1"}]}')
+    assert signature.report_fields == {"app_name"}
+    assert signature.matches(lazy)
+    assert isinstance(lazy._url, str)
+    assert isinstance(lazy._reported_at, str)
+    assert not hasattr(lazy, "_details")
+    assert lazy.url == reports[1].url
+    assert lazy.reported_at == reports[1].reported_at
+    assert lazy.details == reports[1].details
+    assert lazy.create_signature().raw_signature == (
+        reports[1].create_signature().raw_signature
+    )
+
+    # only the given fields are set
+    lazy = LazyReport(url="s://h/")
+    assert lazy.url.hostname == "h"
+    with pytest.raises(AttributeError):
+        lazy.comments
+
+
+@pytest.mark.parametrize(
+    "symptoms, fields",
+    (
+        ('{"type": "os", "value": "S"}', {"os"}),
+        ('{"type": "app_name", "value": "N"}', {"app_name"}),
+        (
+            '{"type": "url", "part": "hostname", "value": "h"},'
+            '{"type": "url", "pattern": ".*"},'
+            '{"type": "details", "path": "$.a", "value": "b"}',
+            {"url", "details"},
+        ),
+        (
+            '{"type": "comments", "pattern": "R"},'
+            '{"type": "reported_at", "before": "2000-01-01T00:00:00"}',
+            {"comments", "reported_at"},
+        ),
+    ),
+)
+def test_lazy_report_02(symptoms, fields):
+    """test matching lazy reports with only the fields used by a signature"""
+    data = {
+        "app_channel": "C",
+        "app_name": "N",
+        "app_version": "V",
+        "breakage_category": "B",
+        "comments": "R",
+        "details": json.dumps({"a": "b"}),
+        "os": "S",
+        "reported_at": "1999-01-01T12:00:00",
+        "url": "s://h/p",
+        "uuid": "U",
+    }
+    report = Report.load(json.dumps(data))
+    signature = Signature(f'{{"symptoms": [{symptoms}]}}')
+    assert signature.report_fields == fields
+    assert signature.matches(report)
+
+    data["details_text"] = data.pop("details")
+    lazy = LazyReport(
+        **{
+            name: value
+            for name, value in data.items()
+            if name in fields or (name == "details_text" and "details" in fields)
+        }
+    )
+    assert signature.matches(lazy)
+    assert signature.match_batch(ReportBatch([lazy])) == 1
+    # the repr only has the fields which are set
+    assert repr(lazy) == "LazyReport({})".format(
+        ", ".join(
+            f"{name}={getattr(report, name)!r}"
+            for name in Report.__dataclass_fields__
+            if name in fields
+        )
+    )
+    for name in {"app_name", "comments", "details", "url"} - fields:
+        with pytest.raises(AttributeError):
+            getattr(lazy, name)
+
+
+def test_lazy_report_03():
+    """test that lazy reports with all fields have the repr of reports"""
+    report = Report(
+        app_name="N",
+        app_version="V",
+        comments="R",
+        details={"a": {"b": 1}},
+        os="S",
+        reported_at=datetime(1999, 1, 1, 12, tzinfo=timezone.utc),
+        uuid="U",
+        url=urlsplit("s://h/p"),
+    )
+    lazy = LazyReport(
+        **{name: getattr(report, name) for name in Report.__dataclass_fields__}
+    )
+    assert repr(lazy) == repr(report).replace("Report(", "LazyReport(", 1)